@@ -0,0 +1,134 @@
+"""
+The accessify command.
+
+With no arguments it starts the GUI, or brings the window of an already running instance to the front, refusing if the headless daemon is running instead.  Subcommands such as play, queue and next are forwarded to the running instance over JSON-RPC, which only needs the standard library and ujson, so they return in milliseconds.  wx, pykka and requests are only imported when the full application has to be started, in which case the command is forwarded once it's up.
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+import time
+
+from accessify import config as configuration
+from accessify import constants
+from accessify import ipc
+
+
+# How long to wait for a newly started instance to start serving JSON-RPC
+STARTUP_TIMEOUT = 30
+STARTUP_POLL_INTERVAL = 0.1
+
+
+def create_parser():
+    parser = argparse.ArgumentParser(prog='accessify', description='Accessible control interface for Spotify.  Run without a command to open the main window.')
+    subparsers = parser.add_subparsers(dest='command', metavar='command')
+    play_parser = subparsers.add_parser('play', help='Play a Spotify URI')
+    play_parser.add_argument('uri')
+    play_parser.add_argument('--context', help='URI of the album or playlist to carry on playing from')
+    queue_parser = subparsers.add_parser('queue', help='Add Spotify URIs to the playback queue')
+    queue_parser.add_argument('uris', nargs='+', metavar='uri')
+    import_parser = subparsers.add_parser('import', help='Add the Spotify URIs and links in a file to the playback queue or a playlist')
+    import_parser.add_argument('file', nargs='?', type=argparse.FileType('r', encoding='utf-8'), default='-', help='Defaults to standard input, so a list can be piped in')
+    import_parser.add_argument('--playlist', help='URI of a playlist to add the tracks to instead')
+    subparsers.add_parser('next', help='Skip to the next track')
+    subparsers.add_parser('previous', help='Go back to the previous track')
+    subparsers.add_parser('play-pause', help='Toggle between playing and paused')
+    subparsers.add_parser('now-playing', help='Print the track which is playing')
+    return parser
+
+
+def main(argv=None):
+    arguments = create_parser().parse_args(argv)
+    endpoint_path = ipc.get_endpoint_path(configuration.get_config_directory(), constants.APP_NAME)
+    client = ipc.connect(endpoint_path)
+
+    if arguments.command is None:
+        if client is not None and client.server_info.get('hwnd'):
+            client.close()
+            ipc.focus_window(client.server_info['hwnd'])
+            return 0
+        if client is not None:
+            # The headless daemon, which a second controller would fight over the queue, pending writes and endpoint file
+            client.close()
+            print('{0} is already running without a window.  Stop accessify-daemon first, or use the commands to control it.'.format(constants.APP_NAME), file=sys.stderr)
+            return 1
+        return run_application()
+
+    if client is None:
+        start_application()
+        client = wait_for_instance(endpoint_path)
+        if client is None:
+            print('{0} did not start in time.'.format(constants.APP_NAME), file=sys.stderr)
+            return 1
+
+    with client:
+        try:
+            return run_command(client, arguments)
+        except ipc.RPCError as e:
+            print(e, file=sys.stderr)
+            return 1
+
+
+def run_command(client, arguments):
+    if arguments.command == 'play':
+        client.call('play_uri', uri=arguments.uri, context=arguments.context)
+    elif arguments.command == 'queue':
+        client.call('queue_uris', uris=arguments.uris, timeout=ipc.LONG_CALL_TIMEOUT)
+    elif arguments.command == 'import':
+        with arguments.file:
+            text = arguments.file.read()
+        summary = client.call('import_uris', text=text, playlist=arguments.playlist, timeout=ipc.LONG_CALL_TIMEOUT)
+        print('Imported {0} items at {1:.0f} URIs per second.'.format(summary.get('written', summary['resolved']), summary['uris_per_second']))
+        for label, key in (('Not found', 'unresolved'), ('Not valid', 'rejected'), ('Skipped', 'skipped'), ('Not added', 'failed')):
+            if summary.get(key):
+                print('{0}: {1}'.format(label, ' '.join(summary[key])), file=sys.stderr)
+        if summary['duplicates']:
+            print('{0} duplicates ignored.'.format(summary['duplicates']))
+    elif arguments.command == 'next':
+        client.call('next_track')
+    elif arguments.command == 'previous':
+        client.call('previous_track')
+    elif arguments.command == 'play-pause':
+        client.call('play_pause')
+    elif arguments.command == 'now-playing':
+        track = client.call('current_track')
+        if track is None:
+            print('Nothing is playing.')
+        else:
+            print('{0} by {1}'.format(track['name'], ', '.join(artist['name'] for artist in track['artists'])))
+    return 0
+
+
+def run_application():
+    from accessify import main as application
+    application.main()
+    return 0
+
+
+def start_application():
+    """
+    Start the GUI in a process of its own, which outlives this one.
+    """
+    if getattr(sys, 'frozen', False):
+        command = [sys.executable]
+    else:
+        command = [sys.executable, '-m', 'accessify.main']
+    if os.name == 'nt':
+        subprocess.Popen(command, creationflags=subprocess.DETACHED_PROCESS | subprocess.CREATE_NEW_PROCESS_GROUP, close_fds=True)
+    else:
+        subprocess.Popen(command, start_new_session=True, close_fds=True, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+def wait_for_instance(endpoint_path, timeout=STARTUP_TIMEOUT):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        client = ipc.connect(endpoint_path)
+        if client is not None:
+            return client
+        time.sleep(STARTUP_POLL_INTERVAL)
+    return None
+
+
+if __name__ == '__main__':
+    sys.exit(main())
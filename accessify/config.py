@@ -0,0 +1,84 @@
+"""
+Locating, loading and saving the user's configuration.
+
+Nothing here imports wx, pykka or requests, so it can be used by the headless daemon and the command line as well as the GUI.
+"""
+
+import logging
+import os
+import os.path
+
+from appdirs import user_config_dir
+import ujson as json
+
+from accessify import constants
+from accessify.utils import logs
+
+
+logger = logging.getLogger(__name__)
+
+CONFIG_FILENAME = 'config.json'
+CONFIG_DIRECTORY_VARIABLE = 'ACCESSIFY_CONFIG_DIRECTORY'
+
+
+def get_config_directory():
+    """
+    Return the directory named by ACCESSIFY_CONFIG_DIRECTORY if set, or the user's roaming application data directory otherwise.
+    """
+    return os.environ.get(CONFIG_DIRECTORY_VARIABLE) or user_config_dir(appname=constants.APP_NAME, appauthor=False, roaming=True)
+
+
+def get_config_path(config_directory):
+    return os.path.join(config_directory, CONFIG_FILENAME)
+
+
+def get_credentials():
+    """
+    Return (client_id, client_secret) from the credentials module if there is one, or from the SPOTIFY_CLIENT_ID and SPOTIFY_CLIENT_SECRET environment variables otherwise.
+    """
+    try:
+        from accessify import credentials
+    except ImportError:
+        return os.environ.get('SPOTIFY_CLIENT_ID'), os.environ.get('SPOTIFY_CLIENT_SECRET')
+    return credentials.client_id, credentials.client_secret
+
+
+def load_config(path):
+    logger.info('Attempting to load config from {0}'.format(path))
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            config = json.load(f)
+    except (FileNotFoundError, ValueError):
+        logger.info('Valid existing config not found, creating default')
+        return default_config
+
+    for key in default_config.keys():
+        if key not in config:
+            config.update({key: default_config[key]})
+    return config
+
+
+def save_config(config_dict, path):
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(config_dict, f, indent=4)
+    logger.info('Config saved to {0}'.format(path))
+
+
+default_config = {
+    'spotify_access_token': '',
+    'spotify_refresh_token': '',
+    'spotify_polling_interval': 60,
+    'spotify_idle_polling_interval': 300,
+    'playback_backend': 'web_helper',
+    'library_workers': 3,
+    'prefetch_request_budget': 3,
+    'saved_items_first': True,
+    'write_concurrency': 4,
+    'write_flush_interval': 2,
+    'write_flush_size': 50,
+    'import_concurrency': 4,
+    'log_level': logs.DEFAULT_LOG_LEVEL,
+    'log_levels': {
+        'urllib3': 'WARNING',
+    },
+}
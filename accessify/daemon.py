@@ -0,0 +1,137 @@
+"""
+Runs PlaybackController and LibraryController without a GUI, serving them over JSON-RPC until interrupted or asked to shut down.
+
+Any number of front-ends and scripts can then share one Web API session, access token and Spotify connection.  See accessify.rpc for the protocol.
+"""
+
+import argparse
+import logging
+import os
+import os.path
+import signal
+import sys
+import threading
+
+from accessify import config as configuration
+from accessify import constants
+from accessify import ipc
+from accessify import library
+from accessify import metrics
+from accessify import playback
+from accessify import playback_queue
+from accessify import playlist_cache
+from accessify import prefetch
+from accessify import rpc
+from accessify import spotify
+from accessify import tracing
+from accessify import writes
+from accessify.utils import logs
+
+
+logger = logging.getLogger(__package__)
+
+LOG_FILENAME = 'accessify-daemon.log'
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='accessify-daemon', description='Run {0} without a GUI, controlled over a local JSON-RPC socket.'.format(constants.APP_NAME))
+    parser.add_argument('--port', type=int, default=0, help='Port to listen on, chosen automatically by default')
+    parser.add_argument('--log-to-console', action='store_true', help='Log to standard error as well as the log file')
+    arguments = parser.parse_args(argv)
+
+    config_directory = configuration.get_config_directory()
+    endpoint_path = ipc.get_endpoint_path(config_directory, constants.APP_NAME)
+    existing = ipc.connect(endpoint_path)
+    if existing is not None:
+        existing.close()
+        print('{0} is already running.'.format(constants.APP_NAME))
+        return 1
+
+    log_directory = os.path.join(config_directory, 'logs')
+    os.makedirs(log_directory, exist_ok=True)
+    formatter = logs.create_formatter()
+    handlers = [logs.create_file_handler(log_directory, formatter, filename=LOG_FILENAME)]
+    if arguments.log_to_console:
+        console_handler = logging.StreamHandler()
+        console_handler.setFormatter(formatter)
+        handlers.append(console_handler)
+    log_pipeline = logs.LogPipeline(handlers, filters=[tracing.TraceIdFilter()])
+    logger.info('Version: {0} (headless)'.format(constants.APP_VERSION))
+
+    config_path = configuration.get_config_path(config_directory)
+    config = configuration.load_config(config_path)
+    logs.apply_log_levels(config)
+
+    client_id, client_secret = configuration.get_credentials()
+    if not client_id or not client_secret:
+        print('No Spotify credentials provided.  Please either set the environment variables SPOTIFY_CLIENT_ID and SPOTIFY_CLIENT_SECRET or create a credentials module with client_id and client_secret variables.')
+        logger.error('No Spotify credentials provided.')
+        log_pipeline.stop()
+        return 1
+
+    cassette = spotify.webapi.cassette.open_cassette_from_environment()
+    auth_agent = spotify.webapi.authorisation.AuthorisationAgent(client_id, client_secret)
+    spotify_api_client = spotify.webapi.WebAPIClient(auth_agent, cassette=cassette)
+    backend = spotify.backends.create_backend(config, spotify_api_client)
+
+    psignalman = playback.PlaybackSignalman()
+    playback_controller = playback.PlaybackController.start(psignalman, config, api_client=spotify_api_client, backend=backend, queue_path=os.path.join(config_directory, playback_queue.QUEUE_FILENAME))
+    playback_proxy = playback_controller.proxy()
+
+    lsignalman = library.LibrarySignalman()
+    playlist_tracks = playlist_cache.PlaylistTrackCache(os.path.join(config_directory, 'playlists'))
+    library_router = library.LibraryRouter.start(config['library_workers'], lsignalman, config, spotify_api_client, playlist_cache=playlist_tracks, pending_writes_path=os.path.join(config_directory, writes.PENDING_WRITES_FILENAME))
+
+    prefetcher = prefetch.Prefetcher(spotify_api_client, upcoming_items=lambda count: playback_proxy.upcoming_items(count).get(), budget=config['prefetch_request_budget'])
+    psignalman.track_changed.connect(prefetcher.on_track_changed)
+    prefetcher.start()
+
+    stopping = threading.Event()
+    server = rpc.RPCServer(playback_proxy, library_router, [psignalman, lsignalman], endpoint_path, on_shutdown=stopping.set, port=arguments.port)
+    server.start()
+
+    lsignalman.authorisation_required.connect(on_authorisation_required, weak=False)
+    if config['saved_items_first']:
+        # Checking search results against a synced library saves a request per page of results
+        lsignalman.authorisation_completed.connect(lambda profile: library_router.sync_saved_items(), weak=False)
+    if config['playback_backend'] == spotify.backends.BACKEND_CONNECT:
+        # The Connect backend can't poll the player until we have an access token
+        lsignalman.authorisation_completed.connect(lambda profile: playback_proxy.connect_to_spotify(), weak=False)
+    else:
+        playback_proxy.connect_to_spotify()
+    library_router.log_in()
+
+    for signal_number in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(signal_number, lambda signal_number, frame: stopping.set())
+    # Waiting in short steps lets the main thread notice signals on Windows
+    while not stopping.wait(0.5):
+        pass
+
+    # Shutdown
+    logger.info('Shutting down')
+    server.stop()
+    playback_proxy.log_statistics().get()
+    prefetcher.stop()
+    playback_controller.stop()
+    library_router.log_utilisation()
+    library_router.stop()
+    configuration.save_config(config, config_path)
+    if cassette is not None:
+        cassette.close()
+    metrics_path = os.environ.get('ACCESSIFY_METRICS')
+    if metrics_path:
+        metrics.registry.export(metrics_path)
+    traces_path = os.environ.get('ACCESSIFY_TRACES')
+    if traces_path:
+        tracing.tracer.dump(traces_path)
+    logger.info('Daemon shutdown complete')
+    log_pipeline.stop()
+    return 0
+
+
+def on_authorisation_required(first_run):
+    logger.warning('{0} needs access to your Spotify account.  Call begin_authorisation over JSON-RPC, or authorise from the GUI, to open the Spotify website.'.format(constants.APP_NAME))
+
+
+if __name__ == '__main__':
+    sys.exit(main())
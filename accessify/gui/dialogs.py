@@ -7,6 +7,7 @@ from accessify import spotify
 TITLE_SPOTIFY_ERROR = constants.APP_NAME
 TXT_NOT_LOGGED_IN = 'Either the Spotify application isn\'t running or there\'s no user logged into it.  Please make sure the application is running and logged into a Spotify account.\nThis dialog will close once a connection has been made.'
 TXT_UNEXPECTED_ERROR = 'Oops, something seems to have gone wrong with the Spotify application.  You may want to try restarting Spotify or logging out and then back in again.\nLeave this dialog open to keep trying to connect, or you can click Cancel to quit.\n\nError #{code} - {description}'
+TXT_NO_ACTIVE_DEVICE = 'There\'s no Spotify device available to play on.  Please open Spotify on one of your devices and make sure you\'re logged in, and this dialog will close once a connection has been made.'
 TXT_CONNECTION_ERROR = 'The Spotify application doesn\'t seem to be running.  Please start the application, make sure you\'re logged in and this dialog will close once a connection has been made.'
 
 LABEL_FIRST_RUN = 'Welcome to {0}.  To get started you\'ll need to give the application access to your Spotify account.  Click the Authorise button to open the Spotify website where you can provide your login credentials.'.format(constants.APP_NAME)
@@ -48,6 +49,8 @@ class SpotifyErrorDialog(wx.Dialog):
                 error_message = TXT_NOT_LOGGED_IN
             else:
                 error_message = TXT_UNEXPECTED_ERROR.format(code=exception.error_code, description=exception.error_description)
+        elif isinstance(exception, spotify.remote.exceptions.NoActiveDeviceError):
+            error_message = TXT_NO_ACTIVE_DEVICE
         else:
             error_message = TXT_CONNECTION_ERROR
         return error_message
@@ -1,6 +1,5 @@
 from enum import Enum
 
-from functional import seq
 import wx
 
 from accessify import constants
@@ -179,7 +178,7 @@ class MainWindow(wx.Frame):
 
 
 def format_track_display(track):
-    return '{0} - {1}'.format(seq(track.artists).first().name, track.name).replace('&', 'and')
+    return '{0} - {1}'.format(track.artists[0].name, track.name).replace('&', 'and')
 
 
 class GUIState(Enum):
@@ -1,6 +1,6 @@
 import wx
 
-from accessify.spotify.utils import is_spotify_uri
+from accessify.spotify.utils import PLAYABLE_URI_TYPES, find_uris, parse_uri
 
 from accessify.gui import utils
 
@@ -31,10 +31,10 @@ class NowPlayingPage(wx.Panel):
         queue_button.Bind(wx.EVT_BUTTON, self.onQueue)
 
     def onURIEntered(self, event):
-        uri = self.uri_field.GetValue()
+        uri = parse_uri(self.uri_field.GetValue(), PLAYABLE_URI_TYPES)
         self.uri_field.Clear()
-        if is_spotify_uri(uri):
-            self.playback.play_uri( uri)
+        if uri is not None:
+            self.playback.play_uri(uri)
         else:
             utils.show_error(self, 'Not a valid Spotify URI.')
 
@@ -43,7 +43,12 @@ class NowPlayingPage(wx.Panel):
         self.uri_field.SetFocus()
 
     def onQueue(self, event):
-        self.playback.queue_uri(self.uri_field.GetValue())
+        # Several URIs or links can be pasted at once, and are queued in the order given
+        uris = [uri for candidate, uri in find_uris(self.uri_field.GetValue()) if uri is not None]
+        if not uris:
+            utils.show_error(self, 'Not a valid Spotify URI.')
+            return
+        self.playback.queue_uris(uris)
         self.uri_field.Clear()
         self.uri_field.SetFocus()
 
@@ -1,11 +1,10 @@
-import functools
-
 import wx
 
 from accessify import structures
+from accessify import tracing
 
-from accessify.library import SearchType
-from accessify.spotify.utils import is_spotify_uri
+from accessify.library import SearchGenerations, SearchType
+from accessify.spotify.utils import PLAYABLE_URI_TYPES, parse_uri
 from accessify.utils.formatting import format_seconds
 
 from accessify.gui import speech
@@ -35,6 +34,9 @@ class SearchPage(wx.Panel):
     def __init__(self, parent, playback_controller, library_controller, *args, **kwargs):
         super().__init__(parent, *args, **kwargs)
         self.library = library_controller
+        # Searches from this page go to one worker, so that their results arrive in the order they were asked for
+        self.searcher = library_controller.ordered(id(self))
+        self.search_generations = SearchGenerations()
         self.playback = playback_controller
 
         self.context_menu_commands = {
@@ -69,21 +71,29 @@ class SearchPage(wx.Panel):
         self.search_button.Bind(wx.EVT_BUTTON, self.onSearch)
 
     def onQueryEntered(self, event):
+        @utils.main_thread
         def results_cb(result_collection):
+            if token.superseded():
+                token.record_superseded('delivered')
+                return
             self.results.SetCollection(result_collection)
             self.results.SetFocus()
+            token.results_shown()
+            tracing.end_trace()
 
         query = self.query_field.GetValue()
         if not query:
             return
-        if is_spotify_uri(query):
+        uri = parse_uri(query, PLAYABLE_URI_TYPES)
+        if uri is not None:
             self.query_field.SetSelection(-1, -1)
-            self.playback.play_uri(query)
+            self.playback.play_uri(uri)
         else:
             self.results.Clear()
             search_type = self.search_type.GetClientData(self.search_type.GetSelection())
-            callback = functools.partial(wx.CallAfter, results_cb)
-            self.library.perform_new_search(query, search_type, callback)
+            token = self.search_generations.new_search()
+            with tracing.start_trace('search'):
+                self.searcher.perform_new_search(query, search_type, results_cb, token)
 
     def onSearch(self, event):
         self.onQueryEntered(None)
@@ -3,6 +3,8 @@ import threading
 
 import wx
 
+from accessify import tracing
+
 
 def find_last_child(widget):
     children = widget.GetChildren()
@@ -23,6 +25,11 @@ def show_error(parent, message):
 def main_thread(func):
     @functools.wraps(func)
     def wrapper(*args, **kwargs):
-        return wx.CallAfter(func, *args, **kwargs)
+        return wx.CallAfter(call_in_trace, tracing.current_context(), tracing.tracer.clock(), func, *args, **kwargs)
     return wrapper
 
+
+def call_in_trace(context, queued_at, func, *args, **kwargs):
+    with tracing.continue_trace(context, 'main thread queue', queued_at), tracing.span(func.__qualname__):
+        return func(*args, **kwargs)
+
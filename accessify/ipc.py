@@ -1,4 +1,37 @@
+"""
+Communication with an already running instance of Accessify.
+
+A running instance serves JSON-RPC 2.0 on a loopback TCP socket (see accessify.rpc), one message per line, and writes the port and an access token to an endpoint file in the config directory.  RPCClient speaks that protocol.  Only the standard library and ujson are used here, so that talking to a running instance is quick to start.
+"""
+
+import collections
 import ctypes
+import itertools
+import os
+import os.path
+import socket
+
+import ujson as json
+
+
+JSONRPC_VERSION = '2.0'
+LOOPBACK_ADDRESS = '127.0.0.1'
+ENDPOINT_FILENAME_FORMAT = '{0}.rpc'
+CONNECT_TIMEOUT = 2
+CALL_TIMEOUT = 30
+# For calls which may make thousands of requests, such as import_uris and queue_uris with Spotify Connect
+LONG_CALL_TIMEOUT = 300
+# The method name of notifications carrying a signal sent by one of the controllers
+EVENT_METHOD = 'event'
+
+# Error codes defined by JSON-RPC 2.0
+PARSE_ERROR = -32700
+INVALID_REQUEST = -32600
+METHOD_NOT_FOUND = -32601
+INVALID_PARAMS = -32602
+INTERNAL_ERROR = -32603
+# And our own
+UNAUTHORISED = -32001
 
 
 def save_hwnd(hwnd, path):
@@ -20,3 +53,143 @@ def get_existing_hwnd(path):
 def focus_window(hwnd):
     ctypes.windll.User32.SetForegroundWindow(hwnd)
 
+
+class RPCError(Exception):
+    def __init__(self, code, message, data=None):
+        super().__init__(code, message)
+        self.code = code
+        self.message = message
+        self.data = data
+
+    def __str__(self):
+        return '{0} (error {1})'.format(self.message, self.code)
+
+    def to_json(self):
+        error = {'code': self.code, 'message': self.message}
+        if self.data is not None:
+            error['data'] = self.data
+        return error
+
+
+def encode_message(message):
+    return json.dumps(message).encode('utf-8') + b'\n'
+
+
+def decode_message(line):
+    return json.loads(line.decode('utf-8'))
+
+
+def get_endpoint_path(config_directory, app_name):
+    return os.path.join(config_directory, ENDPOINT_FILENAME_FORMAT.format(app_name))
+
+
+def write_endpoint(path, port, token):
+    """
+    Atomically replace the endpoint file, readable only by the current user where the platform supports it.
+    """
+    temporary_path = '{0}.{1}'.format(path, os.getpid())
+    fd = os.open(temporary_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, 'w', encoding='utf-8') as f:
+        json.dump({'port': port, 'token': token, 'pid': os.getpid()}, f)
+    os.replace(temporary_path, path)
+
+
+def read_endpoint(path):
+    """
+    Return the endpoint file as a dict with port, token and pid, or None if there isn't a valid one.
+    """
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            endpoint = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if not isinstance(endpoint, dict) or 'port' not in endpoint or 'token' not in endpoint:
+        return None
+    return endpoint
+
+
+def remove_endpoint(path, token):
+    # Another instance may have started since and written its own
+    endpoint = read_endpoint(path)
+    if endpoint is not None and endpoint['token'] == token:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+class RPCClient:
+    """
+    A connection to a running instance, authenticated on creation.
+
+    Notifications which arrive while waiting for the response to a call are kept in order in events, and next_event() returns them before reading any more.
+    """
+
+    def __init__(self, port, token, timeout=CONNECT_TIMEOUT):
+        self._socket = socket.create_connection((LOOPBACK_ADDRESS, port), timeout)
+        self._socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self._buffer = b''
+        self._ids = itertools.count(1)
+        self.events = collections.deque()
+        self.server_info = self.call('authenticate', token=token)
+
+    def call(self, method, *args, timeout=CALL_TIMEOUT, **kwargs):
+        request_id = next(self._ids)
+        self._send({'jsonrpc': JSONRPC_VERSION, 'id': request_id, 'method': method, 'params': kwargs or list(args)})
+        while True:
+            message = self._receive(timeout)
+            if message.get('id') != request_id or 'method' in message:
+                self.events.append(message)
+                continue
+            if 'error' in message:
+                error = message['error']
+                raise RPCError(error.get('code', INTERNAL_ERROR), error.get('message', ''), error.get('data'))
+            return message.get('result')
+
+    def notify(self, method, *args, **kwargs):
+        self._send({'jsonrpc': JSONRPC_VERSION, 'method': method, 'params': kwargs or list(args)})
+
+    def next_event(self, timeout=None):
+        """
+        Return the params of the next event notification, waiting up to timeout seconds or forever if timeout is None.  Raises socket.timeout if none arrives in time.
+        """
+        while True:
+            message = self.events.popleft() if self.events else self._receive(timeout)
+            if message.get('method') == EVENT_METHOD:
+                return message.get('params')
+
+    def _send(self, message):
+        self._socket.sendall(encode_message(message))
+
+    def _receive(self, timeout):
+        self._socket.settimeout(timeout)
+        while b'\n' not in self._buffer:
+            data = self._socket.recv(65536)
+            if not data:
+                raise ConnectionError('Connection closed by Accessify')
+            self._buffer += data
+        line, self._buffer = self._buffer.split(b'\n', 1)
+        return decode_message(line)
+
+    def close(self):
+        self._socket.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+        return False
+
+
+def connect(endpoint_path, timeout=CONNECT_TIMEOUT):
+    """
+    Return an RPCClient connected to the running instance described by the endpoint file, or None if there isn't one.
+    """
+    endpoint = read_endpoint(endpoint_path)
+    if endpoint is None:
+        return None
+    try:
+        return RPCClient(endpoint['port'], endpoint['token'], timeout)
+    except (OSError, RPCError, ValueError):
+        return None
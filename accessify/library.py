@@ -1,29 +1,58 @@
 from enum import Enum
+import itertools
 import logging
+import threading
+import time
 import webbrowser
 
-import pykka
-from functional import seq
-
+from accessify import metrics
 from accessify import structures
+from accessify import uri_import
+from accessify import writes
 
+from accessify.membership import LibraryMembership
+from accessify.metrics import MeasuredActor
+from accessify.playlist_cache import PlaylistTrackCache
 from accessify.signalling import Signalman
+from accessify.spotify.utils import split_uri
 from accessify.spotify.webapi import authorisation
+from accessify.spotify.webapi import fields
 
 
 logger = logging.getLogger(__name__)
 
+DEFAULT_WORKERS = 3
+# Calls which rely on state kept by one particular worker, such as the authorisation server, all go to the first
+PRIMARY_WORKER_METHODS = frozenset(['log_in', 'begin_authorisation', 'on_authorisation_code_received', 'on_authorisation_error', 'complete_authorisation'])
+
 
-class LibraryController(pykka.ThreadingActor):
+class LibraryController(MeasuredActor):
     use_daemon_thread = True
 
-    def __init__(self, signalman, config, api_client):
+    def __init__(self, signalman, config, api_client, name=None, load=None, playlist_cache=None, membership=None, writer=None, write_queue=None):
         super().__init__()
         self._signalman = signalman
         self.config = config
         self.api_client = api_client
+        self.playlist_cache = playlist_cache if playlist_cache is not None else PlaylistTrackCache()
+        self.membership = membership if membership is not None else LibraryMembership(api_client)
+        self.writer = writer if writer is not None else writes.BatchWriter(api_client, signalman, self.membership)
+        # A controller started on its own flushes its own queue, while a pool's queue belongs to its LibraryRouter
+        self._owns_write_queue = write_queue is None
+        self.write_queue = write_queue if write_queue is not None else writes.WriteBehindQueue(self.writer)
+        self.authorisation_server = None
+        self.actor_name = name
+        self.load = load
+
+    def on_start(self):
+        if self._owns_write_queue:
+            self.write_queue.start()
 
     def on_stop(self):
+        if self.authorisation_server is not None:
+            self.authorisation_server.cancel()
+        if self._owns_write_queue:
+            self.write_queue.stop()
         self.config.update({
             'spotify_access_token': self.api_client.authorisation.get_access_token(),
             'spotify_refresh_token': self.api_client.authorisation.get_refresh_token(),
@@ -38,8 +67,10 @@ class LibraryController(pykka.ThreadingActor):
             self.complete_authorisation(access_token, refresh_token)
 
     def begin_authorisation(self):
-        auth_callback = self.actor_ref.proxy().on_authorisation_code_received
-        self.authorisation_server = authorisation.OAuthCallbackServer(self.api_client.authorisation.client_id, auth_callback)
+        if self.authorisation_server is not None:
+            self.authorisation_server.cancel()
+        proxy = self.actor_ref.proxy()
+        self.authorisation_server = authorisation.OAuthCallbackServer(self.api_client.authorisation.client_id, proxy.on_authorisation_code_received, errback=proxy.on_authorisation_error)
         self.authorisation_server.run_threaded()
         webbrowser.open(self.authorisation_server.get_authorisation_url(authorisation.ALL_SCOPES))
 
@@ -48,6 +79,10 @@ class LibraryController(pykka.ThreadingActor):
         self.api_client.authorisation.fetch_access_token(code, self.authorisation_server.get_redirect_uri())
         self.load_profile()
 
+    def on_authorisation_error(self, error):
+        logger.error('Authorisation failed: %s', error)
+        self._signalman.authorisation_error.send(error)
+
     def complete_authorisation(self, access_token, refresh_token):
         self.api_client.authorisation.set_access_token(access_token)
         self.api_client.authorisation.set_refresh_token(refresh_token)
@@ -58,32 +93,260 @@ class LibraryController(pykka.ThreadingActor):
         logger.info('Logged into Spotify as {0} (account type {1})'.format(profile['id'], profile['product']))
         self._signalman.authorisation_completed.send(profile)
 
-    def perform_new_search(self, query, search_type, results_callback):
-        results = self.perform_search(query, search_type, offset=0)
+    def perform_new_search(self, query, search_type, results_callback, token=None):
+        """
+        Search and pass the results to results_callback.  If token is given and a newer search has been made from the same search box by the time this one is handled or its response arrives, nothing is passed on.
+        """
+        if token is not None and token.superseded():
+            token.record_superseded('queued')
+            return
+        try:
+            results = self.perform_search(query, search_type, offset=0, token=token)
+        except SearchSuperseded:
+            token.record_superseded('in_flight')
+            return
         results_callback(results)
 
-    def perform_search(self, query, search_type, offset):
+    def perform_search(self, query, search_type, offset, token=None):
         results = self.api_client.search(query, search_type.value, offset=offset)
+        # Deserializing is the expensive part of handling a response, so stale ones are dropped first
+        if token is not None and token.superseded():
+            raise SearchSuperseded
         if results:
             container = item_containers[search_type]
             deserializer = item_deserializers[search_type]
             entities = results[container]
-            deserialized_results = seq(entities['items']).map(deserializer)
-            result_collection = structures.ItemCollection(items=list(deserialized_results), total=entities['total'])
+            deserialized_results = [deserializer(entity) for entity in entities['items']]
+            result_collection = structures.ItemCollection(items=deserialized_results, total=entities['total'])
+            if self.config.get('saved_items_first') and search_type in SAVED_SEARCH_TYPES:
+                result_collection = self.membership.saved_first(result_collection)
         else:
             result_collection = structures.ItemCollection(items=[], total=0)
 
         return result_collection
 
+    def sync_saved_items(self):
+        counts = self.membership.sync()
+        logger.info('Synced saved items: %s', ', '.join('{0} {1}s'.format(count, kind) for kind, count in sorted(counts.items())))
+        return counts
+
+    def get_playlist_tracks(self, playlist_uri):
+        """
+        Return an ItemCollection of every track in a playlist.  They come from the playlist cache unless the playlist's snapshot ID has changed since they were cached, which costs one small request to check.
+        """
+        playlist_id = split_uri(playlist_uri)[1]
+        snapshot_id = self.api_client.playlist(playlist_id, fields=SNAPSHOT_FIELDS)['snapshot_id']
+        cached = self.playlist_cache.get(playlist_uri)
+        if cached is not None and cached.snapshot_id == snapshot_id:
+            result = 'hit'
+            tracks = cached.tracks
+        else:
+            result = 'miss' if cached is None else 'changed'
+            tracks = self.playlist_cache.store(playlist_uri, snapshot_id, self.fetch_playlist_tracks(playlist_id)).tracks
+        metrics.registry.counter('playlist_cache_requests_total', 'Requests for the tracks of a playlist by whether the cached tracks could be used', labels={'result': result}).inc()
+        return structures.ItemCollection(items=tracks, total=len(tracks))
+
+    def save_items(self, uris):
+        return self.writer.save(uris)
+
+    def remove_saved_items(self, uris):
+        return self.writer.remove_saved(uris)
+
+    def queue_save_items(self, uris):
+        """
+        Save items in the background, along with other changes made shortly before or after.  Better than save_items for changes made a keypress at a time.
+        """
+        self.write_queue.save(uris)
+
+    def queue_remove_saved_items(self, uris):
+        self.write_queue.remove(uris)
+
+    def flush_library_changes(self):
+        self.write_queue.flush()
+        return self.write_queue.statistics()
+
+    def add_to_playlist(self, playlist_uri, uris, position=None):
+        return self.writer.add_to_playlist(playlist_uri, uris, position)
+
+    def remove_from_playlist(self, playlist_uri, uris):
+        return self.writer.remove_from_playlist(playlist_uri, uris)
+
+    def resolve_uris(self, text, kinds=None):
+        """
+        Look up the items for the Spotify URIs and links in text, limited to kinds if given.  Returns a uri_import.ImportResult.
+        """
+        resolver = uri_import.URIResolver(self.api_client, IMPORT_LOOKUPS, concurrency=self.config.get('import_concurrency', uri_import.DEFAULT_CONCURRENCY))
+        return resolver.resolve(text.splitlines(), kinds)
+
+    def fetch_playlist_tracks(self, playlist_id):
+        offset = 0
+        while True:
+            page = self.api_client.playlist_tracks(playlist_id, offset=offset, fields=PLAYLIST_TRACKS_PAGE_FIELDS)
+            for item in page['items']:
+                # Tracks which are no longer available come back as null
+                if item['track'] is not None:
+                    yield deserialize_track(item['track'])
+            if page['next'] is None:
+                break
+            offset += len(page['items'])
+
+
+class SearchSuperseded(Exception):
+    pass
+
+
+class SearchGenerations:
+    """
+    Numbers the searches made from one search box, so that each new search supersedes any made before it which are still waiting, in progress or on their way to the GUI.
+    """
+
+    def __init__(self, clock=time.perf_counter):
+        self.clock = clock
+        self._latest = 0
+        self._lock = threading.Lock()
+
+    def new_search(self):
+        with self._lock:
+            self._latest += 1
+            return SearchToken(self, self._latest, self.clock())
+
+    def is_latest(self, generation):
+        return generation == self._latest
+
+
+class SearchToken:
+    __slots__ = ('generations', 'generation', 'started_at')
+
+    def __init__(self, generations, generation, started_at):
+        self.generations = generations
+        self.generation = generation
+        self.started_at = started_at
+
+    def superseded(self):
+        return not self.generations.is_latest(self.generation)
+
+    def record_superseded(self, stage):
+        metrics.registry.counter('searches_superseded_total', 'Searches abandoned because a newer one was made from the same search box', labels={'stage': stage}).inc()
+
+    def results_shown(self):
+        """
+        Record the time from the search being made until its results were shown, returning it in seconds.
+        """
+        elapsed = self.generations.clock() - self.started_at
+        metrics.registry.histogram('search_time_to_results_seconds', 'Time from a search being made until its results are shown').observe(elapsed)
+        return elapsed
+
+
+class LibraryRouter:
+    """
+    Spreads calls across a pool of LibraryController actors which share one WebAPIClient, and with it one HTTP session and access token, so that a slow search doesn't hold up everything else.
+
+    Calls are made as they would be through an actor proxy, e.g. router.perform_search(...) returns a future.  Each goes to the worker with the least to do, except that the proxy returned by ordered(key) always belongs to the same worker, so calls made through it are handled in the order they were made.
+    """
+
+    def __init__(self, actor_refs, loads, writer=None, write_queue=None):
+        self._actor_refs = actor_refs
+        self._writer = writer
+        self._write_queue = write_queue
+        self._proxies = [actor_ref.proxy() for actor_ref in actor_refs]
+        self._loads = loads
+        self._names = [worker_name(index) for index in range(len(actor_refs))]
+        self._next_start = itertools.count()
+        self._assignments = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def start(cls, size, signalman, config, api_client, playlist_cache=None, pending_writes_path=None):
+        size = max(1, size)
+        loads = [metrics.ActorLoad() for i in range(size)]
+        if playlist_cache is None:
+            playlist_cache = PlaylistTrackCache()
+        membership = LibraryMembership(api_client)
+        writer = writes.BatchWriter(api_client, signalman, membership, concurrency=config.get('write_concurrency', writes.DEFAULT_CONCURRENCY))
+        write_queue = writes.WriteBehindQueue(writer, pending_writes_path, flush_interval=config.get('write_flush_interval', writes.DEFAULT_FLUSH_INTERVAL), flush_size=config.get('write_flush_size', writes.DEFAULT_FLUSH_SIZE))
+        write_queue.start()
+        actor_refs = [LibraryController.start(signalman, config, api_client, name=worker_name(index), load=loads[index], playlist_cache=playlist_cache, membership=membership, writer=writer, write_queue=write_queue) for index in range(size)]
+        return cls(actor_refs, loads, writer, write_queue)
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        index = 0 if name in PRIMARY_WORKER_METHODS else self._least_busy()
+        return getattr(self._proxies[index], name)
+
+    def ordered(self, key):
+        """
+        Return the proxy of the worker which handles calls for key, assigning the worker with the fewest keys so far if key is new.
+        """
+        with self._lock:
+            index = self._assignments.get(key)
+            if index is None:
+                counts = [0] * len(self._proxies)
+                for assigned in self._assignments.values():
+                    counts[assigned] += 1
+                index = counts.index(min(counts))
+                self._assignments[key] = index
+        return self._proxies[index]
+
+    def _least_busy(self):
+        # Starting the search at a different worker each time spreads calls evenly between idle workers
+        size = len(self._proxies)
+        start = next(self._next_start) % size
+        indexes = [(start + offset) % size for offset in range(size)]
+        return min(indexes, key=self._backlog)
+
+    def _backlog(self, index):
+        return self._actor_refs[index].actor_inbox.qsize() + (1 if self._loads[index].busy else 0)
+
+    def utilisation(self):
+        """
+        Return a dict per worker of the fraction of its lifetime spent handling messages, how many it has handled and how many are waiting.  The fractions are also recorded in the library_worker_utilisation gauge.
+        """
+        workers = []
+        for index, name in enumerate(self._names):
+            load = self._loads[index]
+            utilisation = load.utilisation()
+            metrics.registry.gauge('library_worker_utilisation', 'Fraction of its lifetime a LibraryController worker has spent handling messages', labels={'worker': name}).set(utilisation)
+            workers.append({
+                'worker': name,
+                'utilisation': utilisation,
+                'handled': load.handled,
+                'waiting': self._actor_refs[index].actor_inbox.qsize(),
+            })
+        return workers
+
+    def log_utilisation(self):
+        for worker in self.utilisation():
+            logger.info('{worker}: {utilisation:.1%} utilised, {handled} messages handled'.format(**worker))
+
+    def stop(self):
+        for actor_ref in self._actor_refs:
+            actor_ref.stop()
+        if self._write_queue is not None:
+            self._write_queue.stop()
+            logger.info('Library changes: {changes} made, {requests} requests sent, {avoided_requests} avoided'.format(**self._write_queue.statistics()))
+        if self._writer is not None:
+            self._writer.stop()
+
+
+def worker_name(index):
+    return '{0}-{1}'.format(LibraryController.__name__, index + 1)
+
 
 def deserialize_track(track):
-    artists = seq(track['artists']).map(deserialize_artist)
+    artists = [deserialize_artist(artist) for artist in track['artists']]
     album = deserialize_album(track['album'])
     return structures.Track(artists=artists, name=track['name'], uri=track['uri'], album=album, length=round(track['duration_ms'] / 1000))
 
 
+def deserialize_album_track(track, album):
+    # Tracks listed under an album leave the album out, so the caller passes it in
+    artists = [deserialize_artist(artist) for artist in track['artists']]
+    return structures.Track(artists=artists, name=track['name'], uri=track['uri'], album=album, length=round(track['duration_ms'] / 1000))
+
+
 def deserialize_album(album):
-    artists = seq(album['artists']).map(deserialize_artist)
+    artists = [deserialize_artist(artist) for artist in album['artists']]
     return structures.Album(artists=artists, name=album['name'], uri=album['uri'])
 
 
@@ -95,6 +358,27 @@ def deserialize_playlist(playlist):
     return structures.Playlist(name=playlist['name'], total_tracks=playlist['tracks']['total'], uri=playlist['uri'])
 
 
+# The fields of each Web API object read by the deserializers above, for endpoints which can leave the rest out
+ARTIST_FIELDS = ('name', 'uri')
+ALBUM_FIELDS = ('name', 'uri', ('artists', ARTIST_FIELDS))
+TRACK_FIELDS = ('name', 'uri', 'duration_ms', ('artists', ARTIST_FIELDS), ('album', ALBUM_FIELDS))
+PLAYLIST_FIELDS = ('name', 'uri', ('tracks', ('total',)))
+
+
+# A page of playlist items, each of which wraps a track
+PLAYLIST_TRACKS_PAGE_FIELDS = fields.page_of(TRACK_FIELDS, wrapper='track')
+SNAPSHOT_FIELDS = ('snapshot_id',)
+
+
+# How bulk imports look up each kind of item.  Playlists have no several-at-once endpoint, so are looked up one at a time
+IMPORT_LOOKUPS = {
+    'track': uri_import.Lookup('tracks', 'tracks', 50, deserialize_track),
+    'album': uri_import.Lookup('albums', 'albums', 20, deserialize_album),
+    'artist': uri_import.Lookup('artists', 'artists', 50, deserialize_artist),
+    'playlist': uri_import.Lookup('playlist', None, 1, deserialize_playlist, PLAYLIST_FIELDS),
+}
+
+
 class SearchType(Enum):
     TRACK = 'track'
     ARTIST = 'artist'
@@ -110,6 +394,10 @@ item_containers = {
 }
 
 
+# The search types which can be saved to the user's library, and so shown first when they are
+SAVED_SEARCH_TYPES = frozenset([SearchType.TRACK, SearchType.ALBUM])
+
+
 item_deserializers = {
     SearchType.TRACK: deserialize_track,
     SearchType.ALBUM: deserialize_album,
@@ -119,5 +407,5 @@ item_deserializers = {
 
 
 class LibrarySignalman(Signalman):
-    signals = ['authorisation_required', 'authorisation_completed', 'authorisation_error']
+    signals = ['authorisation_required', 'authorisation_completed', 'authorisation_error', 'write_progress']
 
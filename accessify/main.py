@@ -1,43 +1,55 @@
-from datetime import datetime
+import time
+
+STARTED_AT = time.perf_counter()
+
+import sys
+
+from accessify.utils import startup
+
+# Installed before anything else is imported, so that every import can be timed
+import_timer = startup.ImportTimer() if startup.profiling_requested() else None
+if import_timer is not None:
+    import_timer.install()
+
 import logging
 import os
 import os.path
 import platform
-import sys
 
-from appdirs import user_config_dir
 import tolk
-import ujson as json
 import wx
 
+from accessify import config as configuration
 from accessify import constants
-
-try:
-    from accessify import credentials
-    has_credentials = True
-except ImportError:
-    has_credentials = False
-
 from accessify import gui
 from accessify import ipc
 from accessify import library
+from accessify import metrics
 from accessify import playback
+from accessify import playback_queue
+from accessify import playlist_cache
+from accessify import prefetch
+from accessify import rpc
+from accessify import tracing
+from accessify import writes
+from accessify.utils import logs
 from accessify import spotify
 
 
 logger = logging.getLogger(__package__)
 
-LOG_RECORD_FORMAT = '%(levelname)s - %(asctime)s:%(msecs)d:\n%(name)s: %(message)s'
-LOG_DATE_TIME_FORMAT = '%d-%m-%Y @ %H:%M:%S'
-LOG_FILE_DATE_TIME_FORMAT = '%Y_%m_%d-%H_%M_%S'
+IMPORTS_FINISHED_AT = time.perf_counter()
 
 
 def main():
-    config_directory = user_config_dir(appname=constants.APP_NAME, appauthor=False, roaming=True)
+    profiler = startup.StartupProfiler(STARTED_AT, import_timer)
+    profiler.record('imports', STARTED_AT, IMPORTS_FINISHED_AT)
+    config_directory = configuration.get_config_directory()
     hwnd_file = os.path.join(config_directory, '{0}.hwnd'.format(constants.APP_NAME))
 
-    app = wx.App()
-    instance_checker = wx.SingleInstanceChecker()
+    with profiler.phase('wx.App'):
+        app = wx.App()
+        instance_checker = wx.SingleInstanceChecker()
     if instance_checker.IsAnotherRunning():
         hwnd = ipc.get_existing_hwnd(hwnd_file)
         if hwnd:
@@ -45,57 +57,76 @@ def main():
         else:
             gui.utils.show_error(None, 'Accessify is already running.')
         return
+    # The headless daemon doesn't hold the instance checker, but would share the queue, pending writes and endpoint file
+    existing = ipc.connect(ipc.get_endpoint_path(config_directory, constants.APP_NAME))
+    if existing is not None:
+        existing.close()
+        gui.utils.show_error(None, 'Accessify is already running without a window.')
+        return
 
-    config_directory = user_config_dir(appname=constants.APP_NAME, appauthor=False, roaming=True)
     log_directory = os.path.join(config_directory, 'logs')
-    try:
-        os.makedirs(log_directory)
-    except FileExistsError:
-        pass
-
-    log_filename = '{0}.{1}.log'.format(constants.APP_NAME.lower(), datetime.utcnow().strftime(LOG_FILE_DATE_TIME_FORMAT))
-    log_path = os.path.join(log_directory, log_filename)
-    root_logger = logging.getLogger()
-    root_logger.setLevel(logging.DEBUG)
-    handler = logging.FileHandler(log_path, mode='w', encoding='utf-8')
-    handler.setFormatter(logging.Formatter(LOG_RECORD_FORMAT, LOG_DATE_TIME_FORMAT))
-    root_logger.addHandler(handler)
+    with profiler.phase('logging'):
+        try:
+            os.makedirs(log_directory)
+        except FileExistsError:
+            pass
+        file_handler = logs.create_file_handler(log_directory, logs.create_formatter())
+        log_pipeline = logs.LogPipeline([file_handler], filters=[tracing.TraceIdFilter()])
+        logs.remove_old_logs(log_directory)
 
     log_startup_info()
 
-    config_path = os.path.join(config_directory, 'config.json')
-    config = load_config(config_path)
+    config_path = configuration.get_config_path(config_directory)
+    with profiler.phase('config'):
+        config = configuration.load_config(config_path)
+        logs.apply_log_levels(config)
 
-    if has_credentials:
-        client_id = credentials.client_id
-        client_secret = credentials.client_secret
-    else:
-        client_id = os.environ.get('SPOTIFY_CLIENT_ID')
-        client_secret = os.environ.get('SPOTIFY_CLIENT_SECRET')
+    # Scanning processes for the Web Helper's port is the slowest part of connecting and needs nothing else, so it runs alongside the rest of startup
+    port_finder = spotify.remote.find_listening_port
+    if config['playback_backend'] == spotify.backends.BACKEND_WEB_HELPER:
+        port_future = profiler.run_concurrently('find Spotify port', spotify.remote.find_listening_port)
+        port_finder = startup.prefetched(port_future, spotify.remote.find_listening_port)
 
+    client_id, client_secret = configuration.get_credentials()
     if not client_id or not client_secret:
         print('No Spotify credentials provided.  Please either set the environment variables SPOTIFY_CLIENT_ID and SPOTIFY_CLIENT_SECRET or create a credentials module with client_id and client_secret variables.')
         logger.error('No Spotify credentials provided.')
         return
 
-    try:
-        tolk.load()
-    except Exception:
-        pass
+    # Tolk initialises COM for the thread which loads it, so this stays on the main thread
+    with profiler.phase('screen reader'):
+        try:
+            tolk.load()
+        except Exception:
+            pass
 
-    auth_agent = spotify.webapi.authorisation.AuthorisationAgent(client_id, client_secret)
-    spotify_api_client = spotify.webapi.WebAPIClient(auth_agent)
+    with profiler.phase('controllers'):
+        cassette = spotify.webapi.cassette.open_cassette_from_environment()
+        auth_agent = spotify.webapi.authorisation.AuthorisationAgent(client_id, client_secret)
+        spotify_api_client = spotify.webapi.WebAPIClient(auth_agent, cassette=cassette)
+        backend = spotify.backends.create_backend(config, spotify_api_client, port_finder=port_finder)
 
-    psignalman = playback.PlaybackSignalman()
-    playback_controller = playback.PlaybackController.start(psignalman, config)
-    playback_proxy = playback_controller.proxy()
+        psignalman = playback.PlaybackSignalman()
+        playback_controller = playback.PlaybackController.start(psignalman, config, api_client=spotify_api_client, backend=backend, queue_path=os.path.join(config_directory, playback_queue.QUEUE_FILENAME))
+        playback_proxy = playback_controller.proxy()
 
-    lsignalman = library.LibrarySignalman()
-    library_controller = library.LibraryController.start(lsignalman, config, spotify_api_client)
-    library_proxy = library_controller.proxy()
+        lsignalman = library.LibrarySignalman()
+        playlist_tracks = playlist_cache.PlaylistTrackCache(os.path.join(config_directory, 'playlists'))
+        library_router = library.LibraryRouter.start(config['library_workers'], lsignalman, config, spotify_api_client, playlist_cache=playlist_tracks, pending_writes_path=os.path.join(config_directory, writes.PENDING_WRITES_FILENAME))
 
-    window = gui.main.MainWindow(playback_proxy, library_proxy)
-    ipc.save_hwnd(window.GetHandle(), hwnd_file)
+        prefetcher = prefetch.Prefetcher(spotify_api_client, upcoming_items=lambda count: playback_proxy.upcoming_items(count).get(), budget=config['prefetch_request_budget'])
+        psignalman.track_changed.connect(prefetcher.on_track_changed)
+        prefetcher.start()
+
+    with profiler.phase('main window'):
+        window = gui.main.MainWindow(playback_proxy, library_router)
+        ipc.save_hwnd(window.GetHandle(), hwnd_file)
+
+    rpc_server = rpc.RPCServer(playback_proxy, library_router, [psignalman, lsignalman], ipc.get_endpoint_path(config_directory, constants.APP_NAME), on_shutdown=lambda: wx.CallAfter(window.Close), info={'hwnd': window.GetHandle()})
+    try:
+        rpc_server.start()
+    except OSError:
+        logger.exception('Unable to start the JSON-RPC server')
 
     psignalman.state_changed.connect(window.onPlaybackStateChange)
     psignalman.track_changed.connect(window.onTrackChange)
@@ -106,18 +137,41 @@ def main():
 
     lsignalman.authorisation_required.connect(window.onAuthorisationRequired)
     lsignalman.authorisation_completed.connect(window.onAuthorisationCompleted)
+    if config['saved_items_first']:
+        # Checking search results against a synced library saves a request per page of results
+        lsignalman.authorisation_completed.connect(lambda profile: library_router.sync_saved_items(), weak=False)
     # lsignalman.authorisation_error.connect(window.onAuthorisationError)
 
-    playback_proxy.connect_to_spotify()
-    library_proxy.log_in()
+    if config['playback_backend'] == spotify.backends.BACKEND_CONNECT:
+        # The Connect backend can't poll the player until we have an access token
+        lsignalman.authorisation_completed.connect(lambda profile: playback_proxy.connect_to_spotify(), weak=False)
+    else:
+        playback_proxy.connect_to_spotify()
+    library_router.log_in()
+    wx.CallAfter(profiler.mark_interactive)
     app.MainLoop()
 
     # Shutdown
+    rpc_server.stop()
+    playback_proxy.log_statistics().get()
+    prefetcher.stop()
     playback_controller.stop()
-    library_controller.stop()
-    save_config(config, config_path)
+    library_router.log_utilisation()
+    library_router.stop()
+    configuration.save_config(config, config_path)
+    if cassette is not None:
+        cassette.close()
+    metrics_path = os.environ.get('ACCESSIFY_METRICS')
+    if metrics_path:
+        metrics.registry.export(metrics_path)
+        logger.info('Metrics written to {0}'.format(metrics_path))
+    traces_path = os.environ.get('ACCESSIFY_TRACES')
+    if traces_path:
+        tracing.tracer.dump(traces_path)
+        logger.info('Trace timelines written to {0}'.format(traces_path))
     tolk.unload()
     logger.info('Application shutdown complete')
+    log_pipeline.stop()
 
 
 def log_startup_info():
@@ -132,34 +186,6 @@ def log_startup_info():
     logger.info('Python {0}'.format(sys.version))
 
 
-def load_config(path):
-    logger.info('Attempting to load config from {0}'.format(path))
-    try:
-        with open(path, 'r', encoding='utf-8') as f:
-            config = json.load(f)
-    except (FileNotFoundError, ValueError):
-        logger.info('Valid existing config not found, creating default')
-        return default_config
-
-    for key in default_config.keys():
-        if key not in config:
-            config.update({key: default_config[key]})
-    return config
-
-
-def save_config(config_dict, path):
-    with open(path, 'w', encoding='utf-8') as f:
-        json.dump(config_dict, f, indent=4)
-    logger.info('Config saved to {0}'.format(path))
-
-
-default_config = {
-    'spotify_access_token': '',
-    'spotify_refresh_token': '',
-    'spotify_polling_interval': 60,
-}
-
-
 if __name__ == '__main__':
     main()
 
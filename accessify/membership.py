@@ -0,0 +1,167 @@
+"""
+Which tracks and albums are in the user's library, so that saved items can be shown first in search results.
+
+LibraryMembership keeps the IDs of saved tracks and albums in a set per kind.  Once a kind has been synced by paging through everything the user has saved, an ID missing from its set isn't saved, so checking a page of search results costs no requests.  Until then, IDs not seen before are checked with the contains endpoints in as few requests as their limits allow, and the answers kept.
+"""
+
+import logging
+import threading
+
+from accessify import metrics
+from accessify import structures
+from accessify.spotify.utils import split_uri
+
+
+logger = logging.getLogger(__name__)
+
+# For each kind of item, the WebAPIClient methods which list saved items and check whether IDs are saved, and the most IDs the latter accepts
+KINDS = {
+    'track': ('saved_tracks', 'contains_saved_tracks', 50),
+    'album': ('saved_albums', 'contains_saved_albums', 20),
+}
+SAVED_PAGE_LIMIT = 50
+
+
+class LibraryMembership:
+    """
+    Safe to share between threads and actors.  Saving or removing items should be reported with mark_saved, so that what's known stays up to date without syncing again.
+    """
+
+    def __init__(self, api_client):
+        self.api_client = api_client
+        self._saved = {kind: set() for kind in KINDS}
+        self._unsaved = {kind: set() for kind in KINDS}
+        self._synced = set()
+        # Items of each kind marked saved or not while it's being synced, which the paged results may be too old to include
+        self._changed_during_sync = {}
+        self._lock = threading.Lock()
+
+    def is_synced(self, kind):
+        return kind in self._synced
+
+    def sync(self, kinds=None):
+        """
+        Page through the user's saved items of each kind, replacing what was known about them apart from items marked saved or not while the sync was running.  Returns a dict of how many of each were found.
+        """
+        counts = {}
+        for kind in kinds or KINDS:
+            with self._lock:
+                changed = self._changed_during_sync[kind] = {}
+            try:
+                ids = self._list_saved(kind)
+            except BaseException:
+                with self._lock:
+                    del self._changed_during_sync[kind]
+                raise
+            # Everything from here to the swap happens under the lock, so that no change can land in the sets being replaced
+            with self._lock:
+                unsaved = set()
+                for item_id, saved in changed.items():
+                    if saved:
+                        ids.add(item_id)
+                    else:
+                        ids.discard(item_id)
+                        unsaved.add(item_id)
+                self._saved[kind] = ids
+                self._unsaved[kind] = unsaved
+                self._synced.add(kind)
+                del self._changed_during_sync[kind]
+            counts[kind] = len(ids)
+        return counts
+
+    def _list_saved(self, kind):
+        list_saved = getattr(self.api_client, KINDS[kind][0])
+        ids = set()
+        offset = 0
+        while True:
+            page = list_saved(limit=SAVED_PAGE_LIMIT, offset=offset)
+            for item in page['items']:
+                parts = split_uri(item[kind]['uri'])
+                if parts is not None:
+                    ids.add(parts[1])
+            if page['next'] is None:
+                return ids
+            offset += len(page['items'])
+
+    def mark_saved(self, uris, saved=True):
+        with self._lock:
+            for uri in uris:
+                parts = split_uri(uri)
+                if parts is None or parts[0] not in KINDS:
+                    continue
+                kind, item_id = parts
+                if saved:
+                    self._saved[kind].add(item_id)
+                    self._unsaved[kind].discard(item_id)
+                else:
+                    self._saved[kind].discard(item_id)
+                    self._unsaved[kind].add(item_id)
+                if kind in self._changed_during_sync:
+                    self._changed_during_sync[kind][item_id] = saved
+
+    def known_state(self, uri):
+        """
+        Return whether uri is saved if that's known without a request, or None.
+        """
+        parts = split_uri(uri)
+        if parts is None or parts[0] not in KINDS:
+            return None
+        kind, item_id = parts
+        with self._lock:
+            if item_id in self._saved[kind]:
+                return True
+            if kind in self._synced or item_id in self._unsaved[kind]:
+                return False
+        return None
+
+    def saved(self, uris):
+        """
+        Return a dict of whether each track or album URI in uris is saved.  URIs of anything else are left out.
+        """
+        results = {}
+        unknown = {kind: {} for kind in KINDS}
+        with self._lock:
+            for uri in uris:
+                parts = split_uri(uri)
+                if parts is None or parts[0] not in KINDS:
+                    continue
+                kind, item_id = parts
+                if item_id in self._saved[kind]:
+                    results[uri] = True
+                elif kind in self._synced or item_id in self._unsaved[kind]:
+                    results[uri] = False
+                else:
+                    unknown[kind][uri] = item_id
+        local = len(results)
+        for kind, pending in unknown.items():
+            if pending:
+                results.update(self._check(kind, list(pending.items())))
+        record_lookups('local', local)
+        record_lookups('remote', len(results) - local)
+        return results
+
+    def _check(self, kind, pending):
+        contains_method, maximum_ids = KINDS[kind][1:]
+        contains = getattr(self.api_client, contains_method)
+        results = {}
+        for start in range(0, len(pending), maximum_ids):
+            chunk = pending[start:start + maximum_ids]
+            answers = contains([item_id for uri, item_id in chunk])
+            with self._lock:
+                for (uri, item_id), saved in zip(chunk, answers):
+                    results[uri] = saved
+                    (self._saved if saved else self._unsaved)[kind].add(item_id)
+        return results
+
+    def saved_first(self, collection):
+        """
+        Return a copy of an ItemCollection with its saved items moved to the front, otherwise in the same order.
+        """
+        items = list(collection)
+        saved = self.saved(item.uri for item in items if item.uri)
+        ordered = [item for item in items if saved.get(item.uri)] + [item for item in items if not saved.get(item.uri)]
+        return structures.ItemCollection(items=ordered, total=collection.total)
+
+
+def record_lookups(source, count):
+    metrics.registry.counter('library_membership_lookups_total', 'Checks of whether an item is saved, by whether they were answered without a request', labels={'source': source}).inc(count)
@@ -0,0 +1,309 @@
+"""
+A lightweight in-process registry of counters, gauges and fixed-bucket histograms.
+
+Recording a value only takes a lock and some arithmetic, and nothing is formatted or written until a snapshot is asked for with MetricsRegistry.snapshot(), write_json() or prometheus_text().  Metrics are identified by name plus an optional dict of labels, and callers on hot paths can hold on to the metric object rather than looking it up each time.
+"""
+
+import bisect
+from enum import Enum
+import re
+import threading
+import time
+
+import blinker
+import pykka
+import ujson as json
+
+from accessify import tracing
+
+
+DEFAULT_LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+SPOTIFY_ID_PATTERN = re.compile(r'\b[0-9A-Za-z]{22}\b')
+
+
+class MetricType(Enum):
+    COUNTER = 'counter'
+    GAUGE = 'gauge'
+    HISTOGRAM = 'histogram'
+
+
+class Counter:
+    type = MetricType.COUNTER
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.value = 0
+
+    def inc(self, amount=1):
+        with self._lock:
+            self.value += amount
+
+    def snapshot(self):
+        return {'value': self.value}
+
+
+class Gauge:
+    type = MetricType.GAUGE
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.value = 0
+
+    def set(self, value):
+        self.value = value
+
+    def inc(self, amount=1):
+        with self._lock:
+            self.value += amount
+
+    def dec(self, amount=1):
+        self.inc(-amount)
+
+    def snapshot(self):
+        return {'value': self.value}
+
+
+class Histogram:
+    """
+    Counts observations into fixed buckets, each bucket holding the observations less than or equal to its upper bound and greater than the bound below it.
+    """
+
+    type = MetricType.HISTOGRAM
+
+    def __init__(self, buckets=DEFAULT_LATENCY_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        self._lock = threading.Lock()
+        # The last count is for observations above the highest bucket
+        self._counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0
+        self.count = 0
+
+    def observe(self, value):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self._counts[index] += 1
+            self.sum += value
+            self.count += 1
+
+    def time(self):
+        """
+        Return a context manager which observes how long its block takes.
+        """
+        return HistogramTimer(self)
+
+    def cumulative_counts(self):
+        with self._lock:
+            counts = list(self._counts)
+        total = 0
+        cumulative = []
+        for count in counts:
+            total += count
+            cumulative.append(total)
+        return cumulative
+
+    def snapshot(self):
+        cumulative = self.cumulative_counts()
+        return {
+            'buckets': dict(zip([str(bucket) for bucket in self.buckets] + ['+Inf'], cumulative)),
+            'sum': self.sum,
+            'count': cumulative[-1],
+        }
+
+
+class HistogramTimer:
+    # A plain class rather than contextlib.contextmanager, which costs several times as much per use
+    __slots__ = ('_histogram', '_started')
+
+    def __init__(self, histogram):
+        self._histogram = histogram
+
+    def __enter__(self):
+        self._started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._histogram.observe(time.perf_counter() - self._started)
+        return False
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._metrics = {}
+        self._descriptions = {}
+
+    def counter(self, name, description='', labels=None):
+        return self._get_or_create(name, description, labels, Counter)
+
+    def gauge(self, name, description='', labels=None):
+        return self._get_or_create(name, description, labels, Gauge)
+
+    def histogram(self, name, description='', labels=None, buckets=DEFAULT_LATENCY_BUCKETS):
+        return self._get_or_create(name, description, labels, lambda: Histogram(buckets))
+
+    def _get_or_create(self, name, description, labels, factory):
+        key = (name, tuple(sorted(labels.items())) if labels else ())
+        metric = self._metrics.get(key)
+        if metric is None:
+            with self._lock:
+                metric = self._metrics.get(key)
+                if metric is None:
+                    metric = factory()
+                    self._metrics[key] = metric
+                    if description or name not in self._descriptions:
+                        self._descriptions[name] = description
+        return metric
+
+    def snapshot(self):
+        """
+        Return {name: {'type', 'description', 'series': [{'labels', ...values}]}} for every metric.
+        """
+        with self._lock:
+            metrics = list(self._metrics.items())
+            descriptions = dict(self._descriptions)
+        snapshot = {}
+        for (name, labels), metric in sorted(metrics, key=lambda item: item[0]):
+            entry = snapshot.setdefault(name, {'type': metric.type.value, 'description': descriptions.get(name, ''), 'series': []})
+            entry['series'].append(dict(metric.snapshot(), labels=dict(labels)))
+        return snapshot
+
+    def write_json(self, path):
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump({'timestamp': time.time(), 'metrics': self.snapshot()}, f, indent=4)
+
+    def prometheus_text(self):
+        lines = []
+        for name, entry in self.snapshot().items():
+            if entry['description']:
+                lines.append('# HELP {0} {1}'.format(name, entry['description']))
+            lines.append('# TYPE {0} {1}'.format(name, entry['type']))
+            for series in entry['series']:
+                labels = series['labels']
+                if entry['type'] == MetricType.HISTOGRAM.value:
+                    for bound, count in series['buckets'].items():
+                        lines.append('{0}_bucket{1} {2}'.format(name, format_labels(dict(labels, le=bound)), count))
+                    lines.append('{0}_sum{1} {2}'.format(name, format_labels(labels), series['sum']))
+                    lines.append('{0}_count{1} {2}'.format(name, format_labels(labels), series['count']))
+                else:
+                    lines.append('{0}{1} {2}'.format(name, format_labels(labels), series['value']))
+        return '\n'.join(lines) + '\n'
+
+    def write_prometheus(self, path):
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(self.prometheus_text())
+
+    def export(self, path):
+        """
+        Write a snapshot to path, in Prometheus text format if it ends in .prom and as JSON otherwise.
+        """
+        if path.endswith('.prom'):
+            self.write_prometheus(path)
+        else:
+            self.write_json(path)
+
+    def clear(self):
+        with self._lock:
+            self._metrics.clear()
+            self._descriptions.clear()
+
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    pairs = ['{0}="{1}"'.format(key, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')) for key, value in labels.items()]
+    return '{' + ','.join(pairs) + '}'
+
+
+def endpoint_label(endpoint):
+    """
+    Replace Spotify IDs in a Web API endpoint, so that e.g. every playlist's tracks are counted together.
+    """
+    return SPOTIFY_ID_PATTERN.sub('{id}', endpoint)
+
+
+registry = MetricsRegistry()
+
+
+class MeasuredSignal(blinker.Signal):
+    """
+    A blinker signal which records how long delivering each send() to its receivers takes.
+    """
+
+    def __init__(self, name, doc=None):
+        super().__init__(doc)
+        self.name = name
+        self._delivery = registry.histogram('signal_delivery_seconds', 'Time taken to deliver a signal to all of its receivers', labels={'signal': name})
+
+    def send(self, *args, **kwargs):
+        with self._delivery.time(), tracing.span('signal {0}'.format(self.name)):
+            return super().send(*args, **kwargs)
+
+
+class ActorLoad:
+    """
+    How busy an actor has been since it started, readable from other threads without waiting behind the actor's inbox.
+    """
+
+    def __init__(self, clock=time.perf_counter):
+        self.clock = clock
+        self.started_at = clock()
+        self.busy_seconds = 0
+        self.handled = 0
+        self.busy = False
+        self._lock = threading.Lock()
+
+    def begin(self):
+        self.busy = True
+
+    def record(self, duration):
+        with self._lock:
+            self.busy_seconds += duration
+            self.handled += 1
+            self.busy = False
+
+    def utilisation(self):
+        elapsed = self.clock() - self.started_at
+        return self.busy_seconds / elapsed if elapsed > 0 else 0
+
+
+class MeasuredActor(pykka.ThreadingActor):
+    """
+    A ThreadingActor which records how long each message, including proxy calls, takes to handle and how many are waiting in its inbox.
+
+    Its inbox is a tracing.TracingQueue, so the trace of whoever sent a message carries on while the actor handles it.  Metrics are labelled with actor_name, which defaults to the class name but can be set per instance to tell apart actors of the same class.  If load is set to an ActorLoad, the time spent handling each message is added to it too.
+    """
+
+    actor_name = None
+    load = None
+
+    @classmethod
+    def _create_actor_inbox(cls):
+        return tracing.TracingQueue(cls.__name__)
+
+    def _handle_receive(self, message):
+        actor = self.actor_name or type(self).__name__
+        name = message_name(message)
+        registry.gauge('actor_inbox_depth', 'Messages waiting to be handled by an actor', labels={'actor': actor}).set(self.actor_inbox.qsize())
+        histogram = registry.histogram('actor_message_seconds', 'Time taken by an actor to handle a message', labels={'actor': actor, 'message': name})
+        if self.load is not None:
+            self.load.begin()
+        started = time.perf_counter()
+        try:
+            with tracing.span('{0}.{1}'.format(actor, name)):
+                return super()._handle_receive(message)
+        finally:
+            elapsed = time.perf_counter() - started
+            histogram.observe(elapsed)
+            if self.load is not None:
+                self.load.record(elapsed)
+
+
+def message_name(message):
+    # Proxy calls are dicts in older versions of pykka and message objects in newer ones
+    if isinstance(message, dict):
+        attr_path = message.get('attr_path')
+    else:
+        attr_path = getattr(message, 'attr_path', None)
+    if attr_path:
+        return '.'.join(attr_path)
+    return type(message).__name__
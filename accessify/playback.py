@@ -1,40 +1,55 @@
-import collections
 import logging
 
-import pykka
-import pyperclip
-
+from accessify.metrics import MeasuredActor
+from accessify.playback_queue import ContextLoader, PlaybackQueue, QueuedContext, item_for_uri, queue_entry
 from accessify.signalling import Signalman
-from accessify import spotify
+from accessify.spotify import backends
 from accessify.spotify.eventmanager import EventType, PlaybackState
 from accessify.spotify import exceptions
 from accessify.spotify.remote import PlaybackCommand
+from accessify.spotify.webapi import exceptions as webapi_exceptions
 
 
 logger = logging.getLogger(__name__)
 
 
-class PlaybackController(pykka.ThreadingActor):
+class PlaybackController(MeasuredActor):
     use_daemon_thread = True
 
-    def __init__(self, signalman, config):
+    def __init__(self, signalman, config, api_client=None, backend=None, queue_path=None):
         super().__init__()
         self._signalman = signalman
         self.config = config
-        self.playback_queue = collections.deque()
+        if backend is None:
+            backend = backends.create_backend(config, api_client)
+        self.backend = backend
+        self.playback_queue = PlaybackQueue(queue_path, ContextLoader(api_client) if api_client is not None else None)
         self.current_track = None
         self._connected = None
+        self._event_manager = None
+
+    def get_statistics(self):
+        if self._event_manager is None:
+            return {}
+        return {
+            'polling': self._event_manager.polling_stats,
+            'reconnection': self._event_manager.reconnect_stats,
+        }
+
+    def log_statistics(self):
+        for name, stats in self.get_statistics().items():
+            logger.info('Spotify {0} statistics: {1}'.format(name, stats))
 
     def connect_to_spotify(self):
         try:
-            self.spotify = spotify.remote.RemoteBridge(spotify.remote.find_listening_port())
-        except spotify.remote.exceptions.SpotifyNotRunningError as e:
+            event_manager = self.backend.connect()
+        except exceptions.SpotifyNotRunningError as e:
             self._signalman.spotify_not_running.send()
             return
 
-        event_manager = spotify.eventmanager.EventManager(self.spotify, self.config.get('spotify_polling_interval'))
         self._connect_spotify_events(event_manager)
         event_manager.start()
+        self._event_manager = event_manager
 
     def _connect_spotify_events(self, event_manager):
         event_manager.subscribe(EventType.PLAY, self.on_play)
@@ -42,6 +57,10 @@ class PlaybackController(pykka.ThreadingActor):
         event_manager.subscribe(EventType.STOP, self.on_stop)
         event_manager.subscribe(EventType.TRACK_CHANGE, self.on_track_change)
         event_manager.subscribe(EventType.ERROR, self.on_error)
+        event_manager.subscribe(EventType.VOLUME_CHANGE, self._signalman.volume_changed.send)
+        event_manager.subscribe(EventType.SHUFFLE_CHANGE, self._signalman.shuffle_changed.send)
+        event_manager.subscribe(EventType.REPEAT_CHANGE, self._signalman.repeat_changed.send)
+        event_manager.subscribe(EventType.SEEK, self._signalman.position_changed.send)
 
     def on_play(self, track):
         if not self._connected:
@@ -82,10 +101,20 @@ class PlaybackController(pykka.ThreadingActor):
             self._signalman.error.send(exception)
 
     def _advance_playback_queue(self):
-        try:
-            return self.playback_queue.popleft()
-        except IndexError:
-            return None
+        return self.playback_queue.popleft()
+
+    def upcoming_items(self, count):
+        # Albums and playlists are left unexpanded, so this never waits on the Web API
+        return self.playback_queue.entries(0, count)
+
+    def queued_items(self, offset=0, count=50):
+        return self.playback_queue.peek(count, offset)
+
+    def remove_queued_item(self, position):
+        return self.playback_queue.pop(position)
+
+    def move_queued_item(self, position, new_position):
+        self.playback_queue.move(position, new_position)
 
     def clear_queue(self):
         self.playback_queue.clear()
@@ -95,43 +124,90 @@ class PlaybackController(pykka.ThreadingActor):
 
     def play_uri(self, uri, context=None):
         try:
-            self.spotify.play_uri(uri, context)
+            self.backend.play_uri(uri, context)
         except exceptions.SpotifyError as e:
             logger.error('Error while trying to play URI {0} with context {1}'.format(uri, context), exc_info=True)
-            self.on_error(e_)
+            self.on_error(e)
+
+    def queue_item(self, item, context=None, position=None):
+        if not self.backend.native_queue:
+            if position is None:
+                self.playback_queue.append(item)
+            else:
+                self.playback_queue.insert(position, item)
+            return
+        for track in self._native_queue_tracks(item):
+            try:
+                self.backend.queue_uri(track.uri)
+            except exceptions.SpotifyError as e:
+                logger.error('Error while trying to queue URI {0}'.format(track.uri), exc_info=True)
+                self.on_error(e)
+                return
+
+    def _native_queue_tracks(self, item):
+        """
+        Return the tracks to add to Spotify's own queue for item, which only takes tracks, so albums and playlists are expanded up front.
+        """
+        entry = queue_entry(item)
+        if not isinstance(entry, QueuedContext):
+            return [item]
+        loader = self.playback_queue.loader
+        if loader is None:
+            logger.error('Cannot queue {0}: only tracks can be added to the Spotify queue, and there is no Web API client to list its tracks'.format(entry.uri))
+            return []
+        tracks = []
+        try:
+            while entry is not None:
+                page, entry = loader.load_page(entry)
+                tracks.extend(page)
+        except (webapi_exceptions.APIError, OSError):
+            logger.error('Could not list the tracks of {0} to queue them'.format(item.uri), exc_info=True)
+            return []
+        return tracks
+
+    def queue_items(self, items):
+        if not self.backend.native_queue:
+            self.playback_queue.extend(items)
+            return
+        for item in items:
+            self.queue_item(item)
 
-    def queue_item(self, item, context=None):
-        self.playback_queue.append(item)
+    def queue_uris(self, uris):
+        """
+        Queue each URI, with albums and playlists expanded into their tracks only as they're reached.
+        """
+        self.queue_items([item_for_uri(uri) for uri in uris])
 
     def copy_current_track_uri(self):
         if self.current_track is not None:
             self.copy_item_uri(self.current_track)
 
     def copy_item_uri(self, item):
+        import pyperclip
         pyperclip.copy(item.uri)
 
     def play_pause(self):
-        self.spotify.send_command(PlaybackCommand.PLAY_PAUSE)
+        self.backend.send_command(PlaybackCommand.PLAY_PAUSE)
 
     def previous_track(self):
-        self.spotify.send_command(PlaybackCommand.PREV_TRACK)
+        self.backend.send_command(PlaybackCommand.PREV_TRACK)
 
     def next_track(self):
-        self.spotify.send_command(PlaybackCommand.NEXT_TRACK)
+        self.backend.send_command(PlaybackCommand.NEXT_TRACK)
 
     def seek_backward(self):
-        self.spotify.send_command(PlaybackCommand.SEEK_BACKWARD)
+        self.backend.send_command(PlaybackCommand.SEEK_BACKWARD)
 
     def seek_forward(self):
-        self.spotify.send_command(PlaybackCommand.SEEK_FORWARD)
+        self.backend.send_command(PlaybackCommand.SEEK_FORWARD)
 
     def increase_volume(self):
-        self.spotify.send_command(PlaybackCommand.VOLUME_UP)
+        self.backend.send_command(PlaybackCommand.VOLUME_UP)
 
     def decrease_volume(self):
-        self.spotify.send_command(PlaybackCommand.VOLUME_DOWN)
+        self.backend.send_command(PlaybackCommand.VOLUME_DOWN)
 
 
 class PlaybackSignalman(Signalman):
-    signals = ('state_changed', 'track_changed', 'unplayable_content', 'connection_established', 'spotify_not_running', 'error')
+    signals = ('state_changed', 'track_changed', 'unplayable_content', 'connection_established', 'spotify_not_running', 'error', 'volume_changed', 'shuffle_changed', 'repeat_changed', 'position_changed')
 
@@ -0,0 +1,416 @@
+"""
+The playback queue used with backends which have no queue of their own, kept on disk so that it survives a restart.
+
+Entries are usually tracks.  An album or playlist is queued as a single QueuedContext and only replaced with its tracks a page at a time as the front of the queue reaches it, so queueing one with thousands of tracks is as quick as queueing one track.
+
+Every change is appended to a journal as one line of JSON, and the journal is rewritten as a snapshot of the whole queue when it grows to several times the queue's length.
+"""
+
+from collections import deque
+from itertools import islice
+import logging
+import os
+from typing import NamedTuple
+
+import ujson as json
+
+from accessify import library
+from accessify import structures
+from accessify.spotify.utils import split_uri
+from accessify.spotify.webapi import exceptions
+
+
+logger = logging.getLogger(__name__)
+
+QUEUE_FILENAME = 'playback_queue.jsonl'
+BLOCK_SIZE = 256
+# The journal is compacted when it has more entries than this or twice the queue's length, whichever is larger
+COMPACT_AFTER = 1000
+ALBUM_PAGE_SIZE = 50
+CONTEXT_TYPES = ('album', 'playlist')
+
+
+class QueuedContext(NamedTuple):
+    uri: str
+    name: str
+    # How many of its tracks have already been taken into the queue
+    offset: int = 0
+
+
+class IndexedList:
+    """
+    A sequence stored as blocks of up to a few hundred items, with a Fenwick tree of block lengths for finding the block which holds a position.
+
+    Appending and popping from the front take constant time, as they only touch the first or last block and are accounted for by two counters rather than in the tree.  Inserting or removing elsewhere, and indexing, take O(log n).  The tree is rebuilt when blocks are added or removed, which happens at most once every BLOCK_SIZE operations.
+    """
+
+    def __init__(self, items=()):
+        self._blocks = []
+        self._length = 0
+        self._tree = None
+        # Items popped from the first block and appended to the last since the tree was built, which the tree doesn't know about
+        self._front_removed = 0
+        self._back_added = 0
+        for item in items:
+            self.append(item)
+
+    def __len__(self):
+        return self._length
+
+    def __iter__(self):
+        for block in self._blocks:
+            yield from block
+
+    def __getitem__(self, position):
+        block_index, offset = self._locate(self._check_position(position))
+        return self._blocks[block_index][offset]
+
+    def slice(self, start, count):
+        if start >= self._length or count <= 0:
+            return []
+        block_index, offset = self._locate(start)
+        items = list(islice(self._blocks[block_index], offset, offset + count))
+        for block in islice(self._blocks, block_index + 1, None):
+            if len(items) >= count:
+                break
+            items.extend(islice(block, count - len(items)))
+        return items
+
+    def append(self, item):
+        if self._blocks and len(self._blocks[-1]) < BLOCK_SIZE:
+            self._blocks[-1].append(item)
+            self._back_added += 1
+        else:
+            self._blocks.append(deque([item]))
+            self._invalidate()
+        self._length += 1
+
+    def popleft(self):
+        if not self._length:
+            raise IndexError('pop from an empty queue')
+        first = self._blocks[0]
+        item = first.popleft()
+        self._length -= 1
+        if first:
+            self._front_removed += 1
+        else:
+            del self._blocks[0]
+            self._invalidate()
+        return item
+
+    def insert(self, position, item):
+        """
+        Insert item before position, clamped to the queue as with list.insert().
+        """
+        if position < 0:
+            position = max(0, position + self._length)
+        if position >= self._length:
+            self.append(item)
+            return
+        block_index, offset = self._locate(position)
+        block = self._blocks[block_index]
+        block.insert(offset, item)
+        self._length += 1
+        if len(block) > 2 * BLOCK_SIZE:
+            self._blocks[block_index:block_index + 1] = [deque(islice(block, BLOCK_SIZE)), deque(islice(block, BLOCK_SIZE, None))]
+            self._invalidate()
+        elif block_index == len(self._blocks) - 1:
+            self._back_added += 1
+        else:
+            self._add(block_index, 1)
+
+    def pop(self, position):
+        position = self._check_position(position)
+        if position == 0:
+            return self.popleft()
+        block_index, offset = self._locate(position)
+        block = self._blocks[block_index]
+        item = block[offset]
+        del block[offset]
+        self._length -= 1
+        if not block:
+            del self._blocks[block_index]
+            self._invalidate()
+        elif block_index == len(self._blocks) - 1 and self._back_added:
+            self._back_added -= 1
+        else:
+            self._add(block_index, -1)
+        return item
+
+    def clear(self):
+        self._blocks = []
+        self._length = 0
+        self._invalidate()
+
+    def _check_position(self, position):
+        if position < 0:
+            position += self._length
+        if not 0 <= position < self._length:
+            raise IndexError('queue position out of range')
+        return position
+
+    def _invalidate(self):
+        self._tree = None
+
+    def _build(self):
+        tree = [0] * (len(self._blocks) + 1)
+        for index, block in enumerate(self._blocks, 1):
+            tree[index] += len(block)
+            parent = index + (index & -index)
+            if parent < len(tree):
+                tree[parent] += tree[index]
+        self._tree = tree
+        self._front_removed = 0
+        self._back_added = 0
+
+    def _add(self, block_index, amount):
+        tree = self._tree
+        index = block_index + 1
+        while index < len(tree):
+            tree[index] += amount
+            index += index & -index
+
+    def _locate(self, position):
+        """
+        Return (block index, index within the block) of a position which is in range.
+        """
+        if self._tree is None:
+            self._build()
+        from_end = self._length - position
+        if from_end <= self._back_added:
+            return len(self._blocks) - 1, len(self._blocks[-1]) - from_end
+        # Search the tree for the last block starting at or before the position, as the tree sees it
+        tree = self._tree
+        target = position + self._front_removed
+        block_index = 0
+        step = 1 << (len(tree) - 1).bit_length()
+        while step:
+            candidate = block_index + step
+            if candidate < len(tree) and tree[candidate] <= target:
+                block_index = candidate
+                target -= tree[candidate]
+            step >>= 1
+        if block_index == 0:
+            target -= self._front_removed
+        return block_index, target
+
+
+class ContextLoader:
+    """
+    Fetches the tracks of queued albums and playlists a page at a time.
+    """
+
+    def __init__(self, api_client):
+        self.api_client = api_client
+
+    def load_page(self, context):
+        """
+        Return the tracks on the next page of context, and a QueuedContext for the rest or None if that was the last page.
+        """
+        kind, item_id = split_uri(context.uri)
+        if kind == 'album':
+            page = self.api_client.album_tracks(item_id, limit=ALBUM_PAGE_SIZE, offset=context.offset)
+            album = structures.Album(artists=[], name=context.name, uri=context.uri)
+            tracks = [library.deserialize_album_track(track, album) for track in page['items']]
+        else:
+            page = self.api_client.playlist_tracks(item_id, offset=context.offset, fields=library.PLAYLIST_TRACKS_PAGE_FIELDS)
+            tracks = [library.deserialize_track(item['track']) for item in page['items'] if item['track'] is not None]
+        if page['next'] is None or not page['items']:
+            return tracks, None
+        return tracks, context._replace(offset=context.offset + len(page['items']))
+
+
+class PlaybackQueue:
+    """
+    Without a path, the queue is only kept in memory.  Without a loader, queued albums and playlists aren't expanded and are played as a whole when they reach the front.
+    """
+
+    def __init__(self, path=None, loader=None):
+        self.path = path
+        self.loader = loader
+        self._items = IndexedList(load_journal(path) if path is not None else ())
+        self._journal = None
+        self._journal_entries = 0
+        if path is not None:
+            self._compact()
+
+    def __len__(self):
+        return len(self._items)
+
+    def __iter__(self):
+        return iter(self._items)
+
+    def append(self, item):
+        self.extend([item])
+
+    def extend(self, items):
+        entries = [queue_entry(item) for item in items]
+        for entry in entries:
+            self._items.append(entry)
+        self._record('append', [encode_item(entry) for entry in entries])
+
+    def insert(self, position, item):
+        position = min(max(0, position if position >= 0 else position + len(self._items)), len(self._items))
+        self._splice(position, 0, [queue_entry(item)])
+
+    def pop(self, position):
+        item = self._items[position]
+        self._splice(position % len(self._items), 1, [])
+        return item
+
+    def move(self, position, new_position):
+        item = self.pop(position)
+        self.insert(new_position, item)
+
+    def popleft(self):
+        """
+        Remove and return the next item to play, or None if the queue is empty.
+        """
+        self._expand_front(1)
+        if not self._items:
+            return None
+        return self.pop(0)
+
+    def peek(self, count, start=0):
+        """
+        Return up to count items from start, expanding any albums or playlists among them first.
+        """
+        self._expand_front(start + count)
+        return self._items.slice(start, count)
+
+    def entries(self, start, count):
+        """
+        Like peek(), but without expanding anything, so albums and playlists come back as QueuedContext.
+        """
+        return self._items.slice(start, count)
+
+    def clear(self):
+        self._items.clear()
+        self._record('clear')
+
+    def _expand_front(self, count):
+        position = 0
+        while position < min(count, len(self._items)):
+            entry = self._items[position]
+            if not isinstance(entry, QueuedContext) or self.loader is None:
+                position += 1
+                continue
+            try:
+                tracks, remaining = self.loader.load_page(entry)
+            except (exceptions.APIError, OSError):
+                logger.warning('Could not load the tracks of %s, which will be played as a whole', entry.uri, exc_info=True)
+                return
+            self._splice(position, 1, tracks + ([remaining] if remaining is not None else []))
+
+    def _splice(self, position, delete_count, entries):
+        for index in range(delete_count):
+            self._items.pop(position)
+        for offset, entry in enumerate(entries):
+            self._items.insert(position + offset, entry)
+        self._record('splice', position, delete_count, [encode_item(entry) for entry in entries])
+
+    def _record(self, operation, *arguments):
+        if self._journal is None:
+            return
+        try:
+            self._journal.write(json.dumps([operation] + list(arguments)))
+            self._journal.write('\n')
+            self._journal.flush()
+        except OSError:
+            logger.warning('Could not save the playback queue to %s', self.path, exc_info=True)
+            return
+        self._journal_entries += 1
+        if self._journal_entries > max(COMPACT_AFTER, 2 * len(self._items)):
+            self._compact()
+
+    def _compact(self):
+        if self._journal is not None:
+            self._journal.close()
+            self._journal = None
+        temporary_path = '{0}.tmp'.format(self.path)
+        try:
+            with open(temporary_path, 'w', encoding='utf-8') as f:
+                f.write(json.dumps(['snapshot', [encode_item(item) for item in self._items]]))
+                f.write('\n')
+            os.replace(temporary_path, self.path)
+            self._journal = open(self.path, 'a', encoding='utf-8')
+        except OSError:
+            logger.warning('Could not save the playback queue to %s, so it will only be kept in memory', self.path, exc_info=True)
+            return
+        self._journal_entries = 0
+
+
+def queue_entry(item):
+    """
+    Return what goes in the queue for item, a QueuedContext for albums and playlists or the item itself.
+    """
+    if isinstance(item, QueuedContext):
+        return item
+    parts = split_uri(item.uri)
+    if parts is not None and parts[0] in CONTEXT_TYPES:
+        return QueuedContext(uri=item.uri, name=item.name)
+    return item
+
+
+def item_for_uri(uri):
+    """
+    Return a queueable item for a bare URI, with the URI in place of the name until its metadata is known.
+    """
+    parts = split_uri(uri)
+    if parts is not None and parts[0] in CONTEXT_TYPES:
+        return QueuedContext(uri=uri, name=uri)
+    return structures.Track(artists=[], name=uri, uri=uri)
+
+
+def encode_artists(artists):
+    return [[artist.name, artist.uri] for artist in artists]
+
+
+def decode_artists(artists):
+    return [structures.Artist(name=name, uri=uri) for name, uri in artists]
+
+
+def encode_item(item):
+    if isinstance(item, QueuedContext):
+        return ['context', item.uri, item.name, item.offset]
+    album = getattr(item, 'album', None)
+    encoded_album = [album.name, album.uri, encode_artists(album.artists)] if album is not None else None
+    return ['track', item.uri, item.name, getattr(item, 'length', None), encode_artists(getattr(item, 'artists', [])), encoded_album]
+
+
+def decode_item(encoded):
+    if encoded[0] == 'context':
+        kind, uri, name, offset = encoded
+        return QueuedContext(uri=uri, name=name, offset=offset)
+    kind, uri, name, length, artists, album = encoded
+    if album is not None:
+        album = structures.Album(artists=decode_artists(album[2]), name=album[0], uri=album[1])
+    return structures.Track(artists=decode_artists(artists), name=name, uri=uri, album=album, length=length)
+
+
+def load_journal(path):
+    """
+    Replay the journal at path and return the items in the queue, or as many as could be read.
+    """
+    items = IndexedList()
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            for line in f:
+                operation = json.loads(line)
+                if operation[0] in ('snapshot', 'append'):
+                    for encoded in operation[1]:
+                        items.append(decode_item(encoded))
+                elif operation[0] == 'splice':
+                    position, delete_count, entries = operation[1:]
+                    for index in range(delete_count):
+                        items.pop(position)
+                    for offset, encoded in enumerate(entries):
+                        items.insert(position + offset, decode_item(encoded))
+                elif operation[0] == 'clear':
+                    items.clear()
+    except FileNotFoundError:
+        pass
+    except (OSError, ValueError, IndexError, TypeError):
+        # A crash part way through writing a line leaves it incomplete, and everything before it is still good
+        logger.warning('Stopped reading the playback queue from %s at an unreadable entry', path, exc_info=True)
+    return items
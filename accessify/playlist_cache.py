@@ -0,0 +1,150 @@
+"""
+A local cache of the tracks in playlists, kept per playlist URI along with the snapshot ID of the version they were fetched from.
+
+Spotify gives each version of a playlist a new snapshot ID, so if a playlist's snapshot ID is the same as when its tracks were cached, they can be shown without paging through them again.  Each playlist is stored on disk in a file of its own, with every artist and album written once and referred to by position, and the most recently used playlists are also kept in memory.
+"""
+
+from collections import OrderedDict
+import hashlib
+import logging
+import os
+import os.path
+import threading
+from typing import List, NamedTuple
+
+import ujson as json
+
+from accessify import structures
+
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_IN_MEMORY = 20
+# Bump when the layout of the files changes, so that old ones are ignored rather than misread
+FORMAT_VERSION = 1
+
+
+class CachedPlaylist(NamedTuple):
+    snapshot_id: str
+    tracks: List[structures.Track]
+
+
+class PlaylistTrackCache:
+    """
+    Without a directory, playlists are only cached in memory.  Safe to share between threads and actors.
+    """
+
+    def __init__(self, directory=None, max_in_memory=DEFAULT_MAX_IN_MEMORY):
+        self.directory = directory
+        self.max_in_memory = max_in_memory
+        self._playlists = OrderedDict()
+        self._lock = threading.Lock()
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+
+    def get(self, playlist_uri):
+        """
+        Return the CachedPlaylist for playlist_uri, or None if it hasn't been cached.
+        """
+        with self._lock:
+            cached = self._playlists.get(playlist_uri)
+            if cached is not None:
+                self._playlists.move_to_end(playlist_uri)
+                return cached
+        cached = self._load(playlist_uri)
+        if cached is not None:
+            self._remember(playlist_uri, cached)
+        return cached
+
+    def store(self, playlist_uri, snapshot_id, tracks):
+        cached = CachedPlaylist(snapshot_id, list(tracks))
+        self._remember(playlist_uri, cached)
+        if self.directory is not None:
+            self._save(playlist_uri, cached)
+        return cached
+
+    def discard(self, playlist_uri):
+        with self._lock:
+            self._playlists.pop(playlist_uri, None)
+        if self.directory is not None:
+            try:
+                os.remove(self.get_path(playlist_uri))
+            except OSError:
+                pass
+
+    def get_path(self, playlist_uri):
+        # Playlist URIs contain colons, which Windows doesn't allow in filenames
+        return os.path.join(self.directory, '{0}.json'.format(hashlib.sha1(playlist_uri.encode('utf-8')).hexdigest()))
+
+    def _remember(self, playlist_uri, cached):
+        with self._lock:
+            self._playlists[playlist_uri] = cached
+            self._playlists.move_to_end(playlist_uri)
+            while len(self._playlists) > self.max_in_memory:
+                self._playlists.popitem(last=False)
+
+    def _load(self, playlist_uri):
+        if self.directory is None:
+            return None
+        try:
+            with open(self.get_path(playlist_uri), 'r', encoding='utf-8') as f:
+                stored = json.load(f)
+            if stored['version'] != FORMAT_VERSION or stored['uri'] != playlist_uri:
+                return None
+            return CachedPlaylist(stored['snapshot_id'], decode_tracks(stored))
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError, KeyError, IndexError, TypeError):
+            logger.warning('Ignoring unreadable cached tracks for %s', playlist_uri, exc_info=True)
+            return None
+
+    def _save(self, playlist_uri, cached):
+        stored = encode_tracks(cached.tracks)
+        stored.update(version=FORMAT_VERSION, uri=playlist_uri, snapshot_id=cached.snapshot_id)
+        path = self.get_path(playlist_uri)
+        temporary_path = '{0}.{1}'.format(path, threading.get_ident())
+        try:
+            with open(temporary_path, 'w', encoding='utf-8') as f:
+                json.dump(stored, f)
+            os.replace(temporary_path, path)
+        except OSError:
+            logger.warning('Could not save cached tracks for %s', playlist_uri, exc_info=True)
+
+
+def encode_tracks(tracks):
+    """
+    Return a dict of lists representing tracks, with each distinct artist and album included only once.
+    """
+    artists, artist_indexes = [], {}
+    albums, album_indexes = [], {}
+
+    def artist_index(artist):
+        index = artist_indexes.get(artist)
+        if index is None:
+            index = artist_indexes[artist] = len(artists)
+            artists.append([artist.name, artist.uri])
+        return index
+
+    def album_index(album):
+        if album is None:
+            return None
+        # Albums hold a list of artists, so can't be dict keys themselves
+        key = (album.name, album.uri, tuple(album.artists))
+        index = album_indexes.get(key)
+        if index is None:
+            album_artists = [artist_index(artist) for artist in album.artists]
+            index = album_indexes[key] = len(albums)
+            albums.append([album.name, album.uri, album_artists])
+        return index
+
+    rows = [[track.name, track.uri, track.length, [artist_index(artist) for artist in track.artists], album_index(track.album), track.type] for track in tracks]
+    return {'artists': artists, 'albums': albums, 'tracks': rows}
+
+
+def decode_tracks(stored):
+    artists = [structures.Artist(name=name, uri=uri) for name, uri in stored['artists']]
+    albums = [structures.Album(artists=[artists[index] for index in album_artists], name=name, uri=uri) for name, uri, album_artists in stored['albums']]
+    return [
+        structures.Track(artists=[artists[index] for index in track_artists], name=name, uri=uri, album=albums[album] if album is not None else None, length=length, type=track_type)
+        for name, uri, length, track_artists, album, track_type in stored['tracks']
+    ]
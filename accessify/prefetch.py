@@ -0,0 +1,129 @@
+"""
+Prefetching of what the user is likely to look at next when the track changes.
+
+Straight after a track change people often go to the album, the artist, or what's coming up next.  Prefetcher requests the album's tracks, the artist's top tracks and the metadata of the next items in the playback queue, and stores the responses in the Web API client's cache, so that those views can be shown without waiting on the network.
+"""
+
+import logging
+import threading
+
+from accessify import metrics
+from accessify.spotify.utils import split_uri
+from accessify.spotify.webapi import exceptions
+
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_REQUEST_BUDGET = 3
+DEFAULT_LOOKAHEAD = 5
+# Give the requests the user makes straight after a track change a head start
+DEFAULT_DELAY = 1
+# How long prefetched responses are served without a request
+DEFAULT_FRESH_FOR = 10 * 60
+
+
+class Prefetcher:
+    """
+    Prefetches on a low priority thread of its own, one request at a time, making at most budget requests per track change.  A newer track change cancels whatever is left of the prefetching for the one before.
+
+    upcoming_items, if given, is called with a count from the prefetching thread and should return that many of the items which will play next.
+    """
+
+    def __init__(self, api_client, upcoming_items=None, budget=DEFAULT_REQUEST_BUDGET, lookahead=DEFAULT_LOOKAHEAD, delay=DEFAULT_DELAY, fresh_for=DEFAULT_FRESH_FOR):
+        self.api_client = api_client
+        self.upcoming_items = upcoming_items
+        self.budget = budget
+        self.lookahead = lookahead
+        self.delay = delay
+        self.fresh_for = fresh_for
+        self._condition = threading.Condition()
+        self._generation = 0
+        self._pending_track = None
+        self._stopping = False
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='Prefetcher', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        with self._condition:
+            self._stopping = True
+            self._generation += 1
+            self._condition.notify_all()
+        if self._thread is not None:
+            self._thread.join()
+
+    def on_track_changed(self, track, **kwargs):
+        if track is None:
+            return
+        with self._condition:
+            self._generation += 1
+            self._pending_track = track
+            self._condition.notify_all()
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while self._pending_track is None and not self._stopping:
+                    self._condition.wait()
+                if self._stopping:
+                    return
+                track, generation = self._pending_track, self._generation
+                self._pending_track = None
+                # Waiting on the condition means a newer track change cuts the delay short
+                self._condition.wait_for(lambda: self._generation != generation, self.delay)
+                if self._generation != generation:
+                    continue
+            try:
+                self.prefetch(track, generation)
+            except Exception:
+                logger.exception('Error while prefetching for %s', track.uri)
+
+    def cancelled(self, generation):
+        return generation is not None and generation != self._generation
+
+    def plan(self, track):
+        """
+        Return (name, callable) for each request to prefetch for track, most useful first.  A callable returns False if it turned out to have nothing to request.
+        """
+        steps = []
+        album = split_uri(track.album.uri) if track.album is not None and track.album.uri else None
+        if album is not None:
+            steps.append(('album_tracks', lambda: self.api_client.album_tracks(album[1], fresh_for=self.fresh_for)))
+        artist = split_uri(track.artists[0].uri) if track.artists and track.artists[0].uri else None
+        if artist is not None:
+            steps.append(('artist_top_tracks', lambda: self.api_client.artist_top_tracks(artist[1], fresh_for=self.fresh_for)))
+        if self.upcoming_items is not None and self.lookahead:
+            steps.append(('upcoming_tracks', self._prefetch_upcoming))
+        return steps
+
+    def _prefetch_upcoming(self):
+        track_ids = []
+        for item in self.upcoming_items(self.lookahead):
+            parts = split_uri(item.uri)
+            if parts is not None and parts[0] == 'track':
+                track_ids.append(parts[1])
+        if not track_ids:
+            return False
+        return self.api_client.tracks(track_ids, fresh_for=self.fresh_for)
+
+    def prefetch(self, track, generation=None):
+        """
+        Prefetch for track on the calling thread, stopping early if generation is given and a newer track change arrives.  Returns the number of requests made.
+        """
+        made = 0
+        for name, step in self.plan(track):
+            if self.cancelled(generation):
+                metrics.registry.counter('prefetch_cancelled_total', 'Prefetching cut short by a newer track change').inc()
+                break
+            if made >= self.budget:
+                break
+            try:
+                if step() is False:
+                    continue
+            except exceptions.APIError as e:
+                logger.debug('Prefetching %s failed: %s', name, e)
+            made += 1
+            metrics.registry.counter('prefetch_requests_total', 'Requests made to prefetch content related to the playing track', labels={'request': name}).inc()
+        return made
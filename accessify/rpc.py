@@ -0,0 +1,362 @@
+"""
+A JSON-RPC service exposing PlaybackController and LibraryController to other processes.
+
+Connections are made to a loopback TCP socket whose port is published in the endpoint file described in accessify.ipc.  The first call on a connection must be authenticate, with the token from that file, so that only processes which can read the user's config directory can use the service.  After subscribe, signals sent by the controllers' signalmen are streamed to the connection as event notifications.
+"""
+
+from enum import Enum
+import inspect
+import logging
+import os
+import queue
+import secrets
+import socket
+import socketserver
+import threading
+
+from accessify import constants
+from accessify import ipc
+from accessify import metrics
+from accessify import structures
+from accessify import tracing
+from accessify import uri_import
+from accessify.library import SearchType
+from accessify.spotify.utils import split_uri
+
+
+logger = logging.getLogger(__name__)
+
+# Events waiting to be written to a connection beyond which new ones are dropped, so that a client which stops reading can't hold up the controllers
+MAX_PENDING_EVENTS = 1000
+# The kinds of item an import can add to the playback queue, and to a playlist
+QUEUE_IMPORT_KINDS = ('track', 'album', 'playlist')
+PLAYLIST_IMPORT_KINDS = ('track',)
+PLAYBACK_COMMANDS = ('play_pause', 'next_track', 'previous_track', 'seek_forward', 'seek_backward', 'increase_volume', 'decrease_volume', 'clear_queue')
+
+item_types = {
+    'artist': structures.Artist,
+    'album': structures.Album,
+    'track': structures.Track,
+    'playlist': structures.Playlist,
+}
+
+
+def to_json(value):
+    """
+    Convert results and signal arguments to something JSON can represent.  Items from structures become dicts with their type in kind, and enums with numeric values such as PlaybackState become their lower-cased names.
+    """
+    if isinstance(value, Enum):
+        return value.value if isinstance(value.value, str) else value.name.lower()
+    if isinstance(value, structures.ItemCollection):
+        return {'items': [to_json(item) for item in value], 'total': value.total}
+    if hasattr(value, '_asdict'):
+        item = {key: to_json(field) for key, field in value._asdict().items()}
+        item['kind'] = type(value).__name__.lower()
+        return item
+    if isinstance(value, (list, tuple)):
+        return [to_json(element) for element in value]
+    if isinstance(value, dict):
+        return {key: to_json(element) for key, element in value.items()}
+    if isinstance(value, BaseException):
+        return {'error': type(value).__name__, 'message': str(value)}
+    return value
+
+
+def item_from_json(value):
+    """
+    Rebuild an item converted by to_json().  A bare URI becomes a Track with no metadata, which is all the playback queue needs.
+    """
+    if isinstance(value, str):
+        return structures.Track(artists=[], name=value, uri=value)
+    if not isinstance(value, dict) or value.get('kind') not in item_types:
+        raise ipc.RPCError(ipc.INVALID_PARAMS, 'Expected a URI or an item with a kind of {0}'.format(', '.join(item_types)))
+    fields = {key: field for key, field in value.items() if key != 'kind'}
+    if 'artists' in fields:
+        fields['artists'] = [item_from_json(dict(artist, kind='artist')) for artist in fields['artists']]
+    if fields.get('album') is not None:
+        fields['album'] = item_from_json(fields['album'])
+    try:
+        return item_types[value['kind']](**fields)
+    except TypeError as e:
+        raise ipc.RPCError(ipc.INVALID_PARAMS, str(e))
+
+
+def error_response(request_id, code, message):
+    return {'jsonrpc': ipc.JSONRPC_VERSION, 'id': request_id, 'error': ipc.RPCError(code, message).to_json()}
+
+
+class RPCServer:
+    """
+    Serves the methods named rpc_* below plus PLAYBACK_COMMANDS, on a thread per connection.  Calls on one connection are handled in the order they arrive, so clients wanting several at once should open several connections.
+
+    on_shutdown, if given, is called when a client asks the application to exit.  info is added to the result of authenticate, e.g. to give the handle of the main window.
+    """
+
+    def __init__(self, playback, library, signalmen, endpoint_path, on_shutdown=None, port=0, info=None):
+        self.playback = playback
+        self.library = library
+        self.signals = {name: getattr(signalman, name) for signalman in signalmen for name in signalman.signals}
+        self.endpoint_path = endpoint_path
+        self.on_shutdown = on_shutdown
+        self.port = port
+        self.info = info or {}
+        self.token = secrets.token_hex(16)
+        self._server = None
+        self._connections = set()
+        self._lock = threading.Lock()
+
+    def start(self):
+        self._server = _ThreadingTCPServer((ipc.LOOPBACK_ADDRESS, self.port), RPCConnection)
+        self._server.rpc = self
+        self.port = self._server.server_address[1]
+        threading.Thread(target=self._server.serve_forever, name='RPC server', daemon=True).start()
+        ipc.write_endpoint(self.endpoint_path, self.port, self.token)
+        logger.info('Serving JSON-RPC on {0}:{1}'.format(ipc.LOOPBACK_ADDRESS, self.port))
+
+    def stop(self):
+        if self._server is None:
+            return
+        ipc.remove_endpoint(self.endpoint_path, self.token)
+        self._server.shutdown()
+        self._server.server_close()
+        with self._lock:
+            connections = list(self._connections)
+        for connection in connections:
+            connection.close()
+        self._server = None
+
+    def connection_opened(self, connection):
+        with self._lock:
+            self._connections.add(connection)
+        metrics.registry.gauge('rpc_connections', 'Open JSON-RPC connections').inc()
+
+    def connection_closed(self, connection):
+        self.unsubscribe(connection, connection.subscriptions)
+        with self._lock:
+            self._connections.discard(connection)
+        metrics.registry.gauge('rpc_connections', 'Open JSON-RPC connections').dec()
+
+    def handle_message(self, connection, line):
+        """
+        Handle one line received from a connection, returning the response to send or None for a notification.
+        """
+        try:
+            message = ipc.decode_message(line)
+        except ValueError:
+            return error_response(None, ipc.PARSE_ERROR, 'Parse error')
+        if not isinstance(message, dict) or not isinstance(message.get('method'), str):
+            return error_response(message.get('id') if isinstance(message, dict) else None, ipc.INVALID_REQUEST, 'Invalid request')
+        request_id = message.get('id')
+        try:
+            result = self.call(connection, message['method'], message.get('params', []))
+        except ipc.RPCError as e:
+            response = {'jsonrpc': ipc.JSONRPC_VERSION, 'id': request_id, 'error': e.to_json()}
+        except Exception as e:
+            logger.exception('Error handling JSON-RPC call to %s', message['method'])
+            response = error_response(request_id, ipc.INTERNAL_ERROR, str(e))
+        else:
+            response = {'jsonrpc': ipc.JSONRPC_VERSION, 'id': request_id, 'result': to_json(result)}
+        return response if 'id' in message else None
+
+    def call(self, connection, method, params):
+        if not connection.authenticated and method != 'authenticate':
+            raise ipc.RPCError(ipc.UNAUTHORISED, 'Call authenticate first')
+        if method in PLAYBACK_COMMANDS:
+            handler = self.send_playback_command
+            params = {'command': method}
+        else:
+            handler = getattr(self, 'rpc_{0}'.format(method), None)
+            if handler is None:
+                raise ipc.RPCError(ipc.METHOD_NOT_FOUND, 'No method named {0}'.format(method))
+        if isinstance(params, list):
+            args, kwargs = params, {}
+        elif isinstance(params, dict):
+            args, kwargs = [], params
+        else:
+            raise ipc.RPCError(ipc.INVALID_PARAMS, 'params must be an array or an object')
+        try:
+            inspect.signature(handler).bind(connection, *args, **kwargs)
+        except TypeError as e:
+            raise ipc.RPCError(ipc.INVALID_PARAMS, str(e))
+        histogram = metrics.registry.histogram('rpc_call_seconds', 'Time taken to handle a JSON-RPC call', labels={'method': method})
+        with histogram.time(), tracing.start_trace('rpc.{0}'.format(method)):
+            return handler(connection, *args, **kwargs)
+
+    def send_playback_command(self, connection, command):
+        return getattr(self.playback, command)().get(timeout=ipc.CALL_TIMEOUT)
+
+    def rpc_authenticate(self, connection, token):
+        if not isinstance(token, str) or not secrets.compare_digest(token, self.token):
+            raise ipc.RPCError(ipc.UNAUTHORISED, 'Invalid token')
+        connection.authenticated = True
+        return dict(self.info, name=constants.APP_NAME, version=constants.APP_VERSION, pid=os.getpid(), signals=sorted(self.signals))
+
+    def rpc_search(self, connection, query, type=SearchType.TRACK.value, offset=0):
+        try:
+            search_type = SearchType(type)
+        except ValueError:
+            raise ipc.RPCError(ipc.INVALID_PARAMS, 'Unknown search type {0}'.format(type))
+        return self.library.perform_search(query, search_type, offset).get(timeout=ipc.CALL_TIMEOUT)
+
+    def rpc_playlist_tracks(self, connection, uri):
+        parts = split_uri(uri)
+        if parts is None or parts[0] != 'playlist':
+            raise ipc.RPCError(ipc.INVALID_PARAMS, 'Not a playlist URI: {0}'.format(uri))
+        return self.library.get_playlist_tracks(uri).get(timeout=ipc.CALL_TIMEOUT)
+
+    def rpc_save_items(self, connection, uris):
+        return self.library.save_items(uris).get(timeout=ipc.CALL_TIMEOUT)
+
+    def rpc_remove_saved_items(self, connection, uris):
+        return self.library.remove_saved_items(uris).get(timeout=ipc.CALL_TIMEOUT)
+
+    def rpc_add_to_playlist(self, connection, playlist, uris, position=None):
+        return self.library.add_to_playlist(playlist, uris, position).get(timeout=ipc.CALL_TIMEOUT)
+
+    def rpc_remove_from_playlist(self, connection, playlist, uris):
+        return self.library.remove_from_playlist(playlist, uris).get(timeout=ipc.CALL_TIMEOUT)
+
+    def rpc_play_uri(self, connection, uri, context=None):
+        return self.playback.play_uri(uri, context).get(timeout=ipc.CALL_TIMEOUT)
+
+    def rpc_queue_item(self, connection, item, context=None, position=None):
+        return self.playback.queue_item(item_from_json(item), context, position).get(timeout=ipc.LONG_CALL_TIMEOUT)
+
+    def rpc_queue_uris(self, connection, uris):
+        return self.playback.queue_uris(uris).get(timeout=ipc.LONG_CALL_TIMEOUT)
+
+    def rpc_import_uris(self, connection, text, playlist=None):
+        """
+        Add the Spotify URIs and links in text to the playback queue, or the tracks among them to a playlist.  Returns counts of what was imported and the URIs which weren't.
+        """
+        if playlist is not None:
+            parts = split_uri(playlist)
+            if parts is None or parts[0] != 'playlist':
+                raise ipc.RPCError(ipc.INVALID_PARAMS, 'Not a playlist URI: {0}'.format(playlist))
+            result = self.library.resolve_uris(text, PLAYLIST_IMPORT_KINDS).get(timeout=ipc.LONG_CALL_TIMEOUT)
+            written = self.library.add_to_playlist(playlist, [item.uri for item in result.items]).get(timeout=ipc.LONG_CALL_TIMEOUT)
+            return uri_import.summarise(result, written)
+        result = self.library.resolve_uris(text, QUEUE_IMPORT_KINDS).get(timeout=ipc.LONG_CALL_TIMEOUT)
+        self.playback.queue_items(result.items).get(timeout=ipc.LONG_CALL_TIMEOUT)
+        return uri_import.summarise(result)
+
+    def rpc_queued_items(self, connection, offset=0, count=50):
+        return self.playback.queued_items(offset, count).get(timeout=ipc.CALL_TIMEOUT)
+
+    def rpc_remove_queued_item(self, connection, position):
+        try:
+            return self.playback.remove_queued_item(position).get(timeout=ipc.CALL_TIMEOUT)
+        except IndexError:
+            raise ipc.RPCError(ipc.INVALID_PARAMS, 'No queued item at position {0}'.format(position))
+
+    def rpc_move_queued_item(self, connection, position, new_position):
+        try:
+            return self.playback.move_queued_item(position, new_position).get(timeout=ipc.CALL_TIMEOUT)
+        except IndexError:
+            raise ipc.RPCError(ipc.INVALID_PARAMS, 'No queued item at position {0}'.format(position))
+
+    def rpc_current_track(self, connection):
+        return self.playback.current_track.get(timeout=ipc.CALL_TIMEOUT)
+
+    def rpc_begin_authorisation(self, connection):
+        return self.library.begin_authorisation().get(timeout=ipc.CALL_TIMEOUT)
+
+    def rpc_subscribe(self, connection, signals=None):
+        """
+        Start streaming the named signals, or all of them, to the connection.  Returns the names of the signals now subscribed to.
+        """
+        names = self._signal_names(signals)
+        for name in names:
+            if name not in connection.subscriptions:
+                receiver = event_sender(connection, name)
+                self.signals[name].connect(receiver, weak=False)
+                connection.subscriptions[name] = receiver
+        return sorted(connection.subscriptions)
+
+    def rpc_unsubscribe(self, connection, signals=None):
+        self.unsubscribe(connection, self._signal_names(signals))
+        return sorted(connection.subscriptions)
+
+    def rpc_shutdown(self, connection):
+        if self.on_shutdown is None:
+            raise ipc.RPCError(ipc.METHOD_NOT_FOUND, 'This instance can\'t be shut down remotely')
+        self.on_shutdown()
+
+    def unsubscribe(self, connection, names):
+        for name in list(names):
+            receiver = connection.subscriptions.pop(name, None)
+            if receiver is not None:
+                self.signals[name].disconnect(receiver)
+
+    def _signal_names(self, signals):
+        if signals is None:
+            return list(self.signals)
+        unknown = [name for name in signals if name not in self.signals]
+        if unknown:
+            raise ipc.RPCError(ipc.INVALID_PARAMS, 'Unknown signals: {0}'.format(', '.join(unknown)))
+        return signals
+
+
+def event_sender(connection, name):
+    def send(sender, **kwargs):
+        connection.send_event({'jsonrpc': ipc.JSONRPC_VERSION, 'method': ipc.EVENT_METHOD, 'params': {'signal': name, 'value': to_json(sender), 'kwargs': to_json(kwargs)}})
+    return send
+
+
+class _ThreadingTCPServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    daemon_threads = True
+
+
+class RPCConnection(socketserver.StreamRequestHandler):
+    """
+    Reads and handles calls on the connection's thread, while everything sent back goes through a queue to a writer thread of its own.  That way signals can be forwarded from controller threads without waiting on the client.
+    """
+
+    disable_nagle_algorithm = True
+
+    def setup(self):
+        super().setup()
+        self.rpc = self.server.rpc
+        self.authenticated = False
+        self.subscriptions = {}
+        self._outgoing = queue.Queue()
+        self._writer = threading.Thread(target=self._write, name='RPC writer', daemon=True)
+        self._writer.start()
+        self.rpc.connection_opened(self)
+
+    def handle(self):
+        for line in self.rfile:
+            if not line.strip():
+                continue
+            response = self.rpc.handle_message(self, line)
+            if response is not None:
+                self._outgoing.put(response)
+
+    def finish(self):
+        self.rpc.connection_closed(self)
+        self._outgoing.put(None)
+        self._writer.join()
+        super().finish()
+
+    def send_event(self, message):
+        if self._outgoing.qsize() >= MAX_PENDING_EVENTS:
+            metrics.registry.counter('rpc_events_dropped_total', 'Events not sent to a JSON-RPC client because it had too many waiting').inc()
+            return
+        self._outgoing.put(message)
+
+    def close(self):
+        try:
+            self.connection.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+    def _write(self):
+        while True:
+            message = self._outgoing.get()
+            if message is None:
+                return
+            try:
+                self.wfile.write(ipc.encode_message(message))
+            except OSError:
+                # The reader will notice too, and finish the connection
+                continue
@@ -1,8 +1,8 @@
-import blinker
+from accessify.metrics import MeasuredSignal
 
 
 class Signalman:
     def __init__(self):
         for sig in self.signals:
-            setattr(self, sig, blinker.Signal())
+            setattr(self, sig, MeasuredSignal(sig))
 
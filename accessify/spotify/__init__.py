@@ -1,3 +1,4 @@
+from accessify.spotify import backends
 from accessify.spotify import eventmanager
 from accessify.spotify import remote
 from accessify.spotify import webapi
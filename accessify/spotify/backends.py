@@ -0,0 +1,227 @@
+from abc import ABC, abstractmethod
+import contextlib
+import logging
+import threading
+import time
+
+import requests
+
+from accessify.spotify import exceptions
+from accessify.spotify import remote
+from accessify.spotify.eventmanager import EventManager, EventType
+from accessify.spotify.reconnection import ReconnectSupervisor
+from accessify.spotify.remote import PlaybackCommand
+from accessify.spotify.webapi import exceptions as webapi_exceptions
+
+
+logger = logging.getLogger(__name__)
+
+BACKEND_WEB_HELPER = 'web_helper'
+BACKEND_CONNECT = 'connect'
+
+CONNECT_POLLING_INTERVAL = 5
+CONNECT_IDLE_POLLING_INTERVAL = 15
+SEEK_STEP_MS = 10000
+VOLUME_STEP_PERCENT = 10
+
+
+class PlaybackBackend(ABC):
+    """
+    The means by which PlaybackController drives a Spotify player.
+
+    connect() returns an EventManager which has not yet been started, and raises exceptions.SpotifyNotRunningError if there's nothing to connect to.  Backends with native_queue set can add items to Spotify's own playback queue, otherwise PlaybackController keeps a queue of its own.
+    """
+
+    native_queue = False
+
+    @abstractmethod
+    def connect(self):
+        pass
+
+    @abstractmethod
+    def play_uri(self, uri, context=None):
+        pass
+
+    @abstractmethod
+    def queue_uri(self, uri):
+        pass
+
+    @abstractmethod
+    def send_command(self, command):
+        pass
+
+
+class WebHelperBackend(PlaybackBackend):
+    """
+    Plays content via the Spotify Web Helper and sends transport commands to the Spotify main window.
+    """
+
+    def __init__(self, polling_interval, idle_polling_interval, port_finder=remote.find_listening_port, bridge_factory=remote.RemoteBridge):
+        self.polling_interval = polling_interval
+        self.idle_polling_interval = idle_polling_interval
+        self._find_port = port_finder
+        self._create_bridge = bridge_factory
+        self.bridge = None
+
+    def connect(self):
+        self.bridge = self._create_bridge(self._find_port())
+        supervisor = ReconnectSupervisor(self.bridge, port_finder=self._find_port, bridge_factory=self._create_bridge)
+        event_manager = EventManager(self.bridge, self.polling_interval, self.idle_polling_interval, supervisor=supervisor)
+        event_manager.subscribe(EventType.BRIDGE_CHANGE, self._on_bridge_change)
+        return event_manager
+
+    def _on_bridge_change(self, bridge):
+        self.bridge = bridge
+
+    def play_uri(self, uri, context=None):
+        return self.bridge.play_uri(uri, context)
+
+    def queue_uri(self, uri):
+        # native_queue isn't set, so PlaybackController keeps its own queue and never calls this
+        raise NotImplementedError('The Spotify Web Helper has no playback queue')
+
+    def send_command(self, command):
+        self.bridge.send_command(command)
+
+
+class ConnectBackend(PlaybackBackend):
+    """
+    Drives whichever Spotify Connect device is active using the Web API player endpoints.
+
+    Every command is a single request, with no window messages or sleeps involved.  Player state is polled on an interval chosen by the usual PollingScheduler, and the poller is woken as soon as a command succeeds so its effects are reported straight away.
+    """
+
+    native_queue = True
+
+    def __init__(self, api_client, polling_interval=CONNECT_POLLING_INTERVAL, idle_polling_interval=CONNECT_IDLE_POLLING_INTERVAL):
+        self.api_client = api_client
+        self.polling_interval = polling_interval
+        self.idle_polling_interval = idle_polling_interval
+        self.bridge = PlayerStateBridge(api_client)
+
+    def connect(self):
+        supervisor = ReconnectSupervisor(self.bridge, port_finder=None)
+        return EventManager(self.bridge, self.polling_interval, self.idle_polling_interval, supervisor=supervisor)
+
+    def play_uri(self, uri, context=None):
+        if context is None or context == uri:
+            if is_track_uri(uri):
+                self._call(self.api_client.start_playback, uris=[uri])
+            else:
+                self._call(self.api_client.start_playback, context_uri=uri)
+        elif is_track_uri(context):
+            self._call(self.api_client.start_playback, uris=[uri])
+        else:
+            self._call(self.api_client.start_playback, context_uri=context, offset_uri=uri)
+
+    def queue_uri(self, uri):
+        self._call(self.api_client.add_to_queue, uri)
+
+    def seek(self, position_ms):
+        self._call(self.api_client.seek, max(0, position_ms))
+
+    def set_volume(self, volume_percent):
+        self._call(self.api_client.set_volume, min(100, max(0, volume_percent)))
+
+    def send_command(self, command):
+        state = self.bridge.last_player_state
+        if command == PlaybackCommand.PLAY_PAUSE:
+            if state is not None and state['is_playing']:
+                self._call(self.api_client.pause_playback)
+            else:
+                self._call(self.api_client.resume_playback)
+        elif command == PlaybackCommand.NEXT_TRACK:
+            self._call(self.api_client.skip_to_next)
+        elif command == PlaybackCommand.PREV_TRACK:
+            self._call(self.api_client.skip_to_previous)
+        elif command in (PlaybackCommand.SEEK_FORWARD, PlaybackCommand.SEEK_BACKWARD) and state is not None:
+            step = SEEK_STEP_MS if command == PlaybackCommand.SEEK_FORWARD else -SEEK_STEP_MS
+            self.seek(state['progress_ms'] + step)
+        elif command in (PlaybackCommand.VOLUME_UP, PlaybackCommand.VOLUME_DOWN) and state is not None:
+            step = VOLUME_STEP_PERCENT if command == PlaybackCommand.VOLUME_UP else -VOLUME_STEP_PERCENT
+            self.set_volume(state['device']['volume_percent'] + step)
+
+    def _call(self, method, *args, **kwargs):
+        with translate_api_errors():
+            result = method(*args, **kwargs)
+        self.bridge.wake()
+        return result
+
+
+class PlayerStateBridge:
+    """
+    Presents the Web API's player state in the same shape as a status from the Web Helper, so that it can be fed through EventManager.
+
+    There's no long polling in the Web API, so get_status() sleeps for the return_after interval instead, unless woken early by wake().
+    """
+
+    def __init__(self, api_client):
+        self.api_client = api_client
+        self.last_player_state = None
+        self._wakeup = threading.Event()
+
+    def wake(self):
+        self._wakeup.set()
+
+    def get_status(self, return_after=None):
+        if return_after is not None:
+            self._wakeup.wait(return_after)
+        self._wakeup.clear()
+        with translate_api_errors():
+            state = self.api_client.player()
+        if state is None:
+            raise exceptions.NoActiveDeviceError
+        self.last_player_state = state
+        return player_state_to_status(state)
+
+
+def player_state_to_status(state):
+    track = state.get('item')
+    if track is None or not track.get('artists'):
+        # Adverts and some episodes come through without any metadata
+        raise exceptions.MetadataNotReadyError
+    artist = track['artists'][0]
+    volume_percent = state['device'].get('volume_percent') or 0
+    return {
+        'playing': state['is_playing'],
+        'playing_position': (state.get('progress_ms') or 0) / 1000,
+        'volume': volume_percent / 100,
+        'shuffle': state['shuffle_state'],
+        'repeat': state['repeat_state'] != 'off',
+        'server_time': time.time(),
+        'track': {
+            'length': round(track['duration_ms'] / 1000),
+            'track_type': 'normal',
+            'track_resource': {'name': track['name'], 'uri': track['uri']},
+            'artist_resource': {'name': artist['name'], 'uri': artist['uri']},
+            'album_resource': {'name': track['album']['name'], 'uri': track['album']['uri']},
+        },
+    }
+
+
+@contextlib.contextmanager
+def translate_api_errors():
+    """
+    Re-raise Web API and transport errors as the equivalent exceptions.SpotifyError, which is what PlaybackController and EventManager expect.
+    """
+    try:
+        yield
+    except (requests.exceptions.ConnectionError, webapi_exceptions.NotAuthenticatedError) as e:
+        raise exceptions.SpotifyConnectionError from e
+    except webapi_exceptions.APIError as e:
+        if e.status_code == 404:
+            raise exceptions.NoActiveDeviceError from e
+        raise exceptions.SpotifyRemoteError(str(e.status_code), e.error_message) from e
+
+
+def is_track_uri(uri):
+    return uri.startswith('spotify:track:')
+
+
+def create_backend(config, api_client, port_finder=remote.find_listening_port):
+    backend_name = config.get('playback_backend', BACKEND_WEB_HELPER)
+    if backend_name == BACKEND_CONNECT:
+        return ConnectBackend(api_client, config.get('connect_polling_interval', CONNECT_POLLING_INTERVAL), config.get('connect_idle_polling_interval', CONNECT_IDLE_POLLING_INTERVAL))
+    elif backend_name != BACKEND_WEB_HELPER:
+        logger.warning('Unknown playback backend {0}, falling back to {1}'.format(backend_name, BACKEND_WEB_HELPER))
+    return WebHelperBackend(config.get('spotify_polling_interval'), config.get('spotify_idle_polling_interval'), port_finder=port_finder)
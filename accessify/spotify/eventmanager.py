@@ -3,29 +3,40 @@ from enum import Enum
 import logging
 import queue
 import threading
+import time
+from typing import NamedTuple
 
+from accessify import metrics
 from accessify import structures
 from accessify.utils.concurrency import consume_queue
 
 from accessify.spotify import exceptions
+from accessify.spotify.polling import DEFAULT_IDLE_INTERVAL, PollingScheduler
+from accessify.spotify.reconnection import ReconnectSupervisor
 
 
 logger = logging.getLogger(__name__)
 
+POSITION_JUMP_TOLERANCE = 2.5
+VOLUME_PRECISION = 3
+
 
 class EventManager(threading.Thread):
-    def __init__(self, remote_bridge, polling_interval, *args, **kwargs):
+    def __init__(self, remote_bridge, polling_interval, idle_polling_interval=DEFAULT_IDLE_INTERVAL, supervisor=None, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.setDaemon(True)
 
         self._remote_bridge = remote_bridge
         self.polling_interval = polling_interval
+        self.scheduler = PollingScheduler(polling_interval, idle_interval=idle_polling_interval)
+        if supervisor is None:
+            supervisor = ReconnectSupervisor(remote_bridge)
+        self.supervisor = supervisor
         self._event_queue = queue.Queue()
         self._callbacks = defaultdict(list)
 
-        self._previous_track_dict = {}
+        self._differ = StatusDiffer()
         self._current_track = None
-        self._playback_state = PlaybackState.UNDETERMINED
 
     def subscribe(self, event_type, callback):
         logger.debug('Subscribing callback {0} to {1}'.format(callback, event_type))
@@ -33,68 +44,63 @@ class EventManager(threading.Thread):
 
     def run(self):
         consume_queue(self._event_queue, self._process_item)
-        return_immediately = True
-        metadata_retries = 0
         while True:
+            self.supervisor.wait()
+            if self.supervisor.bridge is not self._remote_bridge:
+                self._remote_bridge = self.supervisor.bridge
+                self._event_queue.put(BridgeChange(self._remote_bridge))
+            poll = self.scheduler.plan()
+            if poll.delay > 0:
+                time.sleep(poll.delay)
             try:
-                if return_immediately:
-                    status = self._remote_bridge.get_status()
-                else:
-                    status = self._remote_bridge.get_status(return_after=self.polling_interval)
+                with self.scheduler.stats.measure(poll.mode):
+                    status = self._remote_bridge.get_status(return_after=poll.return_after)
+                self.supervisor.on_success()
+                self.scheduler.on_status(status)
                 self._event_queue.put(status)
-                return_immediately = False
             except exceptions.MetadataNotReadyError as e:
-                if metadata_retries >= 3:
-                    metadata_retries = 0
-                    return_immediately = False
+                self.supervisor.on_success()
+                if self.scheduler.on_metadata_not_ready():
                     self._event_queue.put(e)
-                else:
-                    return_immediately = True
-                    metadata_retries += 1
-                continue
             except exceptions.SpotifyError as e:
-                self._event_queue.put(e)
+                self.scheduler.on_error()
+                if self.supervisor.on_failure(e):
+                    self._event_queue.put(e)
+
+    @property
+    def polling_stats(self):
+        return self.scheduler.stats.summary()
+
+    @property
+    def reconnect_stats(self):
+        return self.supervisor.stats.summary()
 
     def _process_item(self, item):
+        metrics.registry.gauge('event_queue_depth', 'Items waiting to be processed by EventManager').set(self._event_queue.qsize())
+        if isinstance(item, BridgeChange):
+            self._update_subscribers(EventType.BRIDGE_CHANGE, context=item.bridge)
+            return
         if isinstance(item, exceptions.SpotifyError):
-            self._previous_track_dict = {}
+            self._differ.reset()
             self._update_subscribers(EventType.ERROR, context=item)
             return
         self._process_status_dict(item)
 
     def _process_status_dict(self, status_dict):
-        # Remove the keys we're not really interested in
-        for key in ('version', 'play_enabled', 'prev_enabled', 'next_enabled', 'open_graph_state', 'context', 'online', 'server_time'):
-            status_dict.pop(key)
-
-        playing = status_dict['playing']
-        if playing:
-            playback_state = PlaybackState.PLAYING
-        elif not playing and status_dict['playing_position'] == 0:
-            playback_state = PlaybackState.STOPPED
-        else:
-            playback_state = PlaybackState.PAUSED
-
-        track_dict = status_dict.pop('track')
-        if track_dict != self._previous_track_dict and playback_state == PlaybackState.PLAYING:
-            self._current_track = deserialize_track(track_dict)
-            logger.debug('Deserialized track: {0}'.format(self._current_track))
-            self._update_subscribers(EventType.TRACK_CHANGE, context=self._current_track)
-            self._previous_track_dict = track_dict
-
-        if playback_state != self._playback_state:
-            if playback_state == PlaybackState.PLAYING:
-                self._update_subscribers(EventType.PLAY, context=self._current_track)
-            elif playback_state == PlaybackState.PAUSED:
-                self._update_subscribers(EventType.PAUSE)
-            elif playback_state == PlaybackState.STOPPED:
-                self._update_subscribers(EventType.STOP)
-            self._playback_state = playback_state
+        for event_type, context in self._differ.diff(status_dict):
+            if event_type == EventType.TRACK_CHANGE:
+                self._current_track = deserialize_track(context)
+                logger.debug('Deserialized track: %s', self._current_track)
+                context = self._current_track
+            elif event_type == EventType.PLAY:
+                context = self._current_track
+            self._update_subscribers(event_type, context=context)
 
     def _update_subscribers(self, event_type, context=None):
-        logger.debug('Updating subscribers to {0} with context: {1}'.format(event_type, repr(context)))
-        for callback in self._callbacks[event_type]:
-            self._update_subscriber(event_type, callback, context)
+        logger.debug('Updating subscribers to %s with context: %r', event_type, context)
+        with metrics.registry.histogram('event_dispatch_seconds', 'Time taken to dispatch an event to its subscribers', labels={'event': event_type.name}).time():
+            for callback in self._callbacks[event_type]:
+                self._update_subscriber(event_type, callback, context)
 
     def _update_subscriber(self, event_type, callback, context=None):
         if context is not None:
@@ -103,6 +109,96 @@ class EventManager(threading.Thread):
             callback()
 
 
+class BridgeChange(NamedTuple):
+    bridge: object
+
+
+class StatusFingerprint(NamedTuple):
+    track_uri: str
+    playback_state: 'PlaybackState'
+    volume: float
+    shuffle: bool
+    repeat: bool
+    position: float
+    server_time: int
+
+
+class StatusDiffer:
+    """
+    Works out which events a status dict from the Web Helper represents, relative to the previous one.
+
+    Only a handful of scalar fields from each status are kept for comparison, so the status dict itself is neither copied nor modified.  Tracks are compared by URI, and a seek is reported when the playing position differs from where it would be expected to be by more than position_tolerance seconds, as measured by the Web Helper's own clock.
+    """
+
+    def __init__(self, position_tolerance=POSITION_JUMP_TOLERANCE):
+        self.position_tolerance = position_tolerance
+        self._previous = None
+        self._reported_track_uri = None
+        self._playback_state = PlaybackState.UNDETERMINED
+
+    def reset(self):
+        """
+        Forget the last status, so that the current track is reported again once the next status arrives.
+        """
+        self._previous = None
+        self._reported_track_uri = None
+
+    def diff(self, status_dict):
+        """
+        Return a list of (event_type, context) tuples for the fields which changed since the previous status.  The context of a TRACK_CHANGE event is the raw track dict.
+        """
+        track_dict = status_dict['track']
+        current = StatusFingerprint(
+            track_uri=track_dict['track_resource']['uri'],
+            playback_state=determine_playback_state(status_dict),
+            volume=round(status_dict['volume'], VOLUME_PRECISION),
+            shuffle=status_dict['shuffle'],
+            repeat=status_dict['repeat'],
+            position=status_dict['playing_position'],
+            server_time=status_dict['server_time'],
+        )
+        previous = self._previous
+        changes = []
+
+        if current.playback_state == PlaybackState.PLAYING and current.track_uri != self._reported_track_uri:
+            changes.append((EventType.TRACK_CHANGE, track_dict))
+            self._reported_track_uri = current.track_uri
+
+        if current.playback_state != self._playback_state:
+            changes.append((playback_state_events[current.playback_state], None))
+            self._playback_state = current.playback_state
+
+        if previous is not None:
+            if current.volume != previous.volume:
+                changes.append((EventType.VOLUME_CHANGE, current.volume))
+            if current.shuffle != previous.shuffle:
+                changes.append((EventType.SHUFFLE_CHANGE, current.shuffle))
+            if current.repeat != previous.repeat:
+                changes.append((EventType.REPEAT_CHANGE, current.repeat))
+            if self._has_position_jumped(previous, current):
+                changes.append((EventType.SEEK, current.position))
+
+        self._previous = current
+        return changes
+
+    def _has_position_jumped(self, previous, current):
+        if current.track_uri != previous.track_uri or PlaybackState.STOPPED in (previous.playback_state, current.playback_state):
+            return False
+        expected_position = previous.position
+        if previous.playback_state == PlaybackState.PLAYING:
+            expected_position += current.server_time - previous.server_time
+        return abs(current.position - expected_position) > self.position_tolerance
+
+
+def determine_playback_state(status_dict):
+    if status_dict['playing']:
+        return PlaybackState.PLAYING
+    elif status_dict['playing_position'] == 0:
+        return PlaybackState.STOPPED
+    else:
+        return PlaybackState.PAUSED
+
+
 def deserialize_track(track_dict):
     artist_res = track_dict['artist_resource']
     album_res = track_dict['album_resource']
@@ -119,6 +215,11 @@ class EventType(Enum):
     TRACK_CHANGE = 3
     ERROR = 4
     STOP = 5
+    BRIDGE_CHANGE = 6
+    VOLUME_CHANGE = 7
+    SHUFFLE_CHANGE = 8
+    REPEAT_CHANGE = 9
+    SEEK = 10
 
 
 class PlaybackState(Enum):
@@ -127,3 +228,10 @@ class PlaybackState(Enum):
     PAUSED = 2
     STOPPED = 3
 
+
+playback_state_events = {
+    PlaybackState.PLAYING: EventType.PLAY,
+    PlaybackState.PAUSED: EventType.PAUSE,
+    PlaybackState.STOPPED: EventType.STOP,
+}
+
@@ -26,3 +26,6 @@ class MetadataNotReadyError(SpotifyError):
 class SpotifyConnectionError(SpotifyError):
     pass
 
+
+class NoActiveDeviceError(SpotifyError):
+    """Raised when a Spotify Connect command is sent while no device is available to play on."""
@@ -0,0 +1,159 @@
+from collections import defaultdict
+from enum import Enum
+import logging
+import math
+import time
+from typing import NamedTuple, Optional
+
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_IDLE_INTERVAL = 300
+DEFAULT_TRACK_ENDING_THRESHOLD = 15
+MINIMUM_INTERVAL = 1
+METADATA_BASE_DELAY = 0.25
+METADATA_MAX_DELAY = 4
+MAX_METADATA_RETRIES = 3
+SECONDS_PER_HOUR = 3600
+
+
+class PollingMode(Enum):
+    IMMEDIATE = 1
+    IDLE = 2
+    PLAYING = 3
+    TRACK_ENDING = 4
+    METADATA_BACKOFF = 5
+
+
+class Poll(NamedTuple):
+    mode: PollingMode
+    return_after: Optional[int] = None
+    delay: float = 0
+
+
+class PollingScheduler:
+    """
+    Decides how long each status request to the Spotify Web Helper should be allowed to block for, based on the last status received.
+
+    The Web Helper returns early from a long poll on play, pause, login, logout and errors, but not when one track rolls over into the next.  So while paused or stopped we can afford to block for a long time, but while playing we wake up shortly before the current track is due to end so the track change is noticed promptly.
+    """
+
+    def __init__(self, polling_interval, idle_interval=DEFAULT_IDLE_INTERVAL, track_ending_threshold=DEFAULT_TRACK_ENDING_THRESHOLD, max_metadata_retries=MAX_METADATA_RETRIES):
+        self.polling_interval = polling_interval
+        self.idle_interval = idle_interval
+        self.track_ending_threshold = track_ending_threshold
+        self.max_metadata_retries = max_metadata_retries
+        self.stats = PollingStats()
+        self._playing = None
+        self._remaining = None
+        self._return_immediately = True
+        self._metadata_retries = 0
+
+    def plan(self):
+        if self._metadata_retries > 0:
+            delay = min(METADATA_BASE_DELAY * 2 ** (self._metadata_retries - 1), METADATA_MAX_DELAY)
+            return Poll(PollingMode.METADATA_BACKOFF, delay=delay)
+        if self._playing is None:
+            if self._return_immediately:
+                return Poll(PollingMode.IMMEDIATE)
+            return Poll(PollingMode.PLAYING, return_after=self.polling_interval)
+        if not self._playing:
+            return Poll(PollingMode.IDLE, return_after=self.idle_interval)
+
+        remaining = self._remaining
+        if remaining <= self.track_ending_threshold:
+            return Poll(PollingMode.TRACK_ENDING, return_after=max(MINIMUM_INTERVAL, math.ceil(remaining)))
+        return_after = min(self.polling_interval, math.floor(remaining - self.track_ending_threshold))
+        return Poll(PollingMode.PLAYING, return_after=max(MINIMUM_INTERVAL, return_after))
+
+    def on_status(self, status):
+        # Only keep what we need, as the status dict is handed on to another thread
+        self._playing = status['playing']
+        self._remaining = status['track']['length'] - status['playing_position']
+        self._return_immediately = False
+        self._metadata_retries = 0
+
+    def on_metadata_not_ready(self):
+        """
+        Record a status request which returned incomplete track metadata.
+
+        Returns True if the retry budget has been used up and the error should be reported, in which case the next poll falls back to the standard interval.
+        """
+        self._playing = None
+        if self._metadata_retries >= self.max_metadata_retries:
+            self._metadata_retries = 0
+            self._return_immediately = False
+            return True
+        self._metadata_retries += 1
+        return False
+
+    def on_error(self):
+        self._playing = None
+        self._return_immediately = True
+        self._metadata_retries = 0
+
+
+class PollingStats:
+    """
+    Per-mode counters for status requests made to the Web Helper.
+
+    Wall-clock time spent blocked in the PLAYING and TRACK_ENDING modes is counted as playback time, so that request rate and CPU cost can be expressed per hour of playback.
+    """
+
+    playback_modes = (PollingMode.PLAYING, PollingMode.TRACK_ENDING)
+
+    def __init__(self):
+        self._requests = defaultdict(int)
+        self._wall_seconds = defaultdict(float)
+        self._cpu_seconds = defaultdict(float)
+
+    def measure(self, mode):
+        return _PollMeasurement(self, mode)
+
+    def record(self, mode, wall_seconds, cpu_seconds):
+        self._requests[mode] += 1
+        self._wall_seconds[mode] += wall_seconds
+        self._cpu_seconds[mode] += cpu_seconds
+
+    def summary(self):
+        modes = {}
+        for mode in PollingMode:
+            requests = self._requests[mode]
+            wall_seconds = self._wall_seconds[mode]
+            modes[mode.name.lower()] = {
+                'requests': requests,
+                'wall_seconds': wall_seconds,
+                'cpu_seconds': self._cpu_seconds[mode],
+                'requests_per_hour': per_hour(requests, wall_seconds),
+            }
+        playback_seconds = sum(self._wall_seconds[mode] for mode in self.playback_modes)
+        total_requests = sum(self._requests.values())
+        total_cpu_seconds = sum(self._cpu_seconds.values())
+        return {
+            'modes': modes,
+            'playback_seconds': playback_seconds,
+            'requests_per_playback_hour': per_hour(total_requests, playback_seconds),
+            'cpu_seconds_per_playback_hour': per_hour(total_cpu_seconds, playback_seconds),
+        }
+
+
+class _PollMeasurement:
+    def __init__(self, stats, mode):
+        self._stats = stats
+        self._mode = mode
+
+    def __enter__(self):
+        self._started = time.monotonic()
+        # Measured on the polling thread, so the GUI and other threads' CPU time isn't counted
+        self._cpu_started = time.thread_time()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stats.record(self._mode, time.monotonic() - self._started, time.thread_time() - self._cpu_started)
+        return False
+
+
+def per_hour(value, seconds):
+    if seconds <= 0:
+        return 0.0
+    return value * SECONDS_PER_HOUR / seconds
@@ -0,0 +1,194 @@
+from enum import Enum
+import logging
+import random
+import time
+
+from accessify.spotify import exceptions
+from accessify.spotify import remote
+
+
+logger = logging.getLogger(__name__)
+
+BACKOFF_BASE_DELAY = 0.5
+BACKOFF_MAX_DELAY = 30
+BACKOFF_JITTER = 0.5
+BREAKER_FAILURE_THRESHOLD = 5
+BREAKER_RESET_TIMEOUT = 60
+
+
+class ExponentialBackoff:
+    """
+    Doubling delays between attempts, capped at max_delay.  Each delay is randomly shortened by up to the jitter fraction so that several clients don't retry in lockstep.
+    """
+
+    def __init__(self, base_delay=BACKOFF_BASE_DELAY, max_delay=BACKOFF_MAX_DELAY, jitter=BACKOFF_JITTER):
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.jitter = jitter
+        self.attempts = 0
+
+    def next_delay(self):
+        delay = min(self.base_delay * 2 ** self.attempts, self.max_delay)
+        # Once max_delay is reached the exponent stops growing, so the delay can't overflow however long retries go on
+        if delay < self.max_delay:
+            self.attempts += 1
+        return delay * (1 - random.uniform(0, self.jitter))
+
+    def reset(self):
+        self.attempts = 0
+
+
+class CircuitState(Enum):
+    CLOSED = 1
+    OPEN = 2
+    HALF_OPEN = 3
+
+
+class CircuitBreaker:
+    """
+    Stops requests to the bridge altogether after failure_threshold consecutive failures.  Once reset_timeout seconds have passed, a single trial request is let through; if it succeeds the circuit closes again, otherwise it re-opens for another reset_timeout.
+    """
+
+    def __init__(self, failure_threshold=BREAKER_FAILURE_THRESHOLD, reset_timeout=BREAKER_RESET_TIMEOUT, clock=time.monotonic):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._clock = clock
+        self.state = CircuitState.CLOSED
+        self._failures = 0
+        self._opened_at = None
+
+    def time_until_trial(self):
+        if self.state != CircuitState.OPEN:
+            return 0
+        return max(0, self._opened_at + self.reset_timeout - self._clock())
+
+    def allow_request(self):
+        if self.state == CircuitState.OPEN and self.time_until_trial() <= 0:
+            logger.debug('Circuit half-open, allowing a trial request')
+            self.state = CircuitState.HALF_OPEN
+        return self.state != CircuitState.OPEN
+
+    def record_success(self):
+        self.state = CircuitState.CLOSED
+        self._failures = 0
+        self._opened_at = None
+
+    def record_failure(self):
+        self._failures += 1
+        if self.state == CircuitState.HALF_OPEN or self._failures >= self.failure_threshold:
+            if self.state != CircuitState.OPEN:
+                logger.info('Opening circuit after {0} consecutive failures'.format(self._failures))
+            self.state = CircuitState.OPEN
+            self._opened_at = self._clock()
+
+
+class ReconnectSupervisor:
+    """
+    Guards the connection to the Spotify Web Helper on behalf of the polling loop.
+
+    After a failed request, wait() sleeps according to the backoff and circuit breaker before the next attempt is made.  If the failure was a connection error, the listening port is looked up again and the bridge is rebuilt when Spotify has come back on a different port; callers should always fetch the bridge afresh after calling wait().  Pass port_finder=None for bridges which don't talk to a local port.
+    """
+
+    def __init__(self, bridge, port_finder=remote.find_listening_port, bridge_factory=remote.RemoteBridge, backoff=None, breaker=None, sleep=time.sleep, clock=time.monotonic):
+        self.bridge = bridge
+        self._find_port = port_finder
+        self._create_bridge = bridge_factory
+        self.backoff = backoff if backoff is not None else ExponentialBackoff()
+        self.breaker = breaker if breaker is not None else CircuitBreaker(clock=clock)
+        self._sleep = sleep
+        self._clock = clock
+        self.stats = ReconnectStats()
+
+        self._pending_delay = 0
+        self._needs_rediscovery = False
+        self._outage_started = None
+        self._outage_attempts = 0
+        self._last_reported_error = None
+
+    def wait(self):
+        if self._pending_delay > 0:
+            self._sleep(self._pending_delay)
+            self._pending_delay = 0
+        while not self.breaker.allow_request():
+            self._sleep(self.breaker.time_until_trial())
+        if self._needs_rediscovery:
+            self._rediscover()
+        if self._outage_started is not None:
+            self._outage_attempts += 1
+
+    def on_success(self):
+        if self._outage_started is not None:
+            outage_seconds = self._clock() - self._outage_started
+            self.stats.record_reconnect(outage_seconds, self._outage_attempts)
+            logger.info('Reconnected to Spotify after {0:.2f} seconds and {1} attempts'.format(outage_seconds, self._outage_attempts))
+        self.backoff.reset()
+        self.breaker.record_success()
+        self._outage_started = None
+        self._outage_attempts = 0
+        self._needs_rediscovery = False
+        self._last_reported_error = None
+
+    def on_failure(self, exception):
+        """
+        Record a failed request and schedule the delay before the next one.
+
+        Returns True if the error should be reported to subscribers, which is only the case for the first error of an outage or when the kind of error changes, rather than for every retry.
+        """
+        if self._outage_started is None:
+            self._outage_started = self._clock()
+            self._outage_attempts = 1
+        self.stats.failures += 1
+        self.breaker.record_failure()
+        self._pending_delay = self.backoff.next_delay()
+        if self._find_port is not None and isinstance(exception, (exceptions.SpotifyConnectionError, exceptions.SpotifyNotRunningError)):
+            self._needs_rediscovery = True
+
+        error_key = (type(exception), getattr(exception, 'error_code', None))
+        should_report = error_key != self._last_reported_error
+        self._last_reported_error = error_key
+        return should_report
+
+    def _rediscover(self):
+        self.stats.rediscoveries += 1
+        try:
+            port = self._find_port()
+        except exceptions.SpotifyNotRunningError:
+            logger.debug('Spotify still not listening')
+            return
+        self._needs_rediscovery = False
+        if port != self.bridge.port:
+            logger.info('Spotify now listening on port {0}, rebuilding remote bridge'.format(port))
+            self.bridge = self._create_bridge(port)
+            self.stats.bridge_rebuilds += 1
+
+
+class ReconnectStats:
+    def __init__(self):
+        self.failures = 0
+        self.rediscoveries = 0
+        self.bridge_rebuilds = 0
+        self.reconnects = 0
+        self.total_outage_seconds = 0.0
+        self.last_outage_seconds = None
+        self.total_outage_attempts = 0
+
+    def record_reconnect(self, outage_seconds, attempts):
+        self.reconnects += 1
+        self.total_outage_seconds += outage_seconds
+        self.last_outage_seconds = outage_seconds
+        self.total_outage_attempts += attempts
+
+    def summary(self):
+        if self.total_outage_seconds > 0:
+            spin_rate = self.total_outage_attempts / self.total_outage_seconds
+        else:
+            spin_rate = 0.0
+        return {
+            'failures': self.failures,
+            'rediscoveries': self.rediscoveries,
+            'bridge_rebuilds': self.bridge_rebuilds,
+            'reconnects': self.reconnects,
+            'total_outage_seconds': self.total_outage_seconds,
+            'last_outage_seconds': self.last_outage_seconds,
+            'attempts_per_outage_second': spin_rate,
+        }
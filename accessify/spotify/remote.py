@@ -5,15 +5,13 @@ import random
 import string
 import threading
 import time
-from ctypes import windll
 
 from requests.packages.urllib3 import disable_warnings
 from requests.packages.urllib3.exceptions import InsecureRequestWarning
-import psutil
 import requests
-from functional import seq
 import ujson as json
 
+from accessify import metrics
 from accessify.spotify import exceptions
 
 
@@ -21,9 +19,6 @@ logger = logging.getLogger(__name__)
 
 disable_warnings(InsecureRequestWarning)
 
-find_window = windll.User32.FindWindowW
-send_message = windll.User32.SendMessageW
-
 WM_COMMAND = 0x111
 SPOTIFY_WINDOW_CLASS = 'SpotifyMainWindow'
 SPOTIFY_PROCESSES = ('Spotify.exe', 'SpotifyWebHelper.exe')
@@ -36,9 +31,14 @@ class RemoteBridge:
     A Python interface to the remote bridge services hosted by the Spotify Web Helper.
     """
 
-    def __init__(self, port):
-        self._hostname = self.generate_hostname()
+    def __init__(self, port, hostname=None, token_url=SPOTIFY_OPEN_TOKEN_URL, window=None):
+        if hostname is None:
+            hostname = self.generate_hostname()
+        self._hostname = hostname
         self._port = port
+        self._token_url = token_url
+        # Created on first use, as it's only available on Windows
+        self._window = window
         self._session = requests.Session()
         self._session.headers.update({'Origin': 'https://open.spotify.com'})
         self._session.verify = False
@@ -46,6 +46,10 @@ class RemoteBridge:
         self._csrf_token = None
         self._oauth_token = None
 
+    @property
+    def port(self):
+        return self._port
+
     def get_status(self, return_after=None):
         if return_after is not None:
             params = {
@@ -98,17 +102,22 @@ class RemoteBridge:
             request_params = {}
         if params is not None:
             request_params.update(params)
-        logger.debug('Requesting URL: {0} with params: {1}'.format(request_url, request_params))
+        logger.debug('Requesting URL: %s with params: %s', request_url, request_params)
+        labels = {'endpoint': '{0}/{1}'.format(service, endpoint)}
         try:
-            response = self._session.get(request_url, params=request_params)
+            # Passed explicitly, as requests would otherwise let REQUESTS_CA_BUNDLE override the session setting
+            with metrics.registry.histogram('webhelper_request_seconds', 'Web Helper request latency, including long polls', labels=labels).time():
+                response = self._session.get(request_url, params=request_params, verify=self._session.verify)
         except requests.exceptions.ConnectionError:
+            metrics.registry.counter('webhelper_errors_total', 'Web Helper errors by type', labels=dict(labels, error='connection')).inc()
             raise exceptions.SpotifyConnectionError
         response_content = json.loads(response.content)
-        logger.debug('Received response: {0}'.format(response_content))
+        logger.debug('Received response: %s', response_content)
         if 'error' in response_content:
             error_code = response_content['error']['type']
+            metrics.registry.counter('webhelper_errors_total', 'Web Helper errors by type', labels=dict(labels, error=error_code)).inc()
             error_description = spotify_remote_errors[error_code]
-            logger.debug('Error {0} from Spotify: {1}'.format(error_code, error_description))
+            logger.debug('Error %s from Spotify: %s', error_code, error_description)
             raise exceptions.SpotifyRemoteError(error_code, error_description)
         return response_content
 
@@ -121,28 +130,52 @@ class RemoteBridge:
         return response['token']
 
     def get_oauth_token(self):
-        response = self._session.get(SPOTIFY_OPEN_TOKEN_URL)
+        response = self._session.get(self._token_url, verify=self._session.verify)
         data = json.loads(response.content)
-        logger.debug('OAuth token request response: {0}'.format(data))
+        logger.debug('OAuth token request response: %s', data)
         return data['t']
 
     def send_command(self, command):
-        hwnd = find_window(SPOTIFY_WINDOW_CLASS, None)
-        if hwnd == 0:
+        if self._window is None:
+            self._window = SpotifyWindow()
+        if not self._window.send_command(command):
             return
-        logger.debug('Sending command {0} to window handle {1}'.format(command, hwnd))
-        send_message(hwnd, WM_COMMAND, command.value, 0)
         if command in (PlaybackCommand.PLAY_PAUSE, PlaybackCommand.PREV_TRACK, PlaybackCommand.NEXT_TRACK):
             logger.debug('Sleeping to avoid command flooding')
             time.sleep(0.3)
 
 
+class SpotifyWindow:
+    """
+    Sends playback commands to the Spotify main window as WM_COMMAND messages.
+
+    Anything with a send_command(command) method returning whether the command was delivered can be passed to RemoteBridge in its place, which is how the bridge is driven on platforms other than Windows.
+    """
+
+    def __init__(self):
+        from ctypes import windll
+        self._find_window = windll.User32.FindWindowW
+        self._send_message = windll.User32.SendMessageW
+
+    def send_command(self, command):
+        hwnd = self._find_window(SPOTIFY_WINDOW_CLASS, None)
+        if hwnd == 0:
+            return False
+        logger.debug('Sending command %s to window handle %s', command, hwnd)
+        self._send_message(hwnd, WM_COMMAND, command.value, 0)
+        return True
+
+
 def find_listening_port():
     """
     Attempt to find the HTTPS port that the SpotifyWebHelper process is listening on.
 
     If SpotifyWebHelper.exe is not running, this function will atempt to find the listening port for Spotify.exe as a backup.  If neither process is running, exceptions.SpotifyNotRunningError will be raised.  Otherwise it will return the port number which is guaranteed to be between 4370 and 4380 (not inclusive).
     """
+    # Only needed for finding the port, and slow to import
+    from functional import seq
+    import psutil
+
     # Find all Spotify processes with at least one active connection
     spotify_processes = (seq(psutil.process_iter())
         .filter(lambda proc: proc.name() in SPOTIFY_PROCESSES and any(proc.connections()))
@@ -1,3 +1,49 @@
-def is_spotify_uri(text):
-    return text.startswith('spotify:')
+import re
 
+
+URI_TYPES = ('track', 'album', 'artist', 'playlist')
+# Those which can be played when pasted, though not looked up in bulk
+PLAYABLE_URI_TYPES = URI_TYPES + ('episode', 'show')
+_ID = r'(?P<id>[0-9A-Za-z]{22})'
+# Checked against the types asked for once matched
+_TYPE = r'(?P<type>[a-z]+)'
+# spotify:track:ID and the older spotify:user:OWNER:playlist:ID
+URI_PATTERN = re.compile(r'spotify:(?:user:[^:\s]+:)?{0}:{1}'.format(_TYPE, _ID))
+# https://open.spotify.com/track/ID, optionally with a locale such as intl-de, an owner before playlists, and a query string such as ?si=
+LINK_PATTERN = re.compile(r'(?:https?://)?open\.spotify\.com/(?:intl-[\w-]+/)?(?:user/[^/\s]+/)?{0}/{1}(?:\?\S*)?'.format(_TYPE, _ID))
+# Anything which looks like an attempt at either, so that malformed ones can be counted rather than silently skipped
+CANDIDATE_PATTERN = re.compile(r'spotify:\S+|(?:https?://)?open\.spotify\.com/\S+')
+
+
+def parse_uri(text, types=URI_TYPES):
+    """
+    Return the URI for text which is a Spotify URI or open.spotify.com link of one of types, in the form spotify:track:6rqhFgbbKwnb9MLmUQDhG6, or None.
+    """
+    text = text.strip()
+    match = URI_PATTERN.fullmatch(text) or LINK_PATTERN.fullmatch(text)
+    if match is None or match.group('type') not in types:
+        return None
+    return 'spotify:{0}:{1}'.format(match.group('type'), match.group('id'))
+
+
+def find_uris(text):
+    """
+    Yield (candidate, URI) for everything in text which looks like a Spotify URI or link, with URI None for those which aren't valid.
+    """
+    for match in CANDIDATE_PATTERN.finditer(text):
+        # Pasted lists are often separated by commas or quoted
+        candidate = match.group().rstrip('.,;)]}>"\'')
+        yield candidate, parse_uri(candidate)
+
+
+def split_uri(uri):
+    """
+    Return the (type, ID) of a URI such as spotify:track:6rqhFgbbKwnb9MLmUQDhG6, or None if it isn't one.
+    """
+    parts = uri.split(':') if uri else []
+    # Older playlist URIs include their owner, e.g. spotify:user:spotify:playlist:37i9dQZF1DXcBWIGoYBM5M
+    if len(parts) == 5 and parts[0] == 'spotify' and parts[1] == 'user' and parts[3] == 'playlist':
+        return parts[3], parts[4]
+    if len(parts) != 3 or parts[0] != 'spotify':
+        return None
+    return parts[1], parts[2]
@@ -1,3 +1,5 @@
+from accessify.spotify.webapi import cache
+from accessify.spotify.webapi import cassette
+from accessify.spotify.webapi import fields
 from accessify.spotify.webapi.authorisation import AuthorisationAgent
 from accessify.spotify.webapi.client import WebAPIClient
-
@@ -1,8 +1,10 @@
 import base64
+from http.server import BaseHTTPRequestHandler, HTTPServer
 import logging
 import threading
+import time
+from urllib.parse import parse_qs, urlsplit
 
-import flask
 import requests
 import ujson as json
 
@@ -19,17 +21,26 @@ AUTHORISATION_URL = 'https://accounts.spotify.com/authorize?{params}'
 
 ALL_SCOPES = ['playlist-read-private', 'playlist-read-collaborative', 'playlist-modify-public', 'playlist-modify-private', 'user-follow-modify', 'user-follow-read', 'user-library-read', 'user-library-modify', 'user-read-private', 'user-read-birthdate', 'user-read-email', 'user-top-read', 'user-read-recently-played', 'user-read-playback-state', 'user-modify-playback-state', 'user-read-currently-playing', 'streaming', 'ugc-image-upload']
 CALLBACK_SERVER_PORT = 43612
+CALLBACK_PATH = '/oauth'
+CALLBACK_TIMEOUT = 300
+CALLBACK_POLL_INTERVAL = 0.5
+# Seconds a connection to the callback server may sit idle, such as one a browser opens ahead of time and never uses
+CALLBACK_CONNECTION_TIMEOUT = 5
+CALLBACK_RESPONSE_PAGE = '<!DOCTYPE html><html><head><title>Accessify</title></head><body><p>You can now close this window and return to Accessify.</p></body></html>'
+ERROR_TIMEOUT = 'timeout'
 
 
 class AuthorisationAgent:
-    def __init__(self, client_id, client_secret, access_token=None, refresh_token=None, requests_session=None):
+    def __init__(self, client_id, client_secret, access_token=None, refresh_token=None, requests_session=None, token_url=TOKEN_URL):
         self.client_id = client_id
+        self.token_url = token_url
         self._client_secret = client_secret
         self.access_token = access_token
         self._refresh_token = refresh_token
         if requests_session is None:
             requests_session = requests.Session()
         self.session = requests_session
+        self._refresh_lock = threading.Lock()
 
     def get_access_token(self):
         if self.access_token is None:
@@ -55,13 +66,19 @@ class AuthorisationAgent:
         }
         self._token_request(params)
 
-    def refresh_access_token(self):
-        logger.debug('Attempting to refresh expired access token')
-        params = {
-            'grant_type': 'refresh_token',
-            'refresh_token': self._refresh_token,
-        }
-        self._token_request(params)
+    def refresh_access_token(self, expired_token=None):
+        """
+        Replace the access token using the refresh token.  If expired_token is given and has already been replaced, e.g. by another thread which got a 401 at the same time, nothing is done.
+        """
+        with self._refresh_lock:
+            if expired_token is not None and self.access_token != expired_token:
+                return
+            logger.debug('Attempting to refresh expired access token')
+            params = {
+                'grant_type': 'refresh_token',
+                'refresh_token': self._refresh_token,
+            }
+            self._token_request(params)
 
     def _token_request(self, params):
         auth_string = base64.b64encode(bytes('{0}:{1}'.format(self.client_id, self._client_secret), 'utf-8'))
@@ -70,7 +87,7 @@ class AuthorisationAgent:
             'Authorization': auth_header,
         }
         try:
-            response = self.session.post(TOKEN_URL, headers=headers, data=params)
+            response = self.session.post(self.token_url, headers=headers, data=params)
             response.raise_for_status()
         except requests.exceptions.HTTPError:
             logger.error('HTTP/{0} error during web API request:\n{1}'.format(response.status_code, response.content), exc_info=True)
@@ -83,30 +100,61 @@ class AuthorisationAgent:
 
 
 class OAuthCallbackServer:
-    def __init__(self, client_id, auth_code_callback, errback=None, port=CALLBACK_SERVER_PORT):
+    """
+    Listens on the loopback interface for the single redirect back from Spotify's authorisation page.
+
+    auth_code_callback is called with the authorisation code, or errback (if given) with the error Spotify reported, and the listener then stops.  If no redirect has arrived after timeout seconds, errback is called with ERROR_TIMEOUT.  cancel() stops the listener without calling either.  Passing port=0 listens on any free port, which is then available as the port attribute once run_threaded() has been called.
+    """
+
+    def __init__(self, client_id, auth_code_callback, errback=None, port=CALLBACK_SERVER_PORT, timeout=CALLBACK_TIMEOUT):
         self.client_id = client_id
         self.port = port
         self.auth_code_callback = auth_code_callback
         self.errback = errback
+        self.timeout = timeout
+        self._server = None
+        self._finished = threading.Event()
 
-        self._server = flask.Flask('OAuthCallbackServer')
-        self._server.add_url_rule('/oauth', view_func=self.on_callback_request)
+    def run_threaded(self):
+        self._server = CallbackHTTPServer(('127.0.0.1', self.port), CallbackRequestHandler, self)
+        self.port = self._server.server_address[1]
+        threading.Thread(target=self._serve, name='OAuthCallbackServer', daemon=True).start()
 
-    def on_callback_request(self):
-        auth_code = flask.request.args.get('code', None)
+    def _serve(self):
+        deadline = time.monotonic() + self.timeout if self.timeout else None
+        try:
+            while not self._finished.is_set():
+                if deadline is not None and time.monotonic() >= deadline:
+                    logger.warning('No authorisation callback received after %s seconds', self.timeout)
+                    self._finished.set()
+                    if self.errback is not None:
+                        self.errback(ERROR_TIMEOUT)
+                    break
+                self._server.handle_request()
+        finally:
+            self._server.server_close()
+
+    def on_callback_request(self, params):
+        if self._finished.is_set():
+            return
+        self._finished.set()
+        auth_code = params.get('code', None)
         if auth_code is None and self.errback is not None:
-            self.errback(flask.request.args.get('error', None))
+            self.errback(params.get('error', None))
         else:
             self.auth_code_callback(auth_code)
 
-        self.shutdown()
-        return ''
+    def cancel(self):
+        """
+        Stop listening, within CALLBACK_POLL_INTERVAL seconds.
+        """
+        self._finished.set()
 
-    def shutdown(self):
-        flask.request.environ.get('werkzeug.server.shutdown')()
+    shutdown = cancel
 
-    def run_threaded(self):
-        threading.Thread(target=self._server.run, kwargs={'port': self.port, 'debug': False}).start()
+    @property
+    def finished(self):
+        return self._finished.is_set()
 
     def get_authorisation_url(self, scopes):
         params = {
@@ -118,5 +166,35 @@ class OAuthCallbackServer:
         return requote_uri(AUTHORISATION_URL.format(params=RequestEncodingMixin._encode_params(params)))
 
     def get_redirect_uri(self):
-        return 'http://127.0.0.1:{0}/oauth'.format(self.port)
+        return 'http://127.0.0.1:{0}{1}'.format(self.port, CALLBACK_PATH)
+
+
+class CallbackHTTPServer(HTTPServer):
+    timeout = CALLBACK_POLL_INTERVAL
+
+    def __init__(self, address, handler_class, callback_server):
+        super().__init__(address, handler_class)
+        self.callback_server = callback_server
+
+
+class CallbackRequestHandler(BaseHTTPRequestHandler):
+    # The server handles one request at a time, so an idle connection would otherwise hold it up until the deadline had long passed
+    timeout = CALLBACK_CONNECTION_TIMEOUT
+
+    def log_message(self, format, *args):
+        logger.debug('OAuth callback server: ' + format, *args)
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        if url.path != CALLBACK_PATH:
+            self.send_error(404)
+            return
+        params = {key: values[0] for key, values in parse_qs(url.query).items()}
+        content = CALLBACK_RESPONSE_PAGE.encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/html; charset=utf-8')
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+        self.server.callback_server.on_callback_request(params)
 
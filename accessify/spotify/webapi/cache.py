@@ -0,0 +1,67 @@
+"""
+A bounded in-memory cache of parsed Web API responses.
+
+Entries are kept per endpoint and query parameters, least recently used first out.  An entry stored with fresh_for is served by WebAPIClient without a request until that many seconds have passed, which is how prefetched responses are used.  After that, or straight away for entries stored with no fresh_for, an entry's ETag is sent in If-None-Match, and if the server replies 304 Not Modified the stored payload is used instead of downloading and parsing it again.
+"""
+
+from collections import OrderedDict
+import threading
+import time
+from urllib.parse import urlencode
+
+
+DEFAULT_MAX_ENTRIES = 500
+
+
+def cache_key(endpoint, query_parameters):
+    return '{0}?{1}'.format(endpoint, urlencode(sorted((str(key), str(value)) for key, value in (query_parameters or {}).items())))
+
+
+class CacheEntry:
+    __slots__ = ('payload', 'fresh_until', 'etag')
+
+    def __init__(self, payload, fresh_until, etag=None):
+        self.payload = payload
+        self.fresh_until = fresh_until
+        self.etag = etag
+
+
+class ResponseCache:
+    def __init__(self, max_entries=DEFAULT_MAX_ENTRIES, clock=time.monotonic):
+        self.max_entries = max_entries
+        self.clock = clock
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+
+    def get_fresh(self, key):
+        """
+        Return the payload stored for key if it's still fresh, or None.
+        """
+        entry = self.get(key)
+        if entry is None or not self.is_fresh(entry):
+            return None
+        return entry.payload
+
+    def is_fresh(self, entry):
+        return entry.fresh_until > self.clock()
+
+    def store(self, key, payload, fresh_for=0, etag=None):
+        with self._lock:
+            self._entries[key] = CacheEntry(payload, self.clock() + fresh_for, etag)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
@@ -0,0 +1,204 @@
+"""
+Recording of Web API interactions to a cassette file, and replaying them later without a network connection.
+
+A cassette starts with MAGIC, followed by one record per response: a header giving the lengths of the two parts which follow, the request's interaction key and the response as JSON.  Records are only ever appended, so a session that crashes part way through still leaves a usable cassette.  For replay, the file is memory-mapped and only the record headers and keys are read up front; each record is decoded when it's served.
+"""
+
+from enum import Enum
+import logging
+import mmap
+import os
+import struct
+import threading
+import time
+from urllib.parse import urlencode
+
+import requests
+import ujson as json
+
+from accessify.spotify.webapi import exceptions
+
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b'ACCASS01'
+RECORD_HEADER = struct.Struct('<II')
+RECORDED_HEADERS = ('Content-Type', 'Retry-After', 'ETag', 'Cache-Control')
+
+
+class CassetteMode(Enum):
+    RECORD = 'record'
+    REPLAY = 'replay'
+    # Replay, sleeping for as long as each response originally took
+    REPLAY_TIMED = 'replay_timed'
+
+
+def interaction_key(method, endpoint, query_parameters, body, conditional=False):
+    """
+    Identify a request independently of parameter order and access token.  Conditional requests, sent with If-None-Match, are kept apart from unconditional ones, as only they can be answered with 304 Not Modified.
+    """
+    parameters = urlencode(sorted((str(key), str(value)) for key, value in (query_parameters or {}).items()))
+    canonical_body = json.dumps(body, sort_keys=True) if body is not None else ''
+    key = '{0} {1}?{2} {3}'.format(method, endpoint, parameters, canonical_body)
+    return key + ' If-None-Match' if conditional else key
+
+
+class CassetteResponse:
+    """
+    The parts of requests.Response which WebAPIClient.request uses, rebuilt from a record.
+    """
+
+    def __init__(self, key, record):
+        self.status_code = record['status']
+        self.headers = requests.structures.CaseInsensitiveDict(record['headers'])
+        self.content = record['content'].encode('utf-8')
+        self.elapsed_seconds = record['elapsed']
+        self.url = key
+
+    def raise_for_status(self):
+        if 400 <= self.status_code < 600:
+            raise requests.exceptions.HTTPError('{0} error replayed for {1}'.format(self.status_code, self.url), response=self)
+
+
+class CassetteRecorder:
+    replaying = False
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        is_new = not os.path.exists(path) or os.path.getsize(path) == 0
+        if not is_new:
+            truncate_torn_record(path)
+        self._file = open(path, 'ab')
+        if is_new:
+            self._file.write(MAGIC)
+            self._file.flush()
+
+    def record(self, method, endpoint, query_parameters, body, response, elapsed, conditional=False):
+        key = interaction_key(method, endpoint, query_parameters, body, conditional).encode('utf-8')
+        record = {
+            'status': response.status_code,
+            'headers': {name: response.headers[name] for name in RECORDED_HEADERS if name in response.headers},
+            'content': response.content.decode('utf-8'),
+            'elapsed': elapsed,
+            'recorded_at': time.time(),
+        }
+        data = json.dumps(record).encode('utf-8')
+        with self._lock:
+            self._file.write(RECORD_HEADER.pack(len(key), len(data)))
+            self._file.write(key)
+            self._file.write(data)
+            self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+
+class CassettePlayer:
+    """
+    Serves recorded responses by request.  Identical requests get their recorded responses in the order they were recorded, with the last one repeated once they run out.
+    """
+
+    replaying = True
+
+    def __init__(self, path, timed=False, sleep=time.sleep):
+        self.path = path
+        self.timed = timed
+        self._sleep = sleep
+        self._lock = threading.Lock()
+        self._file = open(path, 'rb')
+        if os.path.getsize(path) <= len(MAGIC):
+            self._map = None
+            self._index = {}
+        else:
+            self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+            if self._map[:len(MAGIC)] != MAGIC:
+                raise exceptions.CassetteError('{0} is not a cassette'.format(path))
+            self._index = self._build_index()
+        self._positions = {}
+
+    def _build_index(self):
+        """
+        Map each interaction key to the (offset, length) of its responses, without decoding any of them.
+        """
+        index = {}
+        offset = len(MAGIC)
+        size = len(self._map)
+        while offset + RECORD_HEADER.size <= size:
+            key_length, length = RECORD_HEADER.unpack_from(self._map, offset)
+            key_start = offset + RECORD_HEADER.size
+            start = key_start + key_length
+            if start + length > size:
+                logger.warning('Ignoring truncated record at the end of cassette {0}'.format(self.path))
+                break
+            key = self._map[key_start:start].decode('utf-8')
+            index.setdefault(key, []).append((start, length))
+            offset = start + length
+        logger.debug('Indexed {0} recorded interactions from {1}'.format(sum(len(records) for records in index.values()), self.path))
+        return index
+
+    def __len__(self):
+        return sum(len(records) for records in self._index.values())
+
+    def replay(self, method, endpoint, query_parameters, body, conditional=False):
+        key = interaction_key(method, endpoint, query_parameters, body, conditional)
+        with self._lock:
+            records = self._index.get(key)
+            if not records:
+                raise exceptions.CassetteError('No recorded response for {0}'.format(key))
+            position = self._positions.get(key, 0)
+            self._positions[key] = min(position + 1, len(records) - 1)
+            start, length = records[position]
+            record = json.loads(self._map[start:start + length])
+        response = CassetteResponse(key, record)
+        if self.timed:
+            self._sleep(response.elapsed_seconds)
+        return response
+
+    def close(self):
+        if self._map is not None:
+            self._map.close()
+        self._file.close()
+
+
+def truncate_torn_record(path):
+    """
+    Cut off a record left incomplete by a crash at the end of the cassette at path, so that records appended after it can be found on replay.
+    """
+    with open(path, 'r+b') as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise exceptions.CassetteError('{0} is not a cassette'.format(path))
+        end = len(MAGIC)
+        while True:
+            header = f.read(RECORD_HEADER.size)
+            if len(header) < RECORD_HEADER.size:
+                break
+            key_length, length = RECORD_HEADER.unpack(header)
+            record_end = end + RECORD_HEADER.size + key_length + length
+            f.seek(record_end)
+            # Seeking past the end of the file succeeds, so check that the record's parts were all written
+            if f.tell() > os.fstat(f.fileno()).st_size:
+                break
+            end = record_end
+        if end < os.fstat(f.fileno()).st_size:
+            logger.warning('Removing a truncated record from the end of cassette {0}'.format(path))
+            f.truncate(end)
+
+
+def open_cassette(path, mode):
+    mode = CassetteMode(mode)
+    if mode == CassetteMode.RECORD:
+        return CassetteRecorder(path)
+    return CassettePlayer(path, timed=mode == CassetteMode.REPLAY_TIMED)
+
+
+def open_cassette_from_environment():
+    """
+    Record Web API traffic to, or replay it from, the cassette file named by ACCESSIFY_CASSETTE.  ACCESSIFY_CASSETTE_MODE is one of record (the default), replay or replay_timed.
+    """
+    path = os.environ.get('ACCESSIFY_CASSETTE')
+    if not path:
+        return None
+    mode = os.environ.get('ACCESSIFY_CASSETTE_MODE', CassetteMode.RECORD.value)
+    logger.info('Using Web API cassette {0} in {1} mode'.format(path, mode))
+    return open_cassette(path, mode)
@@ -1,10 +1,15 @@
 import logging
+import time
 
 import requests
 from requests.status_codes import codes
 import ujson as json
 
+from accessify import metrics
+from accessify import tracing
 from accessify.spotify.webapi import exceptions
+from accessify.spotify.webapi.cache import ResponseCache, cache_key
+from accessify.spotify.webapi.fields import format_fields, supports_fields
 
 
 logger = logging.getLogger(__name__)
@@ -14,11 +19,15 @@ API_VERSION = 'v1'
 
 MARKET_FROM_TOKEN = 'from_token'
 DEFAULT_LIMIT = 50
+PLAYLIST_TRACKS_LIMIT = 100
 
 
 class WebAPIClient:
-    def __init__(self, authorisation_agent):
+    def __init__(self, authorisation_agent, base_url=BASE_URL, cassette=None, cache=None):
         self.authorisation = authorisation_agent
+        self.base_url = base_url
+        self.cassette = cassette
+        self.cache = cache if cache is not None else ResponseCache()
         self._session = requests.Session()
 
     def me(self):
@@ -27,28 +36,172 @@ class WebAPIClient:
     def search(self, query, search_type, market=MARKET_FROM_TOKEN, limit=DEFAULT_LIMIT, offset=0):
         return self.request('search', query_parameters={'q': query, 'type': search_type, 'market': market, 'limit': limit, 'offset': offset})
 
-    def request(self, endpoint, method='GET', query_parameters=None):
-        token = self.authorisation.get_access_token()
-        headers = {'Authorization': 'Bearer {0}'.format(token)}
+    def album_tracks(self, album_id, market=MARKET_FROM_TOKEN, limit=DEFAULT_LIMIT, offset=0, fresh_for=0):
+        return self.request('albums/{0}/tracks'.format(album_id), query_parameters={'market': market, 'limit': limit, 'offset': offset}, fresh_for=fresh_for)
+
+    def artist_top_tracks(self, artist_id, market=MARKET_FROM_TOKEN, fresh_for=0):
+        return self.request('artists/{0}/top-tracks'.format(artist_id), query_parameters={'market': market}, fresh_for=fresh_for)
+
+    def tracks(self, track_ids, market=MARKET_FROM_TOKEN, fresh_for=0):
+        return self.request('tracks', query_parameters={'ids': ','.join(track_ids), 'market': market}, fresh_for=fresh_for)
+
+    def albums(self, album_ids, market=MARKET_FROM_TOKEN, fresh_for=0):
+        return self.request('albums', query_parameters={'ids': ','.join(album_ids), 'market': market}, fresh_for=fresh_for)
+
+    def artists(self, artist_ids, fresh_for=0):
+        return self.request('artists', query_parameters={'ids': ','.join(artist_ids)}, fresh_for=fresh_for)
+
+    def playlist(self, playlist_id, market=MARKET_FROM_TOKEN, fields=None):
+        return self.request('playlists/{0}'.format(playlist_id), query_parameters={'market': market}, fields=fields)
+
+    def playlist_tracks(self, playlist_id, market=MARKET_FROM_TOKEN, limit=PLAYLIST_TRACKS_LIMIT, offset=0, fields=None):
+        return self.request('playlists/{0}/tracks'.format(playlist_id), query_parameters={'market': market, 'limit': limit, 'offset': offset}, fields=fields)
+
+    def saved_tracks(self, market=MARKET_FROM_TOKEN, limit=DEFAULT_LIMIT, offset=0):
+        return self.request('me/tracks', query_parameters={'market': market, 'limit': limit, 'offset': offset})
+
+    def saved_albums(self, market=MARKET_FROM_TOKEN, limit=DEFAULT_LIMIT, offset=0):
+        return self.request('me/albums', query_parameters={'market': market, 'limit': limit, 'offset': offset})
+
+    def contains_saved_tracks(self, track_ids):
+        return self.request('me/tracks/contains', query_parameters={'ids': ','.join(track_ids)})
+
+    def contains_saved_albums(self, album_ids):
+        return self.request('me/albums/contains', query_parameters={'ids': ','.join(album_ids)})
+
+    def save_tracks(self, track_ids):
+        return self.request('me/tracks', method='PUT', body={'ids': track_ids})
+
+    def remove_saved_tracks(self, track_ids):
+        return self.request('me/tracks', method='DELETE', body={'ids': track_ids})
+
+    def save_albums(self, album_ids):
+        return self.request('me/albums', method='PUT', body={'ids': album_ids})
+
+    def remove_saved_albums(self, album_ids):
+        return self.request('me/albums', method='DELETE', body={'ids': album_ids})
+
+    def add_to_playlist(self, playlist_id, uris, position=None):
+        body = {'uris': uris}
+        if position is not None:
+            body.update(position=position)
+        return self.request('playlists/{0}/tracks'.format(playlist_id), method='POST', body=body)
+
+    def remove_from_playlist(self, playlist_id, uris):
+        return self.request('playlists/{0}/tracks'.format(playlist_id), method='DELETE', body={'tracks': [{'uri': uri} for uri in uris]})
+
+    def player(self, market=MARKET_FROM_TOKEN):
+        return self.request('me/player', query_parameters={'market': market})
+
+    def start_playback(self, context_uri=None, uris=None, offset_uri=None):
+        body = {}
+        if context_uri is not None:
+            body.update(context_uri=context_uri)
+        if uris is not None:
+            body.update(uris=uris)
+        if offset_uri is not None:
+            body.update(offset={'uri': offset_uri})
+        return self.request('me/player/play', method='PUT', body=body)
+
+    def resume_playback(self):
+        return self.request('me/player/play', method='PUT')
+
+    def pause_playback(self):
+        return self.request('me/player/pause', method='PUT')
+
+    def skip_to_next(self):
+        return self.request('me/player/next', method='POST')
+
+    def skip_to_previous(self):
+        return self.request('me/player/previous', method='POST')
+
+    def seek(self, position_ms):
+        return self.request('me/player/seek', method='PUT', query_parameters={'position_ms': position_ms})
+
+    def set_volume(self, volume_percent):
+        return self.request('me/player/volume', method='PUT', query_parameters={'volume_percent': volume_percent})
+
+    def add_to_queue(self, uri):
+        return self.request('me/player/queue', method='POST', query_parameters={'uri': uri})
+
+    def request(self, endpoint, method='GET', query_parameters=None, body=None, fresh_for=0, fields=None):
+        """
+        Make a request and return the parsed response.
+
+        GET responses are cached.  One requested with fresh_for is served from the cache without a request for that many seconds.  Otherwise, if the cached response had an ETag, it's sent in If-None-Match and the cached payload is returned if the server replies 304 Not Modified.
+
+        fields is a projection from the fields module.  It's sent as a fields filter if the endpoint supports one, and otherwise the full response is returned.
+        """
         if query_parameters is None:
             query_parameters = {}
+        if fields is not None:
+            if supports_fields(endpoint):
+                query_parameters = dict(query_parameters, fields=format_fields(fields))
+            else:
+                logger.debug('%s takes no fields filter, requesting full objects', endpoint)
+        key = cache_key(endpoint, query_parameters) if method == 'GET' else None
+        entry = self.cache.get(key) if key is not None else None
+        if entry is not None and self.cache.is_fresh(entry):
+            metrics.registry.counter('webapi_cache_hits_total', 'Web API requests served from the cache', labels={'endpoint': metrics.endpoint_label(endpoint), 'validated': 'no'}).inc()
+            return entry.payload
+        headers = {'If-None-Match': entry.etag} if entry is not None and entry.etag else None
+        token = self.authorisation.access_token
+        with tracing.span('webapi {0} {1}'.format(method, metrics.endpoint_label(endpoint))):
+            if self.cassette is not None and self.cassette.replaying:
+                response = self.cassette.replay(method, endpoint, query_parameters, body, conditional=headers is not None)
+            else:
+                response = self._send(endpoint, method, query_parameters, body, headers)
+        if response.status_code == codes.not_modified:
+            if headers is None:
+                # Nothing was cached to validate, so a 304 can't be for this request and has no payload to return
+                raise exceptions.APIError(response.status_code, 'Not Modified in reply to {0} {1}, which was sent without If-None-Match'.format(method, endpoint))
+            metrics.registry.counter('webapi_cache_hits_total', 'Web API requests served from the cache', labels={'endpoint': metrics.endpoint_label(endpoint), 'validated': 'yes'}).inc()
+            self.cache.store(key, entry.payload, fresh_for, entry.etag)
+            return entry.payload
         try:
-            response = self._session.request(method, url=api_url(endpoint), params=query_parameters, headers=headers)
             if response.status_code == codes.unauthorized:
-                self.authorisation.refresh_access_token()
-                return self.request(endpoint, method, query_parameters)
+                self.authorisation.refresh_access_token(expired_token=token)
+                return self.request(endpoint, method, query_parameters, body, fresh_for)
             else:
                 response.raise_for_status()
         except requests.exceptions.HTTPError:
-            logger.error('HTTP/{0} error during web API request:\n{1}'.format(response.status_code, response.content), exc_info=True)
+            logger.error('HTTP/%s error during web API request:\n%s', response.status_code, response.content, exc_info=True)
             try:
                 payload = json.loads(response.content)
                 raise exceptions.APIError(payload['error']['status'], payload['error']['message'])
             except (ValueError, KeyError):
                 pass
-        return json.loads(response.content)
+        # Player endpoints reply with 204 No Content
+        if not response.content:
+            return None
+        payload = json.loads(response.content)
+        etag = response.headers.get('ETag')
+        if key is not None and (fresh_for or etag):
+            self.cache.store(key, payload, fresh_for, etag)
+        return payload
+
+    def _send(self, endpoint, method, query_parameters, body, extra_headers=None):
+        token = self.authorisation.get_access_token()
+        headers = {'Authorization': 'Bearer {0}'.format(token)}
+        if extra_headers:
+            headers.update(extra_headers)
+        if body is not None:
+            data = json.dumps(body)
+            headers.update({'Content-Type': 'application/json'})
+        else:
+            data = None
+        started = time.perf_counter()
+        response = self._session.request(method, url=api_url(endpoint, self.base_url), params=query_parameters, data=data, headers=headers)
+        elapsed = time.perf_counter() - started
+        labels = {'endpoint': metrics.endpoint_label(endpoint), 'method': method}
+        metrics.registry.histogram('webapi_request_seconds', 'Web API request latency', labels=labels).observe(elapsed)
+        metrics.registry.counter('webapi_responses_total', 'Web API responses by status code', labels=dict(labels, status=response.status_code)).inc()
+        # A 401 says more about the access token at the time than the request, and replaying one would mean refreshing the token for real
+        if self.cassette is not None and response.status_code != codes.unauthorized:
+            self.cassette.record(method, endpoint, query_parameters, body, response, elapsed, conditional=bool(extra_headers and 'If-None-Match' in extra_headers))
+        return response
 
 
-def api_url(endpoint):
-    return '{0}/{1}/{2}'.format(BASE_URL, API_VERSION, endpoint)
+def api_url(endpoint, base_url=BASE_URL):
+    return '{0}/{1}/{2}'.format(base_url, API_VERSION, endpoint)
 
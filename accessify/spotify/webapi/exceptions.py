@@ -13,3 +13,6 @@ class AuthorisationError(Exception):
 class NotAuthenticatedError(Exception):
     pass
 
+
+class CassetteError(Exception):
+    pass
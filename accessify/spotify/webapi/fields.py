@@ -0,0 +1,32 @@
+"""
+Field projections, for asking the Web API for only the parts of an object that will be used.
+
+A projection is a tuple of field names, with (name, projection) pairs for the fields of nested objects, e.g. ('name', 'uri', ('artists', ('name', 'uri'))).  Lists of objects are projected item by item.  Only some endpoints accept a fields filter; WebAPIClient leaves it off for the rest, which then reply with full objects.
+"""
+
+import re
+
+
+# The playlist endpoints are the only ones which take a fields parameter
+SUPPORTED_ENDPOINTS = re.compile(r'(users/[^/]+/)?playlists/[^/]+(/tracks)?')
+PAGING_FIELDS = ('total', 'offset', 'limit', 'next')
+
+
+def supports_fields(endpoint):
+    return SUPPORTED_ENDPOINTS.fullmatch(endpoint) is not None
+
+
+def format_fields(fields):
+    """
+    Format a projection in the syntax of the fields parameter, e.g. name,uri,artists(name,uri).
+    """
+    return ','.join(field if isinstance(field, str) else '{0}({1})'.format(field[0], format_fields(field[1])) for field in fields)
+
+
+def page_of(item_fields, wrapper=None):
+    """
+    Return the projection of a paging object containing items projected with item_fields, nested in a field called wrapper if given, as with the track of each playlist item.
+    """
+    if wrapper is not None:
+        item_fields = ((wrapper, item_fields),)
+    return PAGING_FIELDS + (('items', item_fields),)
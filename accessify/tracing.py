@@ -0,0 +1,233 @@
+"""
+Correlation IDs for following a user action across threads.
+
+start_trace() gives the calling thread a TraceContext, which is carried along by everything the action causes: pykka messages sent to a MeasuredActor, signals sent through MeasuredSignal and callbacks scheduled with gui.utils.main_thread.  Each of those records a span with the time it started and how long it took, and end_trace() puts the spans together into a timeline of the whole action.
+"""
+
+from collections import OrderedDict
+import itertools
+import logging
+import queue
+import threading
+import time
+from typing import NamedTuple
+
+import ujson as json
+
+
+logger = logging.getLogger(__name__)
+
+MAX_TRACES = 200
+
+
+class TraceContext(NamedTuple):
+    trace_id: str
+    name: str
+    started_at: float
+
+
+class Span(NamedTuple):
+    trace_id: str
+    name: str
+    thread: str
+    started_at: float
+    duration: float
+
+
+_local = threading.local()
+_trace_numbers = itertools.count(1)
+
+
+def current_context():
+    return getattr(_local, 'context', None)
+
+
+def set_context(context):
+    _local.context = context
+
+
+def current_trace_id():
+    context = current_context()
+    return context.trace_id if context is not None else None
+
+
+class Tracer:
+    """
+    Keeps the spans of the most recent max_traces traces.
+    """
+
+    def __init__(self, max_traces=MAX_TRACES, clock=time.perf_counter):
+        self.max_traces = max_traces
+        self.clock = clock
+        self._lock = threading.Lock()
+        self._traces = OrderedDict()
+
+    def start(self, name):
+        context = TraceContext('{0}-{1}'.format(name, next(_trace_numbers)), name, self.clock())
+        with self._lock:
+            self._traces[context.trace_id] = {'context': context, 'spans': []}
+            while len(self._traces) > self.max_traces:
+                self._traces.popitem(last=False)
+        return context
+
+    def record(self, context, name, started_at, duration):
+        span = Span(context.trace_id, name, threading.current_thread().name, started_at, duration)
+        with self._lock:
+            trace = self._traces.get(context.trace_id)
+            if trace is not None:
+                trace['spans'].append(span)
+
+    def timeline(self, trace_id):
+        """
+        Return the spans of a trace in the order they started, with times in milliseconds relative to the start of the trace.
+        """
+        with self._lock:
+            trace = self._traces.get(trace_id)
+            if trace is None:
+                return None
+            context = trace['context']
+            spans = sorted(trace['spans'], key=lambda span: span.started_at)
+        return {
+            'trace_id': trace_id,
+            'name': context.name,
+            'total_ms': max([(span.started_at + span.duration - context.started_at) * 1000 for span in spans] or [0]),
+            'spans': [
+                {
+                    'name': span.name,
+                    'thread': span.thread,
+                    'offset_ms': (span.started_at - context.started_at) * 1000,
+                    'duration_ms': span.duration * 1000,
+                }
+                for span in spans
+            ],
+        }
+
+    def timelines(self):
+        with self._lock:
+            trace_ids = list(self._traces)
+        return [self.timeline(trace_id) for trace_id in trace_ids]
+
+    def dump(self, path):
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(self.timelines(), f, indent=4)
+
+
+tracer = Tracer()
+
+
+class start_trace:
+    """
+    Context manager giving the calling thread a new trace for the duration of the block, recorded as the trace's first span.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.context = None
+
+    def __enter__(self):
+        self._previous = current_context()
+        self.context = tracer.start(self.name)
+        set_context(self.context)
+        return self.context
+
+    def __exit__(self, *exc_info):
+        tracer.record(self.context, self.name, self.context.started_at, tracer.clock() - self.context.started_at)
+        set_context(self._previous)
+        return False
+
+
+class span:
+    """
+    Context manager recording the block as a span of the current trace, if there is one.
+    """
+
+    __slots__ = ('name', '_context', '_started_at')
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self._context = current_context()
+        if self._context is not None:
+            self._started_at = tracer.clock()
+        return self
+
+    def __exit__(self, *exc_info):
+        if self._context is not None:
+            tracer.record(self._context, self.name, self._started_at, tracer.clock() - self._started_at)
+        return False
+
+
+class continue_trace:
+    """
+    Context manager restoring a context captured on another thread for the duration of the block.  If queued_at is given, the time between then and now is recorded as a span named after the hop.
+    """
+
+    __slots__ = ('context', 'hop', 'queued_at', '_previous')
+
+    def __init__(self, context, hop=None, queued_at=None):
+        self.context = context
+        self.hop = hop
+        self.queued_at = queued_at
+
+    def __enter__(self):
+        self._previous = current_context()
+        set_context(self.context)
+        if self.context is not None and self.queued_at is not None:
+            tracer.record(self.context, self.hop, self.queued_at, tracer.clock() - self.queued_at)
+        return self.context
+
+    def __exit__(self, *exc_info):
+        set_context(self._previous)
+        return False
+
+
+def end_trace(context=None):
+    """
+    Log and return the timeline of the current trace, or of context if given.
+    """
+    if context is None:
+        context = current_context()
+    if context is None:
+        return None
+    timeline = tracer.timeline(context.trace_id)
+    if timeline is not None and logger.isEnabledFor(logging.DEBUG):
+        logger.debug('Timeline for %s:\n%s', context.trace_id, format_timeline(timeline))
+    return timeline
+
+
+def format_timeline(timeline):
+    lines = ['{0}: {1:.1f} ms'.format(timeline['trace_id'], timeline['total_ms'])]
+    for entry in timeline['spans']:
+        lines.append('  +{0:8.1f} ms {1:8.1f} ms  {2} [{3}]'.format(entry['offset_ms'], entry['duration_ms'], entry['name'], entry['thread']))
+    return '\n'.join(lines)
+
+
+class TracingQueue(queue.Queue):
+    """
+    A queue which carries the putting thread's trace context along with each item, and restores it on the thread which gets the item.  Time spent waiting in the queue is recorded as a span named after the queue.
+    """
+
+    def __init__(self, name, maxsize=0):
+        super().__init__(maxsize)
+        self.name = name
+
+    def put(self, item, block=True, timeout=None):
+        super().put((current_context(), tracer.clock(), item), block, timeout)
+
+    def get(self, block=True, timeout=None):
+        context, queued_at, item = super().get(block, timeout)
+        set_context(context)
+        if context is not None:
+            tracer.record(context, '{0} queue'.format(self.name), queued_at, tracer.clock() - queued_at)
+        return item
+
+
+class TraceIdFilter(logging.Filter):
+    """
+    Adds the current trace ID to log records as trace_id, so that log lines from one action can be tied together.
+    """
+
+    def filter(self, record):
+        record.trace_id = current_trace_id() or '-'
+        return True
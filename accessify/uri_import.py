@@ -0,0 +1,177 @@
+"""
+Importing lists of Spotify URIs and open.spotify.com links thousands at a time, as pasted or read from a file.
+
+Input is scanned a line at a time and every URI or link in it is normalised and checked against those already seen, so duplicates cost nothing.  URIResolver takes any iterable of lines, so an open file is read as it's scanned, but import_uris over JSON-RPC receives the whole text as one string.  Items are looked up with the Web API's several-at-once endpoints, each batch being sent as soon as it's full and several at a time, and come back in the order they were first given.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+import logging
+import time
+from typing import Any, Callable, List, NamedTuple, Optional, Tuple
+
+from accessify import metrics
+from accessify.spotify.utils import find_uris, split_uri
+from accessify.spotify.webapi import exceptions
+
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CONCURRENCY = 4
+
+
+class Lookup(NamedTuple):
+    # The WebAPIClient method and the key of the list in its response, or None if it takes a single ID and returns the item itself
+    method: str
+    key: Optional[str]
+    batch_size: int
+    deserialize: Callable[[dict], Any]
+    fields: Optional[Tuple] = None
+
+
+class ImportResult(NamedTuple):
+    # Resolved items in the order first given, then the URIs which weren't found or couldn't be looked up
+    items: List[Any]
+    unresolved: List[str]
+    # URIs of kinds which weren't asked for, and text which looked like a URI or link but wasn't valid
+    skipped: List[str]
+    rejected: List[str]
+    duplicates: int
+    candidates: int
+    requests: int
+    seconds: float
+    uris_per_second: float
+
+
+class URIScanner:
+    """
+    Yields each valid URI in lines the first time it appears, counting what it passes over.
+    """
+
+    def __init__(self):
+        self.seen = set()
+        self.candidates = 0
+        self.duplicates = 0
+        self.rejected = []
+
+    def scan(self, lines):
+        for line in lines:
+            for candidate, uri in find_uris(line):
+                self.candidates += 1
+                if uri is None:
+                    self.rejected.append(candidate)
+                elif uri in self.seen:
+                    self.duplicates += 1
+                else:
+                    self.seen.add(uri)
+                    yield uri
+
+
+class URIResolver:
+    """
+    lookups maps each kind of URI which can be resolved to its Lookup.
+    """
+
+    def __init__(self, api_client, lookups, concurrency=DEFAULT_CONCURRENCY):
+        self.api_client = api_client
+        self.lookups = lookups
+        self.concurrency = max(1, concurrency)
+
+    def resolve(self, lines, kinds=None):
+        """
+        Resolve the URIs and links in lines, an iterable of strings such as a file, limited to kinds if given.  Returns an ImportResult.
+        """
+        started = time.perf_counter()
+        scanner = URIScanner()
+        order = []
+        skipped = []
+        pending = {kind: [] for kind in self.lookups}
+        futures = []
+        with ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix='URIResolver') as executor:
+            for uri in scanner.scan(lines):
+                kind, item_id = split_uri(uri)
+                if kind not in self.lookups or (kinds is not None and kind not in kinds):
+                    skipped.append(uri)
+                    continue
+                order.append(uri)
+                batch = pending[kind]
+                batch.append(item_id)
+                if len(batch) >= self.lookups[kind].batch_size:
+                    futures.append(executor.submit(self._look_up, kind, batch))
+                    pending[kind] = []
+            for kind, batch in pending.items():
+                if batch:
+                    futures.append(executor.submit(self._look_up, kind, batch))
+            resolved = {}
+            for future in futures:
+                resolved.update(future.result())
+        items = [resolved[uri] for uri in order if uri in resolved]
+        unresolved = [uri for uri in order if uri not in resolved]
+        seconds = time.perf_counter() - started
+        result = ImportResult(
+            items=items,
+            unresolved=unresolved,
+            skipped=skipped,
+            rejected=scanner.rejected,
+            duplicates=scanner.duplicates,
+            candidates=scanner.candidates,
+            requests=len(futures),
+            seconds=seconds,
+            uris_per_second=scanner.candidates / seconds if seconds else 0.0,
+        )
+        record_import(result)
+        return result
+
+    def _look_up(self, kind, item_ids):
+        """
+        Return {URI: item} for those of item_ids which were found.  A failed lookup is logged and leaves the whole batch unresolved.
+        """
+        lookup = self.lookups[kind]
+        method = getattr(self.api_client, lookup.method)
+        try:
+            if lookup.key is None:
+                objects = [method(item_ids[0], fields=lookup.fields)]
+            else:
+                objects = method(item_ids)[lookup.key]
+        except (exceptions.APIError, OSError):
+            logger.warning('Could not look up %d %s URIs', len(item_ids), kind, exc_info=True)
+            return {}
+        resolved = {}
+        for item_id, item in zip(item_ids, objects):
+            # IDs which don't exist come back as null, in the position they were asked for
+            if item is not None:
+                resolved['spotify:{0}:{1}'.format(kind, item_id)] = lookup.deserialize(item)
+        return resolved
+
+
+def record_import(result):
+    counts = {
+        'resolved': len(result.items),
+        'unresolved': len(result.unresolved),
+        'skipped': len(result.skipped),
+        'rejected': len(result.rejected),
+        'duplicate': result.duplicates,
+    }
+    for outcome, count in counts.items():
+        if count:
+            metrics.registry.counter('uri_import_uris_total', 'URIs and links read by bulk imports by what became of them', labels={'result': outcome}).inc(count)
+    logger.info('Imported %d of %d URIs in %.2f seconds (%.0f URIs/sec, %d requests): %s', len(result.items), result.candidates, result.seconds, result.uris_per_second, result.requests, counts)
+
+
+def summarise(result, written=None):
+    """
+    Return the counts from result which are worth reporting, without the items themselves.
+    """
+    summary = {
+        'resolved': len(result.items),
+        'unresolved': result.unresolved,
+        'skipped': result.skipped,
+        'rejected': result.rejected,
+        'duplicates': result.duplicates,
+        'requests': result.requests,
+        'seconds': result.seconds,
+        'uris_per_second': result.uris_per_second,
+    }
+    if written is not None:
+        summary['written'] = len(written.written)
+        summary['failed'] = written.failed
+    return summary
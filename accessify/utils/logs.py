@@ -0,0 +1,127 @@
+"""
+Background log writing.
+
+Log records are put on a queue by whichever thread logs them, and formatted and written to disk by a single listener thread.  The log file is rotated when it reaches a size limit or a day old, whichever comes first, and only the newest few rotated files are kept.
+"""
+
+import glob
+import logging
+import logging.handlers
+import os
+import os.path
+import queue
+import time
+
+
+LOG_FILENAME = 'accessify.log'
+LOG_RECORD_FORMAT = '%(levelname)s - %(asctime)s:%(msecs)d [%(trace_id)s]:\n%(name)s: %(message)s'
+LOG_DATE_TIME_FORMAT = '%d-%m-%Y @ %H:%M:%S'
+MAX_LOG_BYTES = 5 * 1024 * 1024
+MAX_LOG_AGE = 24 * 60 * 60
+LOG_BACKUP_COUNT = 5
+# Files named the way logs were before rotation, one per launch
+LEGACY_LOG_PATTERN = 'accessify.*_*.log'
+LEGACY_LOG_RETENTION = 7 * 24 * 60 * 60
+
+DEFAULT_LOG_LEVEL = 'INFO'
+
+
+class SizeAndTimeRotatingFileHandler(logging.handlers.RotatingFileHandler):
+    """
+    A RotatingFileHandler which also rolls over once the current file is max_age seconds old.
+    """
+
+    def __init__(self, filename, max_bytes=MAX_LOG_BYTES, max_age=MAX_LOG_AGE, backup_count=LOG_BACKUP_COUNT, encoding='utf-8', clock=time.time):
+        super().__init__(filename, maxBytes=max_bytes, backupCount=backup_count, encoding=encoding, delay=True)
+        self.max_age = max_age
+        self._clock = clock
+        try:
+            self._opened_at = os.path.getmtime(filename) if os.path.getsize(filename) else clock()
+        except OSError:
+            self._opened_at = clock()
+
+    def shouldRollover(self, record):
+        if self.max_age and self._clock() - self._opened_at >= self.max_age:
+            return True
+        return super().shouldRollover(record)
+
+    def doRollover(self):
+        super().doRollover()
+        self._opened_at = self._clock()
+
+
+class DeferredQueueHandler(logging.handlers.QueueHandler):
+    """
+    Queues records without formatting them, leaving that to the listener thread.
+
+    logging.handlers.QueueHandler formats each message on the logging thread, so that records can be pickled.  Ours never leave the process, so the message and its arguments are passed along as they are.  Objects passed as arguments therefore mustn't be changed after they've been logged.
+    """
+
+    def prepare(self, record):
+        if record.exc_info and not record.exc_text:
+            # Tracebacks keep every frame alive, so render them straight away
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+class LogPipeline:
+    """
+    Routes all logging through a queue to handlers run on a listener thread.  Call stop() before exiting to flush whatever is still queued.
+
+    Filters are run on the thread which logged the record, before it's queued, so they can add details such as the current trace ID.
+    """
+
+    def __init__(self, handlers, filters=(), level=logging.DEBUG):
+        self.queue = queue.Queue()
+        self.handler = DeferredQueueHandler(self.queue)
+        for log_filter in filters:
+            self.handler.addFilter(log_filter)
+        self.listener = logging.handlers.QueueListener(self.queue, *handlers, respect_handler_level=True)
+        root_logger = logging.getLogger()
+        root_logger.setLevel(level)
+        root_logger.addHandler(self.handler)
+        self.listener.start()
+
+    def stop(self):
+        self.listener.stop()
+        logging.getLogger().removeHandler(self.handler)
+        for handler in self.listener.handlers:
+            handler.close()
+
+
+def create_formatter():
+    return logging.Formatter(LOG_RECORD_FORMAT, LOG_DATE_TIME_FORMAT)
+
+
+def create_file_handler(log_directory, formatter, filename=LOG_FILENAME):
+    handler = SizeAndTimeRotatingFileHandler(os.path.join(log_directory, filename))
+    handler.setFormatter(formatter)
+    return handler
+
+
+def remove_old_logs(log_directory, retention=LEGACY_LOG_RETENTION, clock=time.time):
+    now = clock()
+    for path in glob.glob(os.path.join(log_directory, LEGACY_LOG_PATTERN)):
+        try:
+            if now - os.path.getmtime(path) > retention:
+                os.remove(path)
+        except OSError:
+            pass
+
+
+def apply_log_levels(config):
+    """
+    Set the root log level from config['log_level'], and the level of individual loggers from config['log_levels'], a dict mapping logger names such as accessify.spotify.remote to level names.
+    """
+    logging.getLogger().setLevel(level_from_name(config.get('log_level', DEFAULT_LOG_LEVEL)))
+    for name, level in config.get('log_levels', {}).items():
+        logging.getLogger(name).setLevel(level_from_name(level))
+
+
+def level_from_name(name):
+    level = logging.getLevelName(str(name).upper())
+    if not isinstance(level, int):
+        logging.getLogger(__name__).warning('Unknown log level %s, using %s', name, DEFAULT_LOG_LEVEL)
+        level = logging.getLevelName(DEFAULT_LOG_LEVEL)
+    return level
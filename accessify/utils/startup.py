@@ -0,0 +1,169 @@
+"""
+Timing of application startup.
+
+StartupProfiler records how long each phase of startup takes and when the main window first becomes responsive, the time to interactive.  Phases which don't depend on each other can be run on background threads with run_concurrently().  With --profile-startup, module imports are timed as well and a report is printed when startup finishes.
+"""
+
+import builtins
+from concurrent.futures import Future
+import logging
+import sys
+import threading
+import time
+
+
+logger = logging.getLogger(__name__)
+
+PROFILE_STARTUP_ARGUMENT = '--profile-startup'
+SLOWEST_IMPORTS = 20
+
+
+def profiling_requested(argv=None):
+    return PROFILE_STARTUP_ARGUMENT in (sys.argv if argv is None else argv)
+
+
+class ImportTimer:
+    """
+    Times every module imported for the first time while installed, including the time taken to import its own dependencies.
+    """
+
+    def __init__(self, clock=time.perf_counter):
+        self.clock = clock
+        self.times = {}
+        self._local = threading.local()
+        self._original_import = None
+
+    def install(self):
+        self._original_import = builtins.__import__
+        builtins.__import__ = self._import
+
+    def uninstall(self):
+        if self._original_import is not None:
+            builtins.__import__ = self._original_import
+            self._original_import = None
+
+    def _import(self, name, globals=None, locals=None, fromlist=(), level=0):
+        if level or name in sys.modules:
+            return self._original_import(name, globals, locals, fromlist, level)
+        depth = getattr(self._local, 'depth', 0)
+        self._local.depth = depth + 1
+        started = self.clock()
+        try:
+            return self._original_import(name, globals, locals, fromlist, level)
+        finally:
+            self._local.depth = depth
+            self.times.setdefault(name, (self.clock() - started, depth))
+
+    def slowest(self, count=SLOWEST_IMPORTS):
+        """
+        Return [(module, milliseconds, depth)] for the slowest imports, where depth 0 means the module was imported directly rather than by another module being imported.
+        """
+        ranked = sorted(self.times.items(), key=lambda item: item[1][0], reverse=True)
+        return [(name, seconds * 1000, depth) for name, (seconds, depth) in ranked[:count]]
+
+
+class StartupProfiler:
+    def __init__(self, started_at, import_timer=None, clock=time.perf_counter):
+        self.started_at = started_at
+        self.import_timer = import_timer
+        self.clock = clock
+        self.phases = []
+        self.interactive_at = None
+        self._lock = threading.Lock()
+
+    def record(self, name, started, finished):
+        with self._lock:
+            self.phases.append((name, started, finished, threading.current_thread().name))
+
+    def phase(self, name):
+        return _Phase(self, name)
+
+    def run_concurrently(self, name, func, *args, **kwargs):
+        """
+        Run func on a background thread as a phase of its own, returning a Future for its result.
+        """
+        future = Future()
+
+        def run():
+            with self.phase(name):
+                try:
+                    future.set_result(func(*args, **kwargs))
+                except BaseException as e:
+                    future.set_exception(e)
+
+        threading.Thread(target=run, name=name, daemon=True).start()
+        return future
+
+    def mark_interactive(self):
+        self.interactive_at = self.clock()
+        time_to_interactive = self.interactive_at - self.started_at
+        # Imported here so as not to be imported before the import timer is installed
+        from accessify import metrics
+        metrics.registry.gauge('startup_time_to_interactive_seconds', 'Time from the start of the import of accessify.main until the main window handles its first event').set(time_to_interactive)
+        logger.info('Interactive after %.0f ms', time_to_interactive * 1000)
+        if self.import_timer is not None:
+            self.import_timer.uninstall()
+            print(format_report(self.report()))
+
+    def report(self):
+        with self._lock:
+            phases = sorted(self.phases, key=lambda phase: phase[1])
+        report = {
+            'time_to_interactive_ms': (self.interactive_at - self.started_at) * 1000 if self.interactive_at is not None else None,
+            'phases': [
+                {
+                    'name': name,
+                    'thread': thread,
+                    'offset_ms': (started - self.started_at) * 1000,
+                    'duration_ms': (finished - started) * 1000,
+                }
+                for name, started, finished, thread in phases
+            ],
+        }
+        if self.import_timer is not None:
+            report['slowest_imports'] = [{'module': name, 'ms': ms, 'depth': depth} for name, ms, depth in self.import_timer.slowest()]
+        return report
+
+
+class _Phase:
+    def __init__(self, profiler, name):
+        self._profiler = profiler
+        self._name = name
+
+    def __enter__(self):
+        self._started = self._profiler.clock()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._profiler.record(self._name, self._started, self._profiler.clock())
+        return False
+
+
+def format_report(report):
+    lines = ['Startup profile']
+    if report['time_to_interactive_ms'] is not None:
+        lines.append('Time to interactive: {0:.1f} ms'.format(report['time_to_interactive_ms']))
+    lines.append('')
+    lines.append('Phases:')
+    for phase in report['phases']:
+        lines.append('  +{0:8.1f} ms {1:8.1f} ms  {2} [{3}]'.format(phase['offset_ms'], phase['duration_ms'], phase['name'], phase['thread']))
+    if 'slowest_imports' in report:
+        lines.append('')
+        lines.append('Slowest imports:')
+        for entry in report['slowest_imports']:
+            lines.append('  {0:8.1f} ms  {1}{2}'.format(entry['ms'], '  ' * entry['depth'], entry['module']))
+    return '\n'.join(lines)
+
+
+def prefetched(future, fallback):
+    """
+    Return a callable which returns the result of future the first time it's called, and the result of calling fallback thereafter.
+    """
+    state = {'used': False}
+
+    def call():
+        if not state['used']:
+            state['used'] = True
+            return future.result()
+        return fallback()
+    return call
@@ -0,0 +1,422 @@
+"""
+Changes to the user's library and playlists, made in as few requests as the Web API allows.
+
+BatchWriter splits a change into chunks of the most items each endpoint accepts, so saving 500 tracks takes 10 requests rather than 500.  Where the order chunks are applied in doesn't matter they're sent several at a time, and where it does, as with adding tracks to a playlist, one after another.  Chunks which fail are retried on their own, and progress is reported through the write_progress signal of LibrarySignalman.
+
+WriteBehindQueue sits in front of a BatchWriter for changes made a keypress at a time, such as saving and unsaving the selected track.  It holds them for a moment, cancels out changes of mind and sends the rest in batches, keeping a copy on disk until they've been written.
+"""
+
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import logging
+import os
+import threading
+import time
+from typing import List, NamedTuple
+
+import ujson as json
+
+from accessify import metrics
+from accessify.spotify.utils import split_uri
+from accessify.spotify.webapi import exceptions
+
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CONCURRENCY = 4
+DEFAULT_ATTEMPTS = 3
+# Seconds before the first retry, growing with each attempt
+DEFAULT_RETRY_DELAY = 1
+
+# The WebAPIClient methods which save and remove each kind of item, and the most IDs they accept
+SAVE_METHODS = {
+    'track': ('save_tracks', 'remove_saved_tracks', 50),
+    'album': ('save_albums', 'remove_saved_albums', 20),
+}
+PLAYLIST_CHUNK_SIZE = 100
+
+DEFAULT_FLUSH_INTERVAL = 2
+# A full chunk of tracks
+DEFAULT_FLUSH_SIZE = 50
+# Flushes a change may fail in before it's given up on, on top of the writer's own retries
+DEFAULT_MAX_FLUSH_ATTEMPTS = 5
+PENDING_WRITES_FILENAME = 'pending_writes.json'
+
+
+class WriteProgress(NamedTuple):
+    description: str
+    written: int
+    failed: int
+    total: int
+    finished: bool = False
+
+
+class WriteResult(NamedTuple):
+    written: List[str]
+    failed: List[str]
+    requests: int
+    # Those of failed which can't succeed however often they're sent, because the Web API refused them or they're of a kind which can't be written
+    rejected: List[str] = []
+
+
+class BatchWriter:
+    """
+    Safe to share between threads and actors.  If given, signalman's write_progress signal is sent a WriteProgress after each chunk is written and once more when a change has finished, and membership is told about items saved or removed.
+    """
+
+    def __init__(self, api_client, signalman=None, membership=None, concurrency=DEFAULT_CONCURRENCY, attempts=DEFAULT_ATTEMPTS, retry_delay=DEFAULT_RETRY_DELAY):
+        self.api_client = api_client
+        self._signalman = signalman
+        self.membership = membership
+        self.attempts = attempts
+        self.retry_delay = retry_delay
+        self._executor = ThreadPoolExecutor(max_workers=max(1, concurrency), thread_name_prefix='BatchWriter')
+
+    def stop(self):
+        self._executor.shutdown()
+
+    def save(self, uris):
+        return self._write_saved(uris, saved=True)
+
+    def remove_saved(self, uris):
+        return self._write_saved(uris, saved=False)
+
+    def _write_saved(self, uris, saved):
+        """
+        Save or remove track and album URIs, each kind through its own endpoint.  URIs of anything else are rejected.
+        """
+        by_kind = {kind: [] for kind in SAVE_METHODS}
+        unsupported = []
+        for uri in uris:
+            parts = split_uri(uri)
+            if parts is not None and parts[0] in by_kind:
+                by_kind[parts[0]].append(uri)
+            else:
+                unsupported.append(uri)
+        if unsupported:
+            logger.warning('Cannot %s %d items which are not tracks or albums: %s', 'save' if saved else 'remove', len(unsupported), unsupported)
+        written, failed, rejected, requests = [], list(unsupported), list(unsupported), 0
+        for kind, kind_uris in by_kind.items():
+            if not kind_uris:
+                continue
+            save_method, remove_method, chunk_size = SAVE_METHODS[kind]
+            send = getattr(self.api_client, save_method if saved else remove_method)
+
+            def send_chunk(chunk, offset, send=send):
+                send([split_uri(uri)[1] for uri in chunk])
+                if self.membership is not None:
+                    self.membership.mark_saved(chunk, saved)
+
+            result = self.write('{0} {1}s'.format('save' if saved else 'remove', kind), kind_uris, chunk_size, send_chunk)
+            written.extend(result.written)
+            failed.extend(result.failed)
+            rejected.extend(result.rejected)
+            requests += result.requests
+        return WriteResult(written, failed, requests, rejected)
+
+    def add_to_playlist(self, playlist_uri, uris, position=None):
+        """
+        Add uris to a playlist in the order given, at position or otherwise at the end.
+        """
+        playlist_id = split_uri(playlist_uri)[1]
+
+        def send_chunk(chunk, offset):
+            self.api_client.add_to_playlist(playlist_id, chunk, position + offset if position is not None else None)
+
+        # Each chunk goes after the one before, so they have to be added in order
+        return self.write('add to playlist', uris, PLAYLIST_CHUNK_SIZE, send_chunk, ordered=True)
+
+    def remove_from_playlist(self, playlist_uri, uris):
+        playlist_id = split_uri(playlist_uri)[1]
+        return self.write('remove from playlist', uris, PLAYLIST_CHUNK_SIZE, lambda chunk, offset: self.api_client.remove_from_playlist(playlist_id, chunk))
+
+    def write(self, description, items, chunk_size, send, ordered=False):
+        """
+        Write items in chunks of chunk_size by calling send(chunk, offset), where offset is the position in items of the chunk's first item, and return a WriteResult.
+
+        Unless ordered is True, chunks are sent concurrently.  If it is, a chunk is only sent once the ones before it have succeeded.  Chunks which fail for reasons which might pass, such as rate limiting, are retried, while those the Web API rejects outright are not.
+        """
+        chunks = [(offset, items[offset:offset + chunk_size]) for offset in range(0, len(items), chunk_size)]
+        progress = _Progress(self._signalman, description, len(items))
+        pending = chunks
+        rejected = []
+        for attempt in range(self.attempts):
+            if attempt:
+                time.sleep(self.retry_delay * attempt)
+                metrics.registry.counter('write_chunk_retries_total', 'Chunks of library and playlist changes sent again after failing', labels={'write': description}).inc(len(pending))
+            if ordered:
+                results = []
+                for index, chunk in enumerate(pending):
+                    error = self._send_chunk(send, chunk, progress)
+                    if error is not None:
+                        # The chunks after this one have to wait for it
+                        results.append((chunk, error))
+                        results.extend((later, None) for later in pending[index + 1:])
+                        break
+            else:
+                futures = [(chunk, self._executor.submit(self._send_chunk, send, chunk, progress)) for chunk in pending]
+                results = [(chunk, future.result()) for chunk, future in futures if future.result() is not None]
+            rejected.extend(chunk for chunk, error in results if error is not None and not is_transient(error))
+            pending = [chunk for chunk, error in results if error is None or is_transient(error)]
+            if not pending:
+                break
+        failed_chunks = sorted(pending + rejected, key=lambda chunk: chunk[0])
+        failed_offsets = set(offset for offset, chunk in failed_chunks)
+        failed_items = [item for offset, chunk in failed_chunks for item in chunk]
+        rejected_items = [item for offset, chunk in rejected for item in chunk]
+        written_items = [item for offset, chunk in chunks if offset not in failed_offsets for item in chunk]
+        progress.finish(len(failed_items))
+        if failed_items:
+            logger.warning('Could not %s: %d of %d items failed, %d of them rejected by the Web API', description, len(failed_items), len(items), len(rejected_items))
+        return WriteResult(written_items, failed_items, progress.requests, rejected_items)
+
+    def _send_chunk(self, send, chunk, progress):
+        """
+        Return None if the chunk was written, or the exception it failed with.
+        """
+        offset, items = chunk
+        try:
+            send(items, offset)
+        except (exceptions.APIError, OSError) as e:
+            # requests' exceptions are OSErrors
+            logger.debug('Writing %d items failed: %r', len(items), e)
+            progress.record_request()
+            return e
+        progress.record_request(len(items))
+        return None
+
+
+def is_transient(error):
+    """
+    Whether a write which failed with error might succeed if sent again: connection problems, rate limiting and server errors.
+    """
+    if isinstance(error, exceptions.APIError):
+        return error.status_code == 429 or error.status_code >= 500
+    return True
+
+
+class _Progress:
+    def __init__(self, signalman, description, total):
+        self._signalman = signalman
+        self.description = description
+        self.total = total
+        self.written = 0
+        self.requests = 0
+        self._lock = threading.Lock()
+
+    def record_request(self, written=0):
+        with self._lock:
+            self.requests += 1
+            self.written += written
+            progress = WriteProgress(self.description, self.written, 0, self.total)
+        if written:
+            self._send(progress)
+
+    def finish(self, failed):
+        self._send(WriteProgress(self.description, self.written, failed, self.total, finished=True))
+
+    def _send(self, progress):
+        if self._signalman is not None:
+            self._signalman.write_progress.send(progress)
+
+
+class WriteBehindQueue:
+    """
+    Buffers saving and removing of library items, flushing them through writer once flush_interval seconds have passed since the oldest unflushed change or flush_size items are waiting.
+
+    Changes to the same URI are collapsed, so that only the last is sent.  Where the writer's LibraryMembership knows whether an item was saved before it was first changed, a change which leaves it that way, such as saving an unsaved track and removing it again, is dropped altogether.  If path is given, waiting and in-flight changes are kept there, and any found when the queue is created are written on the first flush.
+
+    Changes which fail for reasons which might pass are flushed again, up to max_attempts times, while those the Web API rejects are dropped and logged.
+    """
+
+    def __init__(self, writer, path=None, flush_interval=DEFAULT_FLUSH_INTERVAL, flush_size=DEFAULT_FLUSH_SIZE, max_attempts=DEFAULT_MAX_FLUSH_ATTEMPTS, clock=time.monotonic):
+        self.writer = writer
+        self.path = path
+        self.flush_interval = flush_interval
+        self.flush_size = flush_size
+        self.max_attempts = max_attempts
+        self.clock = clock
+        # URI to True to save or False to remove, oldest first
+        self._pending = OrderedDict(load_pending_writes(path) if path is not None else [])
+        # Whether each pending URI was saved before it was changed, where known
+        self._original_states = {}
+        self._in_flight = {}
+        # Flushes each pending URI has failed in so far
+        self._failed_attempts = {}
+        self._first_pending_at = clock() if self._pending else None
+        self._condition = threading.Condition()
+        self._flush_lock = threading.Lock()
+        self._stopping = False
+        self._thread = None
+        self._unflushed_changes = len(self._pending)
+        self.changes = 0
+        self.requests = 0
+        self.avoided_requests = 0
+        self.dropped = 0
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='WriteBehindQueue', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """
+        Stop the flushing thread and write whatever is still waiting.
+        """
+        with self._condition:
+            self._stopping = True
+            self._condition.notify_all()
+        if self._thread is not None:
+            self._thread.join()
+        self.flush()
+
+    def save(self, uris):
+        self._queue(uris, True)
+
+    def remove(self, uris):
+        self._queue(uris, False)
+
+    def _queue(self, uris, saved):
+        membership = self.writer.membership
+        with self._condition:
+            for uri in uris:
+                self.changes += 1
+                self._unflushed_changes += 1
+                if uri not in self._pending and uri not in self._original_states and membership is not None:
+                    self._original_states[uri] = membership.known_state(uri)
+                if self._original_states.get(uri) == saved:
+                    # Leaves the item as it was
+                    self._pending.pop(uri, None)
+                else:
+                    self._pending[uri] = saved
+                    self._pending.move_to_end(uri)
+            if not self._pending:
+                self._first_pending_at = None
+            elif self._first_pending_at is None:
+                self._first_pending_at = self.clock()
+            self._persist()
+            self._condition.notify_all()
+        if membership is not None:
+            membership.mark_saved(uris, saved)
+
+    def __len__(self):
+        return len(self._pending)
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._stopping and not self._due():
+                    self._condition.wait(self._time_until_due())
+                if self._stopping:
+                    return
+            try:
+                self.flush()
+            except Exception:
+                logger.exception('Error while flushing library changes')
+
+    def _due(self):
+        return bool(self._pending) and (len(self._pending) >= self.flush_size or self.clock() - self._first_pending_at >= self.flush_interval)
+
+    def _time_until_due(self):
+        if not self._pending:
+            return None
+        return max(0, self._first_pending_at + self.flush_interval - self.clock())
+
+    def flush(self):
+        """
+        Write everything waiting now, on the calling thread.  Changes which fail are queued again unless they've been superseded in the meantime, rejected or tried max_attempts times.
+        """
+        with self._flush_lock:
+            with self._condition:
+                batch = self._in_flight = self._pending
+                changes = self._unflushed_changes
+                self._pending = OrderedDict()
+                self._original_states = {}
+                self._first_pending_at = None
+                self._unflushed_changes = 0
+            if not batch:
+                return
+            to_save = [uri for uri, saved in batch.items() if saved]
+            to_remove = [uri for uri, saved in batch.items() if not saved]
+            failed = []
+            rejected = set()
+            requests = 0
+            for uris, write in ((to_save, self.writer.save), (to_remove, self.writer.remove_saved)):
+                if uris:
+                    result = write(uris)
+                    failed.extend(result.failed)
+                    rejected.update(result.rejected)
+                    requests += result.requests
+            dropped = {'rejected': [], 'attempts': []}
+            with self._condition:
+                failed_set = set(failed)
+                for uri in batch:
+                    if uri not in failed_set:
+                        self._failed_attempts.pop(uri, None)
+                for uri in failed:
+                    if uri in self._pending:
+                        # Superseded by a newer change, which will be tried afresh
+                        self._failed_attempts.pop(uri, None)
+                        continue
+                    attempts = self._failed_attempts[uri] = self._failed_attempts.get(uri, 0) + 1
+                    if uri in rejected or attempts >= self.max_attempts:
+                        del self._failed_attempts[uri]
+                        dropped['rejected' if uri in rejected else 'attempts'].append(uri)
+                    else:
+                        self._pending[uri] = batch[uri]
+                if self._pending and self._first_pending_at is None:
+                    self._first_pending_at = self.clock()
+                self._in_flight = {}
+                self._persist()
+                self.requests += requests
+                # Without the queue, every change would have been a request of its own
+                avoided = max(0, changes - requests)
+                self.avoided_requests += avoided
+                self.dropped += len(dropped['rejected']) + len(dropped['attempts'])
+            metrics.registry.counter('library_write_requests_avoided_total', 'Requests saved by collapsing and batching changes to the library').inc(avoided)
+            for reason, uris in dropped.items():
+                if not uris:
+                    continue
+                metrics.registry.counter('library_writes_dropped_total', 'Library changes given up on', labels={'reason': reason}).inc(len(uris))
+                logger.warning('Dropped %d library changes (%s): %s', len(uris), reason, uris)
+                if self.writer.membership is not None:
+                    # They were marked as made when queued, which has turned out not to be so
+                    for uri in uris:
+                        self.writer.membership.mark_saved([uri], not batch[uri])
+
+    def statistics(self):
+        with self._condition:
+            return {
+                'changes': self.changes,
+                'requests': self.requests,
+                'avoided_requests': self.avoided_requests,
+                'dropped': self.dropped,
+                'pending': len(self._pending),
+            }
+
+    def _persist(self):
+        if self.path is None:
+            return
+        writes = dict(self._in_flight)
+        writes.update(self._pending)
+        save_pending_writes(self.path, writes)
+
+
+def load_pending_writes(path):
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return [(uri, bool(saved)) for uri, saved in json.load(f)['writes']]
+    except FileNotFoundError:
+        return []
+    except (OSError, ValueError, KeyError, TypeError):
+        logger.warning('Ignoring unreadable pending library changes in %s', path, exc_info=True)
+        return []
+
+
+def save_pending_writes(path, writes):
+    temporary_path = '{0}.tmp'.format(path)
+    try:
+        with open(temporary_path, 'w', encoding='utf-8') as f:
+            json.dump({'writes': list(writes.items())}, f)
+        os.replace(temporary_path, path)
+    except OSError:
+        logger.warning('Could not save pending library changes to %s', path, exc_info=True)
@@ -0,0 +1,117 @@
+"""
+Measure saving tracks and adding them to a playlist one request per item against BatchWriter's chunked writes.
+
+Each write of --items tracks is timed against a FakeWebAPIServer with added latency, one item per request and then with BatchWriter at each of --concurrency.  The playlist is checked to hold the added tracks in order, and a final run with every --fail-every-th request rate limited shows only failed chunks being retried.
+
+    python -m benchmarks.batch_writes --items 500 --latency 0.05
+"""
+
+import argparse
+import logging
+import sys
+import time
+
+import ujson as json
+
+from accessify import library
+from accessify import writes
+
+from benchmarks.fake_webapi import FakeWebAPIServer, FaultInjector, make_id
+from benchmarks.webapi import create_client
+
+
+PLAYLIST_INDEX = 11
+
+
+def track_uris(count, first=0):
+    return ['spotify:track:{0}'.format(make_id(first + index)) for index in range(count)]
+
+
+def playlist_uri():
+    return 'spotify:playlist:{0}'.format(make_id(PLAYLIST_INDEX))
+
+
+def timed(server, write):
+    requests_before = server.stats['requests']
+    started = time.perf_counter()
+    result = write()
+    return {
+        'seconds': time.perf_counter() - started,
+        'requests': server.stats['requests'] - requests_before,
+        'failed': len(result.failed) if result is not None else 0,
+    }
+
+
+def one_by_one(client, uris, add_to_playlist):
+    playlist_id = make_id(PLAYLIST_INDEX)
+    for uri in uris:
+        if add_to_playlist:
+            client.add_to_playlist(playlist_id, [uri])
+        else:
+            client.save_tracks([uri.rsplit(':', 1)[1]])
+
+
+def run(server, items, concurrency_levels):
+    client = create_client(server)
+    results = {'save_tracks': {}, 'add_to_playlist': {}}
+    first = 0
+    results['save_tracks']['one_by_one'] = timed(server, lambda: one_by_one(client, track_uris(items, first), False))
+    results['add_to_playlist']['one_by_one'] = timed(server, lambda: one_by_one(client, track_uris(items, first), True))
+    for concurrency in concurrency_levels:
+        first += items
+        uris = track_uris(items, first)
+        signalman = library.LibrarySignalman()
+        progress = []
+        signalman.write_progress.connect(progress.append, weak=False)
+        writer = writes.BatchWriter(client, signalman, concurrency=concurrency)
+        label = 'concurrency_{0}'.format(concurrency)
+        results['save_tracks'][label] = dict(timed(server, lambda: writer.save(uris)), progress_updates=len(progress))
+        results['add_to_playlist'][label] = timed(server, lambda: writer.add_to_playlist(playlist_uri(), uris))
+        additions = server.catalogue.playlist_additions[PLAYLIST_INDEX]
+        results['add_to_playlist'][label]['in_order'] = additions[-items:] == uris
+        writer.stop()
+    return results
+
+
+def run_with_failures(items, latency, fail_every):
+    server = FakeWebAPIServer(faults=FaultInjector(latency=latency, rate_limit_every=fail_every)).start()
+    try:
+        client = create_client(server)
+        writer = writes.BatchWriter(client, retry_delay=latency)
+        uris = track_uris(items, 5000)
+        save = timed(server, lambda: writer.save(uris))
+        add = timed(server, lambda: writer.add_to_playlist(playlist_uri(), uris))
+        writer.stop()
+        return {
+            'save_tracks': save,
+            'add_to_playlist': add,
+            'in_order': server.catalogue.playlist_additions.get(PLAYLIST_INDEX) == uris,
+            'rate_limited': server.stats['rate_limited'],
+        }
+    finally:
+        server.stop()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--items', type=int, default=500)
+    parser.add_argument('--latency', type=float, default=0.05, help='Seconds added to every fake Web API response')
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 4])
+    parser.add_argument('--fail-every', type=int, default=4, help='Rate limit every nth request in the run with failures')
+    args = parser.parse_args(argv)
+    # The injected 429s would otherwise have their tracebacks printed to stderr
+    logging.getLogger('accessify').addHandler(logging.NullHandler())
+
+    server = FakeWebAPIServer(latency=args.latency)
+    server.start()
+    try:
+        results = {'options': vars(args), 'writes': run(server, args.items, args.concurrency)}
+    finally:
+        server.stop()
+    results['with_failures'] = run_with_failures(args.items, args.latency, args.fail_every)
+    json.dump(results, sys.stdout, indent=4)
+    sys.stdout.write('\n')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,87 @@
+"""
+Measure how long accessify subcommands take to reach a running instance.
+
+A PlaybackController with a backend which does nothing is served over JSON-RPC from this process, and the endpoint file is written to a temporary config directory.  Cold invocations run the command in a new interpreter each time, as a user at a shell would; warm ones call accessify.cli.main() repeatedly in this process, showing the cost of connecting and making the call alone.  An interpreter which only runs pass is timed as a baseline.
+
+    python -m benchmarks.cli --cold 20 --warm 500
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+
+import ujson as json
+
+from accessify import config as configuration
+from accessify import constants
+from accessify import ipc
+from accessify import playback
+from accessify import rpc
+from accessify.spotify import backends
+from accessify.spotify import exceptions
+from benchmarks.timing import summarise, time_calls
+
+
+HEAVY_MODULES = ('wx', 'pykka', 'requests')
+IMPORT_CHECK = 'import sys; from accessify import cli; cli.main(["next"]); print(",".join(name for name in {0!r} if name in sys.modules))'.format(HEAVY_MODULES)
+
+
+class NullBackend(backends.PlaybackBackend):
+    def connect(self):
+        raise exceptions.SpotifyNotRunningError
+
+    def play_uri(self, uri, context=None):
+        pass
+
+    def queue_uri(self, uri):
+        pass
+
+    def send_command(self, command):
+        pass
+
+
+def run_subprocess(command, env):
+    subprocess.run(command, env=env, check=True, stdout=subprocess.DEVNULL)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--cold', type=int, default=20, help='Number of invocations in a new interpreter')
+    parser.add_argument('--warm', type=int, default=500, help='Number of invocations in this process')
+    parser.add_argument('--output', help='Write results to this JSON file as well as standard output')
+    args = parser.parse_args(argv)
+
+    config_directory = tempfile.mkdtemp()
+    os.environ[configuration.CONFIG_DIRECTORY_VARIABLE] = config_directory
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(sys.path))
+
+    signalman = playback.PlaybackSignalman()
+    controller = playback.PlaybackController.start(signalman, {}, backend=NullBackend())
+    server = rpc.RPCServer(controller.proxy(), None, [signalman], ipc.get_endpoint_path(config_directory, constants.APP_NAME))
+    server.start()
+    try:
+        from accessify import cli
+        results = {
+            'interpreter_baseline': summarise(time_calls(run_subprocess, args.cold, [sys.executable, '-c', 'pass'], env)),
+            'cold_next': summarise(time_calls(run_subprocess, args.cold, [sys.executable, '-m', 'accessify.cli', 'next'], env)),
+            'warm_next': summarise(time_calls(cli.main, args.warm, ['next'])),
+            'warm_queue': summarise(time_calls(cli.main, args.warm, ['queue', 'spotify:track:6rqhFgbbKwnb9MLmUQDhG6'])),
+        }
+        check = subprocess.run([sys.executable, '-c', IMPORT_CHECK], env=env, check=True, stdout=subprocess.PIPE)
+        imported = check.stdout.decode('utf-8').strip()
+        results['heavy_modules_imported'] = imported.split(',') if imported else []
+    finally:
+        server.stop()
+        controller.stop()
+
+    json.dump(results, sys.stdout, indent=4)
+    sys.stdout.write('\n')
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=4)
+
+
+if __name__ == '__main__':
+    main()
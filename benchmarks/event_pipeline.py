@@ -0,0 +1,122 @@
+"""
+Measure how long Web Helper state changes take to come out of the other end of RemoteBridge -> EventManager -> PlaybackController -> PlaybackSignalman.
+
+A FakeWebHelperServer replays a scripted timeline of captured responses.  For every step of the timeline, the latency is the time from the step starting to the first signal it causes.  Window commands go to a RecordingWindow, so this runs on any platform with openssl available.
+
+    python -m benchmarks.event_pipeline --duration 30 --polling-interval 60
+"""
+
+import argparse
+from collections import defaultdict
+import sys
+import threading
+import time
+
+import ujson as json
+
+from accessify import playback
+from accessify.spotify import backends
+from accessify.spotify.remote import RemoteBridge
+
+from benchmarks.fake_webhelper import FakeWebHelperServer, RecordingWindow
+from benchmarks.timing import summarise, time_calls
+
+
+class SignalRecorder:
+    def __init__(self, signalman):
+        self.received = []
+        self._lock = threading.Lock()
+        for name in signalman.signals:
+            getattr(signalman, name).connect(self._receiver(name), weak=False)
+
+    def _receiver(self, name):
+        def receive(sender, **kwargs):
+            with self._lock:
+                self.received.append((time.perf_counter(), name))
+        return receive
+
+    def between(self, start, end):
+        with self._lock:
+            return [(received_at, name) for received_at, name in self.received if start <= received_at < end]
+
+
+def bridge_factory(server):
+    def create_bridge(port):
+        return RemoteBridge(port, hostname='127.0.0.1', token_url=server.token_url, window=RecordingWindow())
+    return create_bridge
+
+
+def run_pipeline(duration, polling_interval, idle_polling_interval, latency, command_iterations):
+    server = FakeWebHelperServer(latency=latency).start()
+    signalman = playback.PlaybackSignalman()
+    recorder = SignalRecorder(signalman)
+    backend = backends.WebHelperBackend(polling_interval, idle_polling_interval, port_finder=lambda: server.port, bridge_factory=bridge_factory(server))
+    config = {'spotify_polling_interval': polling_interval, 'spotify_idle_polling_interval': idle_polling_interval}
+    controller = playback.PlaybackController.start(signalman, config, backend=backend)
+    proxy = controller.proxy()
+    try:
+        proxy.connect_to_spotify().get()
+        time.sleep(duration)
+        statistics = proxy.get_statistics().get()
+        results = {
+            'latency_by_step': step_latencies(server.timeline, recorder),
+            'signals_per_second': len(recorder.received) / duration,
+            'signal_counts': count_signals(recorder.received),
+            'requests_per_second': {path: count / duration for path, count in server.request_counts.items()},
+            'polling': statistics['polling'],
+            'commands': {
+                'play_uri': summarise(time_calls(lambda: proxy.play_uri('spotify:track:1mYEgQl8LaIaQQRVp339sL').get(), command_iterations)),
+                'next_track': summarise(time_calls(lambda: proxy.next_track().get(), command_iterations)),
+                'increase_volume': summarise(time_calls(lambda: proxy.increase_volume().get(), command_iterations)),
+            },
+        }
+    finally:
+        controller.stop()
+        server.stop()
+    return results
+
+
+def step_latencies(timeline, recorder):
+    step_number, step, offset = timeline.position()
+    latencies = defaultdict(list)
+    missed = defaultdict(int)
+    for number in range(1, step_number):
+        start = timeline.step_start_time(number)
+        end = timeline.step_start_time(number + 1)
+        previous = timeline.steps[(number - 1) % len(timeline.steps)].fixture
+        current = timeline.steps[number % len(timeline.steps)].fixture
+        transition = '{0} -> {1}'.format(previous, current)
+        signals = recorder.between(start, end)
+        if signals:
+            latencies[transition].append(signals[0][0] - start)
+        else:
+            missed[transition] += 1
+    return {
+        transition: dict(summarise(latencies.get(transition, [])), missed=missed.get(transition, 0))
+        for transition in set(latencies) | set(missed)
+    }
+
+
+def count_signals(received):
+    counts = defaultdict(int)
+    for received_at, name in received:
+        counts[name] += 1
+    return counts
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--duration', type=float, default=30)
+    parser.add_argument('--polling-interval', type=int, default=60)
+    parser.add_argument('--idle-polling-interval', type=int, default=300)
+    parser.add_argument('--latency', type=float, default=0, help='Simulated Web Helper latency in seconds')
+    parser.add_argument('--command-iterations', type=int, default=5)
+    args = parser.parse_args(argv)
+
+    results = run_pipeline(args.duration, args.polling_interval, args.idle_polling_interval, args.latency, args.command_iterations)
+    json.dump(results, sys.stdout, indent=4)
+    sys.stdout.write('\n')
+
+
+if __name__ == '__main__':
+    main()
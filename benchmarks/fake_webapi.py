@@ -0,0 +1,685 @@
+"""
+A local stand-in for the parts of api.spotify.com and accounts.spotify.com used by Accessify, for exercising and benchmarking the Web API code without a network connection or a Spotify account.
+
+Catalogue entities are generated on the fly from their index, in the same shape and at roughly the same size as the real thing, so no fixtures need to be stored.  Latency, expiring access tokens and rate limiting can be injected with FaultInjector.
+"""
+
+import hashlib
+from http.server import BaseHTTPRequestHandler, HTTPServer
+import random
+import re
+import socketserver
+import threading
+import time
+from urllib.parse import parse_qs, urlencode, urlsplit
+
+import ujson as json
+
+
+ID_PREFIX = 'fake'
+ID_LENGTH = 22
+DEFAULT_CATALOGUE_SIZE = 10000
+DEFAULT_LIBRARY_SIZE = 2000
+DEFAULT_PLAYLIST_SIZE = 500
+DEFAULT_MARKET_COUNT = 80
+ALBUM_TRACK_COUNT = 12
+MARKETS = ['AD', 'AR', 'AT', 'AU', 'BE', 'BG', 'BO', 'BR', 'CA', 'CH', 'CL', 'CO', 'CR', 'CY', 'CZ', 'DE', 'DK', 'DO', 'EC', 'EE', 'ES', 'FI', 'FR', 'GB', 'GR', 'GT', 'HK', 'HN', 'HU', 'ID', 'IE', 'IL', 'IS', 'IT', 'JP', 'LI', 'LT', 'LU', 'LV', 'MC', 'MT', 'MX', 'MY', 'NI', 'NL', 'NO', 'NZ', 'PA', 'PE', 'PH', 'PL', 'PT', 'PY', 'RO', 'SE', 'SG', 'SK', 'SV', 'TH', 'TR', 'TW', 'US', 'UY', 'VN', 'ZA', 'AE', 'BH', 'DZ', 'EG', 'JO', 'KW', 'LB', 'MA', 'OM', 'PS', 'QA', 'SA', 'TN', 'IN', 'KR']
+
+
+def make_id(index):
+    return '{0}{1:0{2}d}'.format(ID_PREFIX, index, ID_LENGTH - len(ID_PREFIX))
+
+
+def parse_id(entity_id):
+    try:
+        return int(entity_id[len(ID_PREFIX):])
+    except ValueError:
+        return None
+
+
+def parse_fields(text):
+    """
+    Parse a fields filter such as items(track(name,album.uri)),total into {'items': {'track': {'name': None, 'album': {'uri': None}}}, 'total': None}.
+    """
+    root = {}
+    stack = [root]
+    last = None
+    for token in re.findall(r'[(),]|[^(),]+', text):
+        if token == '(':
+            node, name = last
+            node[name] = {}
+            stack.append(node[name])
+        elif token == ')':
+            stack.pop()
+        elif token != ',':
+            node = stack[-1]
+            names = token.strip().split('.')
+            for name in names[:-1]:
+                node = node.setdefault(name, {})
+            node[names[-1]] = None
+            last = (node, names[-1])
+    return root
+
+
+def project(value, tree):
+    if tree is None:
+        return value
+    if isinstance(value, list):
+        return [project(item, tree) for item in value]
+    if isinstance(value, dict):
+        return {name: project(value[name], subtree) for name, subtree in tree.items() if name in value}
+    return value
+
+
+class Catalogue:
+    """
+    Deterministically generated artists, albums, tracks and playlists.  Every album has ALBUM_TRACK_COUNT tracks, so track n belongs to album n // ALBUM_TRACK_COUNT.
+    """
+
+    def __init__(self, base_url, size=DEFAULT_CATALOGUE_SIZE, library_size=DEFAULT_LIBRARY_SIZE, playlist_size=DEFAULT_PLAYLIST_SIZE, market_count=DEFAULT_MARKET_COUNT):
+        self.base_url = base_url
+        self.size = size
+        self.library_size = library_size
+        self.playlist_size = playlist_size
+        self.markets = MARKETS[:market_count]
+        # Bumped by edit_playlist, giving the playlist a new snapshot ID
+        self.playlist_versions = {}
+        # URIs added to each playlist, which come after its generated tracks
+        self.playlist_additions = {}
+        self.lock = threading.Lock()
+        # The indexes of the user's saved tracks and albums, in the order they were saved
+        self.saved = {
+            'track': dict.fromkeys(position * 3 % size for position in range(library_size)),
+            'album': dict.fromkeys(position * 7 % self.album_count for position in range(library_size // 10)),
+        }
+
+    @property
+    def album_count(self):
+        return self.size // ALBUM_TRACK_COUNT
+
+    def _href(self, kind, index):
+        return '{0}/v1/{1}s/{2}'.format(self.base_url, kind, make_id(index))
+
+    def _external_urls(self, kind, index):
+        return {'spotify': 'https://open.spotify.com/{0}/{1}'.format(kind, make_id(index))}
+
+    def _images(self, kind, index):
+        return [{'height': size, 'width': size, 'url': 'https://i.scdn.co/image/{0}{1}{2}'.format(kind, size, make_id(index))} for size in (640, 300, 64)]
+
+    def simple_artist(self, index):
+        return {
+            'external_urls': self._external_urls('artist', index),
+            'href': self._href('artist', index),
+            'id': make_id(index),
+            'name': 'Artist {0}'.format(index),
+            'type': 'artist',
+            'uri': 'spotify:artist:{0}'.format(make_id(index)),
+        }
+
+    def artist(self, index):
+        artist = self.simple_artist(index)
+        artist.update({
+            'followers': {'href': None, 'total': (index * 7919) % 1000000},
+            'genres': ['genre {0}'.format(index % 40), 'genre {0}'.format(index % 13)],
+            'images': self._images('artist', index),
+            'popularity': index % 100,
+        })
+        return artist
+
+    def simple_album(self, index):
+        return {
+            'album_type': 'album',
+            'artists': [self.simple_artist(index % (self.size // 3 + 1))],
+            'available_markets': self.markets,
+            'external_urls': self._external_urls('album', index),
+            'href': self._href('album', index),
+            'id': make_id(index),
+            'images': self._images('album', index),
+            'name': 'Album {0}'.format(index),
+            'release_date': '{0}-01-01'.format(1960 + index % 60),
+            'release_date_precision': 'day',
+            'total_tracks': ALBUM_TRACK_COUNT,
+            'type': 'album',
+            'uri': 'spotify:album:{0}'.format(make_id(index)),
+        }
+
+    def album(self, index):
+        album = self.simple_album(index)
+        first_track = index * ALBUM_TRACK_COUNT
+        album.update({
+            'copyrights': [{'text': '(C) Fake Records', 'type': 'C'}],
+            'external_ids': {'upc': '{0:012d}'.format(index)},
+            'genres': [],
+            'label': 'Fake Records',
+            'popularity': index % 100,
+            'tracks': self.paging('albums/{0}/tracks'.format(make_id(index)), [self.simple_track(first_track + i) for i in range(ALBUM_TRACK_COUNT)], 0, ALBUM_TRACK_COUNT, ALBUM_TRACK_COUNT),
+        })
+        return album
+
+    def simple_track(self, index):
+        album_index = index // ALBUM_TRACK_COUNT
+        return {
+            'artists': [self.simple_artist(album_index % (self.size // 3 + 1))],
+            'available_markets': self.markets,
+            'disc_number': 1,
+            'duration_ms': 120000 + (index * 7919) % 240000,
+            'explicit': index % 9 == 0,
+            'external_urls': self._external_urls('track', index),
+            'href': self._href('track', index),
+            'id': make_id(index),
+            'is_local': False,
+            'name': 'Track {0}'.format(index),
+            'preview_url': 'https://p.scdn.co/mp3-preview/{0}'.format(make_id(index)),
+            'track_number': index % ALBUM_TRACK_COUNT + 1,
+            'type': 'track',
+            'uri': 'spotify:track:{0}'.format(make_id(index)),
+        }
+
+    def track(self, index):
+        track = self.simple_track(index)
+        track.update({
+            'album': self.simple_album(index // ALBUM_TRACK_COUNT),
+            'external_ids': {'isrc': 'FAKE{0:08d}'.format(index)},
+            'popularity': index % 100,
+        })
+        return track
+
+    def simple_playlist(self, index):
+        return {
+            'collaborative': False,
+            'external_urls': self._external_urls('playlist', index),
+            'href': self._href('playlist', index),
+            'id': make_id(index),
+            'images': self._images('playlist', index)[:1],
+            'name': 'Playlist {0}'.format(index),
+            'owner': {'display_name': 'Fake user', 'id': 'fakeuser', 'type': 'user', 'uri': 'spotify:user:fakeuser'},
+            'public': True,
+            'snapshot_id': 'snapshot{0}-{1}'.format(index, self.playlist_versions.get(index, 0)),
+            'tracks': {'href': '{0}/tracks'.format(self._href('playlist', index)), 'total': self.playlist_length(index)},
+            'type': 'playlist',
+            'uri': 'spotify:user:fakeuser:playlist:{0}'.format(make_id(index)),
+        }
+
+    def playlist(self, index):
+        playlist = self.simple_playlist(index)
+        playlist.update({
+            'description': 'A generated playlist',
+            'followers': {'href': None, 'total': index % 5000},
+            'tracks': self.playlist_tracks(index, 0, 100),
+        })
+        return playlist
+
+    def edit_playlist(self, index):
+        self.playlist_versions[index] = self.playlist_versions.get(index, 0) + 1
+
+    def playlist_length(self, index):
+        return self.playlist_size + len(self.playlist_additions.get(index, []))
+
+    def playlist_track_index(self, index, position):
+        if position < self.playlist_size:
+            return (index * 31 + position) % self.size
+        return track_index(self.playlist_additions[index][position - self.playlist_size])
+
+    def playlist_tracks(self, index, offset, limit):
+        length = self.playlist_length(index)
+        items = [
+            {'added_at': '2017-01-01T00:00:00Z', 'added_by': None, 'is_local': False, 'track': self.track(self.playlist_track_index(index, position))}
+            for position in range(offset, min(offset + limit, length))
+        ]
+        return self.paging('playlists/{0}/tracks'.format(make_id(index)), items, offset, limit, length)
+
+    def add_to_playlist(self, index, uris, position=None):
+        """
+        Add uris at position, or the end.  Positions among the generated tracks are treated as the start of the additions.
+        """
+        additions = self.playlist_additions.setdefault(index, [])
+        if position is None:
+            additions.extend(uris)
+        else:
+            start = max(0, position - self.playlist_size)
+            additions[start:start] = uris
+        self.edit_playlist(index)
+
+    def remove_from_playlist(self, index, uris):
+        removed = set(uris)
+        self.playlist_additions[index] = [uri for uri in self.playlist_additions.get(index, []) if uri not in removed]
+        self.edit_playlist(index)
+
+    def saved_items(self, kind, offset, limit):
+        entity = {'track': self.track, 'album': self.album}[kind]
+        indexes = list(self.saved[kind])
+        items = [{'added_at': '2017-01-01T00:00:00Z', kind: entity(index)} for index in indexes[offset:offset + limit]]
+        return self.paging('me/{0}s'.format(kind), items, offset, limit, len(indexes))
+
+    def saved_tracks(self, offset, limit):
+        return self.saved_items('track', offset, limit)
+
+    def search(self, query, search_type, offset, limit):
+        start = sum(query.encode('utf-8')) % self.size
+        results = {}
+        for kind in search_type.split(','):
+            entity = {'track': self.track, 'album': self.simple_album, 'artist': self.artist, 'playlist': self.simple_playlist}[kind]
+            items = [entity((start + position) % self.size) for position in range(offset, min(offset + limit, self.size))]
+            results[kind + 's'] = self.paging('search', items, offset, limit, self.size, {'query': query, 'type': kind})
+        return results
+
+    def paging(self, endpoint, items, offset, limit, total, extra_parameters=None):
+        def page_url(page_offset):
+            parameters = dict(extra_parameters or {}, offset=page_offset, limit=limit)
+            return '{0}/v1/{1}?{2}'.format(self.base_url, endpoint, urlencode(parameters))
+        return {
+            'href': page_url(offset),
+            'items': items,
+            'limit': limit,
+            'next': page_url(offset + limit) if offset + limit < total else None,
+            'offset': offset,
+            'previous': page_url(max(0, offset - limit)) if offset > 0 else None,
+            'total': total,
+        }
+
+
+class FaultInjector:
+    """
+    Latency, token expiry and rate limiting for the fake Web API.
+
+    Access tokens expire after token_lifetime requests, after which requests get a 401 until the token is refreshed.  Every rate_limit_every-th request gets a 429 with a Retry-After header.  Zero disables either.
+    """
+
+    def __init__(self, latency=0, jitter=0, token_lifetime=0, rate_limit_every=0, retry_after=1, seed=0):
+        self.latency = latency
+        self.jitter = jitter
+        self.token_lifetime = token_lifetime
+        self.rate_limit_every = rate_limit_every
+        self.retry_after = retry_after
+        self._random = random.Random(seed)
+
+    def delay(self):
+        if self.latency or self.jitter:
+            time.sleep(self.latency + self._random.uniform(0, self.jitter))
+
+
+class FakeWebAPIRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # Headers and body go out in separate writes, which Nagle's algorithm would otherwise hold up
+    disable_nagle_algorithm = True
+    # The parsed fields filter of the request being handled, set by projected routes
+    fields = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        self._dispatch()
+
+    def do_PUT(self):
+        self._dispatch()
+
+    def do_POST(self):
+        self._dispatch()
+
+    def do_DELETE(self):
+        self._dispatch()
+
+    def _dispatch(self):
+        url = urlsplit(self.path)
+        params = {key: values[0] for key, values in parse_qs(url.query).items()}
+        length = int(self.headers.get('Content-Length') or 0)
+        raw_body = self.rfile.read(length) if length else b''
+        server = self.server
+        # Connections are kept alive, so one handler serves many requests
+        self.fields = None
+        server.faults.delay()
+
+        if url.path == '/api/token':
+            self.send_json(200, server.issue_token())
+            return
+
+        status = server.check_request(self.headers.get('Authorization'))
+        if status == 401:
+            self.send_json(401, {'error': {'status': 401, 'message': 'The access token expired'}})
+            return
+        if status == 429:
+            self.send_json(429, {'error': {'status': 429, 'message': 'API rate limit exceeded'}}, headers={'Retry-After': str(server.faults.retry_after)})
+            return
+
+        for method, pattern, handler in server.routes:
+            if method != self.command:
+                continue
+            match = pattern.fullmatch(url.path)
+            if match is not None:
+                body = json.loads(raw_body) if raw_body and self.headers.get('Content-Type', '').startswith('application/json') else None
+                handler(self, params, body, *match.groups())
+                return
+        self.send_json(404, {'error': {'status': 404, 'message': 'Service not found'}})
+
+    def send_json(self, status, payload, headers=None):
+        if status == 200 and self.fields is not None:
+            payload = project(payload, self.fields)
+        content = json.dumps(payload).encode('utf-8')
+        if status == 200 and self.command == 'GET':
+            etag = '"{0}"'.format(hashlib.md5(content).hexdigest())
+            headers = dict(headers or {}, ETag=etag)
+            if self.headers.get('If-None-Match') == etag:
+                self.server.record_not_modified()
+                self.send_response(304)
+                self.send_header('ETag', etag)
+                self.end_headers()
+                return
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(content)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        # Recorded first, so that the stats are up to date by the time the client has the response
+        self.server.record_bytes(len(content))
+        self.wfile.write(content)
+
+    def send_no_content(self):
+        self.send_response(204)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+
+def entity_route(entity):
+    def route(handler, params, body, entity_id):
+        index = parse_id(entity_id)
+        if index is None or index >= handler.server.catalogue.size:
+            handler.send_json(404, {'error': {'status': 404, 'message': 'non existing id'}})
+        else:
+            handler.send_json(200, getattr(handler.server.catalogue, entity)(index))
+    return route
+
+
+def projected(route):
+    """
+    Apply the fields filter of a request to the response of route, for the endpoints which support one.
+    """
+    def projected_route(handler, params, body, *args):
+        if 'fields' in params:
+            handler.fields = parse_fields(params['fields'])
+        route(handler, params, body, *args)
+    return projected_route
+
+
+def paging_parameters(params, default_limit=20, maximum_limit=50):
+    return int(params.get('offset', 0)), min(int(params.get('limit', default_limit)), maximum_limit)
+
+
+def get_me(handler, params, body):
+    handler.send_json(200, {'country': 'GB', 'display_name': 'Fake user', 'id': 'fakeuser', 'product': 'premium', 'type': 'user', 'uri': 'spotify:user:fakeuser'})
+
+
+def get_search(handler, params, body):
+    offset, limit = paging_parameters(params)
+    handler.send_json(200, handler.server.catalogue.search(params.get('q', ''), params.get('type', 'track'), offset, limit))
+
+
+def saved_items_route(kind):
+    def route(handler, params, body):
+        offset, limit = paging_parameters(params)
+        handler.send_json(200, handler.server.catalogue.saved_items(kind, offset, limit))
+    return route
+
+
+def contains_route(kind, maximum_ids):
+    def route(handler, params, body):
+        ids = params.get('ids', '').split(',')
+        if len(ids) > maximum_ids:
+            handler.send_json(400, {'error': {'status': 400, 'message': 'Too many ids requested'}})
+            return
+        saved = handler.server.catalogue.saved[kind]
+        handler.send_json(200, [parse_id(item_id) in saved for item_id in ids])
+    return route
+
+
+def get_playlist_tracks(handler, params, body, playlist_id):
+    offset, limit = paging_parameters(params, default_limit=100, maximum_limit=100)
+    handler.send_json(200, handler.server.catalogue.playlist_tracks(parse_id(playlist_id), offset, limit))
+
+
+def save_route(kind, maximum_ids, saved):
+    def route(handler, params, body):
+        ids = body['ids'] if body else params.get('ids', '').split(',')
+        if len(ids) > maximum_ids:
+            handler.send_json(400, {'error': {'status': 400, 'message': 'Too many ids requested'}})
+            return
+        catalogue = handler.server.catalogue
+        with catalogue.lock:
+            for item_id in ids:
+                if saved:
+                    catalogue.saved[kind][parse_id(item_id)] = None
+                else:
+                    catalogue.saved[kind].pop(parse_id(item_id), None)
+        handler.send_json(200, None)
+    return route
+
+
+def post_playlist_tracks(handler, params, body, playlist_id):
+    catalogue = handler.server.catalogue
+    index = parse_id(playlist_id)
+    uris = body['uris']
+    if len(uris) > 100:
+        handler.send_json(400, {'error': {'status': 400, 'message': 'You can add a maximum of 100 tracks per request.'}})
+        return
+    with catalogue.lock:
+        position = body.get('position')
+        if position is not None and position > catalogue.playlist_length(index):
+            handler.send_json(400, {'error': {'status': 400, 'message': 'Index out of bounds'}})
+            return
+        catalogue.add_to_playlist(index, uris, position)
+        snapshot_id = catalogue.simple_playlist(index)['snapshot_id']
+    handler.send_json(201, {'snapshot_id': snapshot_id})
+
+
+def delete_playlist_tracks(handler, params, body, playlist_id):
+    catalogue = handler.server.catalogue
+    index = parse_id(playlist_id)
+    tracks = body['tracks']
+    if len(tracks) > 100:
+        handler.send_json(400, {'error': {'status': 400, 'message': 'You can remove a maximum of 100 tracks per request.'}})
+        return
+    with catalogue.lock:
+        catalogue.remove_from_playlist(index, [track['uri'] for track in tracks])
+        snapshot_id = catalogue.simple_playlist(index)['snapshot_id']
+    handler.send_json(200, {'snapshot_id': snapshot_id})
+
+
+def several_route(entity, maximum):
+    def route(handler, params, body):
+        catalogue = handler.server.catalogue
+        indices = [parse_id(entity_id) for entity_id in params.get('ids', '').split(',')[:maximum]]
+        handler.send_json(200, {entity + 's': [getattr(catalogue, entity)(index) if index is not None and index < catalogue.size else None for index in indices]})
+    return route
+
+
+def get_album_tracks(handler, params, body, album_id):
+    catalogue = handler.server.catalogue
+    index = parse_id(album_id)
+    offset, limit = paging_parameters(params)
+    first_track = index * ALBUM_TRACK_COUNT
+    tracks = [catalogue.simple_track(first_track + position) for position in range(ALBUM_TRACK_COUNT)]
+    handler.send_json(200, catalogue.paging('albums/{0}/tracks'.format(album_id), tracks[offset:offset + limit], offset, limit, ALBUM_TRACK_COUNT))
+
+
+def get_artist_top_tracks(handler, params, body, artist_id):
+    catalogue = handler.server.catalogue
+    index = parse_id(artist_id)
+    handler.send_json(200, {'tracks': [catalogue.track((index * ALBUM_TRACK_COUNT + position) % catalogue.size) for position in range(10)]})
+
+
+class FakePlayer:
+    def __init__(self, catalogue):
+        self.catalogue = catalogue
+        self.lock = threading.Lock()
+        self.active = True
+        self.is_playing = False
+        self.track_index = 0
+        self.progress_ms = 0
+        self.volume_percent = 50
+        self.queue = []
+
+    def state(self):
+        return {
+            'device': {'id': 'fake-device', 'name': 'Fake device', 'type': 'Computer', 'volume_percent': self.volume_percent, 'is_active': True},
+            'shuffle_state': False,
+            'repeat_state': 'off',
+            'timestamp': int(time.time() * 1000),
+            'context': None,
+            'progress_ms': self.progress_ms,
+            'is_playing': self.is_playing,
+            'item': self.catalogue.track(self.track_index),
+            'currently_playing_type': 'track',
+        }
+
+    def play(self, body):
+        if body and body.get('uris'):
+            self.track_index = track_index(body['uris'][0])
+        elif body and body.get('offset'):
+            self.track_index = track_index(body['offset']['uri'])
+        if body:
+            self.progress_ms = 0
+        self.is_playing = True
+
+    def skip(self, step):
+        if step > 0 and self.queue:
+            self.track_index = track_index(self.queue.pop(0))
+        else:
+            self.track_index = max(0, self.track_index + step)
+        self.progress_ms = 0
+
+
+def track_index(uri):
+    index = parse_id(uri.rsplit(':', 1)[-1])
+    return index if index is not None else 0
+
+
+def player_route(method):
+    def route(handler, params, body):
+        player = handler.server.player
+        with player.lock:
+            if not player.active:
+                handler.send_json(404, {'error': {'status': 404, 'message': 'Player command failed: No active device found', 'reason': 'NO_ACTIVE_DEVICE'}})
+                return
+            result = method(player, params, body)
+        if result is None:
+            handler.send_no_content()
+        else:
+            handler.send_json(200, result)
+    return route
+
+
+def get_player(handler, params, body):
+    player = handler.server.player
+    with player.lock:
+        state = player.state() if player.active else None
+    if state is None:
+        handler.send_no_content()
+    else:
+        handler.send_json(200, state)
+
+
+routes = [
+    ('GET', r'/v1/me', get_me),
+    ('GET', r'/v1/search', get_search),
+    ('GET', r'/v1/me/tracks', saved_items_route('track')),
+    ('GET', r'/v1/me/tracks/contains', contains_route('track', 50)),
+    ('GET', r'/v1/me/albums', saved_items_route('album')),
+    ('GET', r'/v1/me/albums/contains', contains_route('album', 20)),
+    ('PUT', r'/v1/me/tracks', save_route('track', 50, saved=True)),
+    ('DELETE', r'/v1/me/tracks', save_route('track', 50, saved=False)),
+    ('PUT', r'/v1/me/albums', save_route('album', 20, saved=True)),
+    ('DELETE', r'/v1/me/albums', save_route('album', 20, saved=False)),
+    ('GET', r'/v1/tracks', several_route('track', 50)),
+    ('GET', r'/v1/albums', several_route('album', 20)),
+    ('GET', r'/v1/artists', several_route('artist', 50)),
+    ('GET', r'/v1/tracks/(\w+)', entity_route('track')),
+    ('GET', r'/v1/albums/(\w+)', entity_route('album')),
+    ('GET', r'/v1/albums/(\w+)/tracks', get_album_tracks),
+    ('GET', r'/v1/artists/(\w+)', entity_route('artist')),
+    ('GET', r'/v1/artists/(\w+)/top-tracks', get_artist_top_tracks),
+    ('GET', r'/v1/playlists/(\w+)', projected(entity_route('playlist'))),
+    ('GET', r'/v1/playlists/(\w+)/tracks', projected(get_playlist_tracks)),
+    ('POST', r'/v1/playlists/(\w+)/tracks', post_playlist_tracks),
+    ('DELETE', r'/v1/playlists/(\w+)/tracks', delete_playlist_tracks),
+    ('GET', r'/v1/me/player', get_player),
+    ('PUT', r'/v1/me/player/play', player_route(lambda player, params, body: player.play(body))),
+    ('PUT', r'/v1/me/player/pause', player_route(lambda player, params, body: setattr(player, 'is_playing', False))),
+    ('POST', r'/v1/me/player/next', player_route(lambda player, params, body: player.skip(1))),
+    ('POST', r'/v1/me/player/previous', player_route(lambda player, params, body: player.skip(-1))),
+    ('PUT', r'/v1/me/player/seek', player_route(lambda player, params, body: setattr(player, 'progress_ms', int(params['position_ms'])))),
+    ('PUT', r'/v1/me/player/volume', player_route(lambda player, params, body: setattr(player, 'volume_percent', int(params['volume_percent'])))),
+    ('POST', r'/v1/me/player/queue', player_route(lambda player, params, body: player.queue.append(params['uri']))),
+]
+
+
+class FakeWebAPIServer(socketserver.ThreadingMixIn, HTTPServer):
+    """
+    Serves both the Web API, under /v1, and the accounts service token endpoint at /api/token.  Point WebAPIClient at base_url and AuthorisationAgent at token_url.
+    """
+
+    daemon_threads = True
+
+    def __init__(self, port=0, latency=0, faults=None, **catalogue_options):
+        super().__init__(('127.0.0.1', port), FakeWebAPIRequestHandler)
+        self.faults = faults if faults is not None else FaultInjector(latency=latency)
+        self.catalogue = Catalogue(self.base_url, **catalogue_options)
+        self.player = FakePlayer(self.catalogue)
+        self.routes = [(method, re.compile(pattern), handler) for method, pattern, handler in routes]
+        self._lock = threading.Lock()
+        self._token_number = 0
+        self._token_requests = 0
+        self.stats = {'requests': 0, 'bytes_sent': 0, 'tokens_issued': 0, 'unauthorised': 0, 'rate_limited': 0, 'not_modified': 0}
+
+    @property
+    def base_url(self):
+        return 'http://127.0.0.1:{0}'.format(self.server_address[1])
+
+    @property
+    def token_url(self):
+        return '{0}/api/token'.format(self.base_url)
+
+    @property
+    def access_token(self):
+        return 'fake-token-{0}'.format(self._token_number)
+
+    def issue_token(self):
+        with self._lock:
+            self._token_number += 1
+            self._token_requests = 0
+            self.stats['tokens_issued'] += 1
+            return {'access_token': self.access_token, 'token_type': 'Bearer', 'expires_in': 3600, 'scope': ''}
+
+    def check_request(self, authorization):
+        """
+        Return the error status to respond with for an API request, or None if it should be served.
+        """
+        with self._lock:
+            self.stats['requests'] += 1
+            if authorization != 'Bearer {0}'.format(self.access_token):
+                self.stats['unauthorised'] += 1
+                return 401
+            self._token_requests += 1
+            if self.faults.token_lifetime and self._token_requests > self.faults.token_lifetime:
+                self.stats['unauthorised'] += 1
+                return 401
+            if self.faults.rate_limit_every and self.stats['requests'] % self.faults.rate_limit_every == 0:
+                self.stats['rate_limited'] += 1
+                return 429
+        return None
+
+    def record_bytes(self, count):
+        with self._lock:
+            self.stats['bytes_sent'] += count
+
+    def record_not_modified(self):
+        with self._lock:
+            self.stats['not_modified'] += 1
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
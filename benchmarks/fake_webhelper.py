@@ -0,0 +1,238 @@
+"""
+A local HTTPS stand-in for the Spotify Web Helper which replays the captured responses in data/spotify_bridge_responses.
+
+The server plays through a scripted timeline of fixtures.  Status requests with a returnafter parameter block like the real thing: they return early when playback is started or paused or an error occurs, but not when one track simply follows another, and otherwise return once returnafter seconds have passed.
+"""
+
+import copy
+from http.server import BaseHTTPRequestHandler, HTTPServer
+import os
+import os.path
+import shutil
+import socketserver
+import ssl
+import subprocess
+import tempfile
+import threading
+import time
+from typing import NamedTuple, Optional
+from urllib.parse import parse_qs, urlsplit
+
+import ujson as json
+
+
+FIXTURE_DIRECTORY = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'data', 'spotify_bridge_responses')
+CSRF_TOKEN = 'fake-csrf-token'
+OAUTH_TOKEN = 'fake-oauth-token'
+
+
+def load_fixtures(directory=FIXTURE_DIRECTORY):
+    fixtures = {}
+    for filename in os.listdir(directory):
+        name, extension = os.path.splitext(filename)
+        if extension == '.json':
+            with open(os.path.join(directory, filename), 'r', encoding='utf-8') as f:
+                # Some captures are annotated with comment lines
+                lines = [line for line in f if not line.startswith('#')]
+            fixtures[name] = json.loads(''.join(lines))
+    return fixtures
+
+
+class TimelineStep(NamedTuple):
+    fixture: str
+    duration: float
+    overrides: Optional[dict] = None
+
+
+DEFAULT_TIMELINE = [
+    TimelineStep('playing_album', 3),
+    TimelineStep('paused_album', 2),
+    TimelineStep('playing_album', 2),
+    TimelineStep('playing_single_track', 3),
+    TimelineStep('playing_before_metadata_has_been_fetched', 0.5),
+    TimelineStep('playing_playlist', 3),
+    TimelineStep('request_while_logged_out', 2),
+    TimelineStep('playing_album', 3),
+]
+
+
+def status_event(status):
+    """
+    The kind of change the real Web Helper would return early from a long poll for.
+    """
+    if 'error' in status:
+        return 'error'
+    return 'play' if status.get('playing') else 'pause'
+
+
+class Timeline:
+    def __init__(self, steps, fixtures, loop=True, clock=time.perf_counter):
+        self.steps = steps
+        self.fixtures = fixtures
+        self.loop = loop
+        self._clock = clock
+        self._total_duration = sum(step.duration for step in steps)
+        self.started_at = None
+
+    def start(self):
+        self.started_at = self._clock()
+        return self.started_at
+
+    def position(self):
+        """
+        Return (step_number, step, seconds_into_step), where step_number counts upwards through loops.
+        """
+        elapsed = self._clock() - self.started_at
+        loops, offset = divmod(elapsed, self._total_duration)
+        if loops and not self.loop:
+            last = len(self.steps) - 1
+            return last, self.steps[last], self.steps[last].duration
+        for index, step in enumerate(self.steps):
+            if offset < step.duration:
+                return int(loops) * len(self.steps) + index, step, offset
+            offset -= step.duration
+        last = len(self.steps) - 1
+        return int(loops) * len(self.steps) + last, self.steps[last], self.steps[last].duration
+
+    def step_start_time(self, step_number):
+        loops, index = divmod(step_number, len(self.steps))
+        return self.started_at + loops * self._total_duration + sum(step.duration for step in self.steps[:index])
+
+    def time_until_next_step(self):
+        step_number, step, offset = self.position()
+        return max(0, step.duration - offset)
+
+    def status(self):
+        step_number, step, offset = self.position()
+        status = copy.deepcopy(self.fixtures[step.fixture])
+        if step.overrides:
+            status.update(step.overrides)
+        if 'error' not in status:
+            status['server_time'] = int(time.time())
+            if status.get('playing') and 'playing_position' in status:
+                status['playing_position'] += offset
+        return step_number, status
+
+
+class FakeWebHelperRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # Headers and body go out in separate writes, which Nagle's algorithm would otherwise hold up
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        params = {key: values[0] for key, values in parse_qs(url.query).items()}
+        server = self.server
+        with server.lock:
+            server.request_counts[url.path] = server.request_counts.get(url.path, 0) + 1
+        if server.latency:
+            time.sleep(server.latency)
+
+        if url.path == '/simplecsrf/token.json':
+            self.send_json({'token': CSRF_TOKEN})
+        elif url.path == '/token':
+            self.send_json({'t': OAUTH_TOKEN})
+        elif url.path == '/remote/status.json':
+            self.send_json(server.wait_for_status(params.get('returnafter')))
+        elif url.path == '/remote/play.json':
+            self.send_json(server.play(params.get('uri', '')))
+        elif url.path == '/remote/pause.json':
+            self.send_json(server.timeline.status()[1])
+        else:
+            self.send_json({'error': {'type': '4001'}})
+
+    def send_json(self, payload):
+        content = json.dumps(payload).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+
+class FakeWebHelperServer(socketserver.ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+    def __init__(self, timeline=None, latency=0, port=0, certificate=None, loop=True):
+        super().__init__(('127.0.0.1', port), FakeWebHelperRequestHandler)
+        self.fixtures = load_fixtures()
+        self.timeline = Timeline(timeline if timeline is not None else DEFAULT_TIMELINE, self.fixtures, loop=loop)
+        self.latency = latency
+        self.unplayable_uris = set()
+        self.lock = threading.Lock()
+        self.request_counts = {}
+        self._certificate = certificate if certificate is not None else SelfSignedCertificate()
+        context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        context.load_cert_chain(self._certificate.certfile, self._certificate.keyfile)
+        self.socket = context.wrap_socket(self.socket, server_side=True)
+
+    @property
+    def port(self):
+        return self.server_address[1]
+
+    @property
+    def token_url(self):
+        return 'https://127.0.0.1:{0}/token'.format(self.port)
+
+    def wait_for_status(self, return_after):
+        step_number, status = self.timeline.status()
+        if return_after is None:
+            return status
+        deadline = time.perf_counter() + float(return_after)
+        event = status_event(status)
+        while True:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                return self.timeline.status()[1]
+            time.sleep(min(remaining, self.timeline.time_until_next_step() + 0.001))
+            new_step_number, new_status = self.timeline.status()
+            if new_step_number != step_number and status_event(new_status) != event:
+                return new_status
+
+    def play(self, uri):
+        if not uri.startswith('spotify:'):
+            return self.fixtures['play_invalid_uri']
+        if uri in self.unplayable_uris:
+            return self.fixtures['track_not_available_in_region']
+        return self.fixtures['play_request']
+
+    def start(self):
+        self.timeline.start()
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+        self._certificate.cleanup()
+
+
+class SelfSignedCertificate:
+    """
+    A throwaway certificate for 127.0.0.1, generated with the openssl command line tool.  RemoteBridge doesn't verify certificates, so nothing more is needed.
+    """
+
+    def __init__(self):
+        self._directory = tempfile.mkdtemp(prefix='accessify-webhelper-')
+        self.certfile = os.path.join(self._directory, 'cert.pem')
+        self.keyfile = os.path.join(self._directory, 'key.pem')
+        subprocess.check_call(['openssl', 'req', '-x509', '-newkey', 'rsa:2048', '-nodes', '-days', '1', '-subj', '/CN=127.0.0.1', '-keyout', self.keyfile, '-out', self.certfile], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+    def cleanup(self):
+        shutil.rmtree(self._directory, ignore_errors=True)
+
+
+class RecordingWindow:
+    """
+    Stands in for remote.SpotifyWindow, recording commands instead of sending window messages.
+    """
+
+    def __init__(self):
+        self.commands = []
+
+    def send_command(self, command):
+        self.commands.append(command)
+        return True
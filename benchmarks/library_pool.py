@@ -0,0 +1,107 @@
+"""
+Compare LibraryRouter pool sizes on a mixed workload against a FakeWebAPIServer with added latency.
+
+Several "search boxes" each submit a run of searches through their own ordered() proxy while profile loads are sent to whichever worker is free.  For each pool size the wall-clock time, the latency of each call and each worker's utilisation are reported, and the results of each search box are checked to have arrived in the order they were asked for.
+
+    python -m benchmarks.library_pool --sizes 1 2 4 --latency 0.05
+"""
+
+import argparse
+import logging
+import sys
+import threading
+import time
+
+import ujson as json
+
+from accessify import library
+from accessify.library import SearchType
+
+from benchmarks.fake_webapi import FakeWebAPIServer
+from benchmarks.timing import summarise
+from benchmarks.webapi import SEARCH_QUERIES, create_client
+
+
+def run_workload(router, search_boxes, searches_per_box, profile_loads):
+    search_latencies = []
+    profile_latencies = []
+    out_of_order = 0
+    lock = threading.Lock()
+
+    def search_box(box):
+        nonlocal out_of_order
+        searcher = router.ordered(('search box', box))
+        completed = []
+        started = {}
+
+        def results_callback(number):
+            def receive(results):
+                with lock:
+                    search_latencies.append(time.perf_counter() - started[number])
+                completed.append(number)
+            return receive
+
+        futures = []
+        for number in range(searches_per_box):
+            started[number] = time.perf_counter()
+            futures.append(searcher.perform_new_search(SEARCH_QUERIES[number % len(SEARCH_QUERIES)], SearchType.TRACK, results_callback(number)))
+        for future in futures:
+            future.get()
+        if completed != sorted(completed):
+            with lock:
+                out_of_order += 1
+
+    def load_profiles():
+        futures = []
+        for i in range(profile_loads):
+            futures.append((time.perf_counter(), router.load_profile()))
+        for started, future in futures:
+            future.get()
+            profile_latencies.append(time.perf_counter() - started)
+
+    threads = [threading.Thread(target=search_box, args=(box,)) for box in range(search_boxes)]
+    threads.append(threading.Thread(target=load_profiles))
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return {
+        'wall_ms': (time.perf_counter() - started) * 1000,
+        'search': summarise(search_latencies),
+        'load_profile': summarise(profile_latencies),
+        'search_boxes_out_of_order': out_of_order,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1, 2, 4])
+    parser.add_argument('--latency', type=float, default=0.05, help='Seconds added to every fake Web API response')
+    parser.add_argument('--search-boxes', type=int, default=3)
+    parser.add_argument('--searches', type=int, default=10, help='Searches per search box')
+    parser.add_argument('--profile-loads', type=int, default=10)
+    args = parser.parse_args(argv)
+    logging.getLogger('accessify').addHandler(logging.NullHandler())
+
+    server = FakeWebAPIServer(latency=args.latency)
+    server.start()
+    results = {'options': vars(args), 'pools': {}}
+    try:
+        for size in args.sizes:
+            signalman = library.LibrarySignalman()
+            router = library.LibraryRouter.start(size, signalman, {}, create_client(server))
+            try:
+                result = run_workload(router, args.search_boxes, args.searches, args.profile_loads)
+                result['workers'] = router.utilisation()
+            finally:
+                router.stop()
+            results['pools'][str(size)] = result
+    finally:
+        server.stop()
+    json.dump(results, sys.stdout, indent=4)
+    sys.stdout.write('\n')
+
+
+if __name__ == '__main__':
+    main()
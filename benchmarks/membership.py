@@ -0,0 +1,79 @@
+"""
+Measure the cost of showing saved tracks first in a page of search results.
+
+A page of --page-size track results is re-ranked by checking each result with its own /me/tracks/contains request, as a naive implementation would, then with LibraryMembership before and after it has synced the user's saved tracks.  Requests and time per page are reported for each, against a FakeWebAPIServer with added latency.
+
+    python -m benchmarks.membership --pages 10 --latency 0.05
+"""
+
+import argparse
+import logging
+import sys
+import time
+
+import ujson as json
+
+from accessify import library
+from accessify.library import SearchType
+from accessify.membership import LibraryMembership
+from accessify.spotify.utils import split_uri
+
+from benchmarks.fake_webapi import FakeWebAPIServer
+from benchmarks.timing import summarise
+from benchmarks.webapi import SEARCH_QUERIES, create_client
+
+
+def search_pages(client, count, page_size):
+    controller = library.LibraryController(None, {}, client)
+    return [controller.perform_search(SEARCH_QUERIES[index % len(SEARCH_QUERIES)], SearchType.TRACK, offset=index * page_size) for index in range(count)]
+
+
+def rank_one_by_one(client, page):
+    saved = {item.uri: client.contains_saved_tracks([split_uri(item.uri)[1]])[0] for item in page}
+    return [item for item in page if saved[item.uri]] + [item for item in page if not saved[item.uri]]
+
+
+def run(server, pages, rank):
+    requests_before = server.stats['requests']
+    samples = []
+    for page in pages:
+        started = time.perf_counter()
+        rank(page)
+        samples.append(time.perf_counter() - started)
+    return {
+        'rerank': summarise(samples),
+        'requests_per_page': (server.stats['requests'] - requests_before) / len(pages),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--pages', type=int, default=10)
+    parser.add_argument('--page-size', type=int, default=50)
+    parser.add_argument('--latency', type=float, default=0.05, help='Seconds added to every fake Web API response')
+    args = parser.parse_args(argv)
+    logging.getLogger('accessify').addHandler(logging.NullHandler())
+
+    server = FakeWebAPIServer(latency=args.latency)
+    server.start()
+    try:
+        client = create_client(server)
+        pages = search_pages(client, args.pages, args.page_size)
+        results = {
+            'options': vars(args),
+            'one_request_per_item': run(server, pages, lambda page: rank_one_by_one(client, page)),
+            'batched_contains': run(server, pages, LibraryMembership(client).saved_first),
+        }
+        membership = LibraryMembership(client)
+        started = time.perf_counter()
+        synced = membership.sync(['track'])
+        results['sync'] = {'seconds': time.perf_counter() - started, 'saved_tracks': synced['track']}
+        results['synced_library'] = run(server, pages, membership.saved_first)
+    finally:
+        server.stop()
+    json.dump(results, sys.stdout, indent=4)
+    sys.stdout.write('\n')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,62 @@
+"""
+Measure the cost of recording metrics, to check that instrumenting hot paths stays cheap.
+
+    python -m benchmarks.metrics --iterations 1000000
+"""
+
+import argparse
+import sys
+import time
+
+import blinker
+import ujson as json
+
+from accessify.metrics import MeasuredSignal, MetricsRegistry
+
+
+def nanoseconds_per_call(func, iterations):
+    started = time.perf_counter()
+    for i in range(iterations):
+        func()
+    return (time.perf_counter() - started) * 1e9 / iterations
+
+
+def noop(sender, **kwargs):
+    pass
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--iterations', type=int, default=200000)
+    args = parser.parse_args(argv)
+
+    registry = MetricsRegistry()
+    counter = registry.counter('benchmark_total')
+    histogram = registry.histogram('benchmark_seconds')
+    measured_signal = MeasuredSignal('benchmark')
+    measured_signal.connect(noop)
+    plain_signal = blinker.Signal()
+    plain_signal.connect(noop)
+
+    def time_block():
+        with histogram.time():
+            pass
+
+    results = {
+        'baseline_ns': nanoseconds_per_call(lambda: None, args.iterations),
+        'counter_inc_ns': nanoseconds_per_call(counter.inc, args.iterations),
+        'labelled_counter_lookup_and_inc_ns': nanoseconds_per_call(lambda: registry.counter('benchmark_labelled_total', labels={'endpoint': 'search', 'status': 200}).inc(), args.iterations),
+        'histogram_observe_ns': nanoseconds_per_call(lambda: histogram.observe(0.003), args.iterations),
+        'histogram_time_ns': nanoseconds_per_call(time_block, args.iterations),
+        'plain_signal_send_ns': nanoseconds_per_call(plain_signal.send, args.iterations),
+        'measured_signal_send_ns': nanoseconds_per_call(measured_signal.send, args.iterations),
+    }
+    started = time.perf_counter()
+    registry.prometheus_text()
+    results['prometheus_export_ms'] = (time.perf_counter() - started) * 1000
+    json.dump(results, sys.stdout, indent=4)
+    sys.stdout.write('\n')
+
+
+if __name__ == '__main__':
+    main()
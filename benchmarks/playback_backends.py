@@ -0,0 +1,80 @@
+"""
+Compare command latency between the Web Helper and Spotify Connect playback backends.
+
+The Connect backend is measured against a local FakeWebAPIServer, and the Web Helper backend against a local FakeWebHelperServer unless --web-helper-port points it at a real Web Helper.  Window commands are only sent for real on Windows with a real Web Helper; otherwise they go to a RecordingWindow and just measure the bridge's anti-flooding sleep.
+
+    python -m benchmarks.playback_backends --iterations 200 --latency 0.02
+"""
+
+import argparse
+import sys
+
+import ujson as json
+
+from accessify.spotify import backends
+from accessify.spotify.remote import PlaybackCommand, RemoteBridge
+from accessify.spotify.webapi import AuthorisationAgent, WebAPIClient
+
+from benchmarks.fake_webapi import FakeWebAPIServer, make_id
+from benchmarks.fake_webhelper import FakeWebHelperServer, RecordingWindow
+from benchmarks.timing import summarise, time_calls
+
+
+def benchmark_connect_backend(iterations, latency):
+    server = FakeWebAPIServer(latency=latency).start()
+    try:
+        api_client = WebAPIClient(AuthorisationAgent('client-id', 'client-secret', access_token=server.access_token, token_url=server.token_url), base_url=server.base_url)
+        backend = backends.ConnectBackend(api_client)
+        backend.bridge.get_status()
+        uri = 'spotify:track:{0}'.format(make_id(1))
+        return {
+            'play_uri': summarise(time_calls(backend.play_uri, iterations, uri)),
+            'queue_uri': summarise(time_calls(backend.queue_uri, iterations, uri)),
+            'seek': summarise(time_calls(backend.seek, iterations, 30000)),
+            'set_volume': summarise(time_calls(backend.set_volume, iterations, 40)),
+            'next_track': summarise(time_calls(backend.send_command, iterations, PlaybackCommand.NEXT_TRACK)),
+            'get_status': summarise(time_calls(backend.bridge.get_status, iterations)),
+        }
+    finally:
+        server.stop()
+
+
+def benchmark_web_helper_backend(iterations, latency, port=None):
+    if port is None:
+        server = FakeWebHelperServer(latency=latency).start()
+        bridge = RemoteBridge(server.port, hostname='127.0.0.1', token_url=server.token_url, window=RecordingWindow())
+    else:
+        server = None
+        bridge = RemoteBridge(port)
+    try:
+        backend = backends.WebHelperBackend(polling_interval=60, idle_polling_interval=300)
+        backend.bridge = bridge
+        uri = 'spotify:track:{0}'.format(make_id(1))
+        return {
+            'play_uri': summarise(time_calls(backend.play_uri, iterations, uri)),
+            'next_track': summarise(time_calls(backend.send_command, iterations, PlaybackCommand.NEXT_TRACK)),
+            'volume_up': summarise(time_calls(backend.send_command, iterations, PlaybackCommand.VOLUME_UP)),
+            'get_status': summarise(time_calls(backend.bridge.get_status, iterations)),
+        }
+    finally:
+        if server is not None:
+            server.stop()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--iterations', type=int, default=100)
+    parser.add_argument('--latency', type=float, default=0, help='Simulated server latency in seconds for the fake servers')
+    parser.add_argument('--web-helper-port', type=int, default=None)
+    args = parser.parse_args(argv)
+
+    results = {
+        'connect': benchmark_connect_backend(args.iterations, args.latency),
+        'web_helper': benchmark_web_helper_backend(args.iterations, args.latency, args.web_helper_port),
+    }
+    json.dump(results, sys.stdout, indent=4)
+    sys.stdout.write('\n')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,152 @@
+"""
+Measure PlaybackQueue's indexed operations, queueing a big playlist and reloading the queue after a restart.
+
+Appending, popping from the front and inserting and removing at random positions are timed on a queue of --size tracks, against a list and a deque doing the same.  A playlist of --playlist-tracks tracks is then queued from a FakeWebAPIServer, timing how long queueing takes to return and how long the first track then takes to come off the front.  Finally the queue is rebuilt from its journal, as after a restart, and checked to match.
+
+    python -m benchmarks.playback_queue --size 100000 --playlist-tracks 10000
+"""
+
+import argparse
+from collections import deque
+import logging
+import os
+import random
+import sys
+import tempfile
+import time
+
+import ujson as json
+
+from accessify.playback_queue import ContextLoader, IndexedList, PlaybackQueue, item_for_uri
+
+from benchmarks.fake_webapi import FakeWebAPIServer, make_id
+from benchmarks.webapi import create_client
+
+
+PLAYLIST_INDEX = 9
+
+
+def per_operation_us(func, count):
+    started = time.perf_counter()
+    func(count)
+    return (time.perf_counter() - started) / count * 1000000
+
+
+def time_structure(make, size, operations, seed):
+    generator = random.Random(seed)
+    positions = [generator.randrange(size) for operation in range(operations)]
+    sequence = make()
+
+    def append(count):
+        for index in range(count):
+            sequence.append(index)
+
+    def insert(count):
+        for position in positions[:count]:
+            sequence.insert(position, position)
+
+    def remove(count):
+        for position in positions[:count]:
+            del_at(sequence, position)
+
+    def popleft(count):
+        for index in range(count):
+            pop_front(sequence)
+
+    return {
+        'append_us': per_operation_us(append, size),
+        'insert_us': per_operation_us(insert, operations),
+        'remove_us': per_operation_us(remove, operations),
+        'popleft_us': per_operation_us(popleft, operations),
+    }
+
+
+def del_at(sequence, position):
+    if isinstance(sequence, IndexedList):
+        sequence.pop(position)
+    else:
+        del sequence[position]
+
+
+def pop_front(sequence):
+    if isinstance(sequence, list):
+        sequence.pop(0)
+    else:
+        sequence.popleft()
+
+
+def queue_playlist(server, directory):
+    path = os.path.join(directory, 'queue.jsonl')
+    queue = PlaybackQueue(path, ContextLoader(create_client(server)))
+    queue.extend(item_for_uri('spotify:track:{0}'.format(make_id(index))) for index in range(100))
+    requests_before = server.stats['requests']
+    started = time.perf_counter()
+    queue.append(item_for_uri('spotify:playlist:{0}'.format(make_id(PLAYLIST_INDEX))))
+    queued = time.perf_counter() - started
+    results = {'queue_ms': queued * 1000, 'requests_while_queueing': server.stats['requests'] - requests_before}
+    for index in range(100):
+        queue.popleft()
+    started = time.perf_counter()
+    first = queue.popleft()
+    results['first_track_ms'] = (time.perf_counter() - started) * 1000
+    results['first_track_is_track'] = first.uri.startswith('spotify:track:')
+    results['queued_after_first_page'] = len(queue)
+    started = time.perf_counter()
+    drained = 1
+    while queue.popleft() is not None:
+        drained += 1
+    results['drain_ms'] = (time.perf_counter() - started) * 1000
+    results['tracks_played'] = drained
+    results['requests_total'] = server.stats['requests'] - requests_before
+    return results
+
+
+def reload_journal(size, directory, seed):
+    path = os.path.join(directory, 'reload.jsonl')
+    generator = random.Random(seed)
+    queue = PlaybackQueue(path)
+    queue.extend(item_for_uri('spotify:track:{0}'.format(make_id(index))) for index in range(size))
+    changes = size // 10
+    started = time.perf_counter()
+    for change in range(changes):
+        queue.insert(generator.randrange(len(queue)), item_for_uri('spotify:track:{0}'.format(make_id(size + change))))
+        queue.popleft()
+    journal_us = (time.perf_counter() - started) / (2 * changes) * 1000000
+    expected = list(queue)
+    started = time.perf_counter()
+    reloaded = PlaybackQueue(path)
+    return {
+        'journal_write_us': journal_us,
+        'reload_ms': (time.perf_counter() - started) * 1000,
+        'journal_bytes': os.path.getsize(path),
+        'matches': list(reloaded) == expected,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--size', type=int, default=100000, help='Tracks in the queue for the timed operations')
+    parser.add_argument('--operations', type=int, default=2000, help='Inserts, removals and pops timed against each structure')
+    parser.add_argument('--playlist-tracks', type=int, default=10000)
+    parser.add_argument('--latency', type=float, default=0.05, help='Seconds added to every fake Web API response')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args(argv)
+    logging.getLogger('accessify').addHandler(logging.NullHandler())
+
+    results = {'options': vars(args), 'operations': {}}
+    for name, make in (('indexed_list', IndexedList), ('list', list), ('deque', deque)):
+        results['operations'][name] = time_structure(make, args.size, args.operations, args.seed)
+    server = FakeWebAPIServer(latency=args.latency, playlist_size=args.playlist_tracks)
+    server.start()
+    try:
+        with tempfile.TemporaryDirectory() as directory:
+            results['queue_playlist'] = queue_playlist(server, directory)
+            results['reload'] = reload_journal(args.size // 10, directory, args.seed)
+    finally:
+        server.stop()
+    json.dump(results, sys.stdout, indent=4)
+    sys.stdout.write('\n')
+
+
+if __name__ == '__main__':
+    main()
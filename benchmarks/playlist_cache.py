@@ -0,0 +1,74 @@
+"""
+Measure opening a big playlist with the snapshot-ID-aware PlaylistTrackCache.
+
+A playlist of --tracks tracks is opened for the first time, which pages through all of it, then opened again while unchanged, which only checks its snapshot ID, and again after it has been edited.  Reading the cached tracks is also timed on its own, from memory and from disk as after a restart.
+
+    python -m benchmarks.playlist_cache --tracks 10000 --latency 0.05
+"""
+
+import argparse
+import logging
+import sys
+import tempfile
+import time
+
+import ujson as json
+
+from accessify.library import LibraryController
+from accessify.playlist_cache import PlaylistTrackCache
+
+from benchmarks.fake_webapi import FakeWebAPIServer, make_id
+from benchmarks.timing import summarise, time_calls
+from benchmarks.webapi import create_client
+
+
+PLAYLIST_INDEX = 7
+
+
+def timed_visit(server, controller, playlist_uri):
+    requests_before, bytes_before = server.stats['requests'], server.stats['bytes_sent']
+    started = time.perf_counter()
+    tracks = controller.get_playlist_tracks(playlist_uri)
+    return {
+        'ms': (time.perf_counter() - started) * 1000,
+        'tracks': len(tracks),
+        'requests': server.stats['requests'] - requests_before,
+        'bytes_downloaded': server.stats['bytes_sent'] - bytes_before,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--tracks', type=int, default=10000, help='Tracks in the playlist')
+    parser.add_argument('--latency', type=float, default=0.05, help='Seconds added to every fake Web API response')
+    parser.add_argument('--iterations', type=int, default=20)
+    args = parser.parse_args(argv)
+    logging.getLogger('accessify').addHandler(logging.NullHandler())
+
+    server = FakeWebAPIServer(latency=args.latency, playlist_size=args.tracks)
+    server.start()
+    playlist_uri = 'spotify:user:fakeuser:playlist:{0}'.format(make_id(PLAYLIST_INDEX))
+    try:
+        with tempfile.TemporaryDirectory() as directory:
+            cache = PlaylistTrackCache(directory)
+            # Calling the controller's methods directly keeps pykka's messaging out of the measurement
+            controller = LibraryController(None, {}, create_client(server), playlist_cache=cache)
+            results = {
+                'options': vars(args),
+                'first_visit': timed_visit(server, controller, playlist_uri),
+                'unchanged_revisit': timed_visit(server, controller, playlist_uri),
+            }
+            server.catalogue.edit_playlist(PLAYLIST_INDEX)
+            results['revisit_after_edit'] = timed_visit(server, controller, playlist_uri)
+            results['read_from_memory'] = summarise(time_calls(cache.get, args.iterations, playlist_uri))
+            # Nothing is kept in memory, so every read loads the file as a fresh start would
+            cold_cache = PlaylistTrackCache(directory, max_in_memory=0)
+            results['read_from_disk'] = summarise(time_calls(cold_cache.get, args.iterations, playlist_uri))
+    finally:
+        server.stop()
+    json.dump(results, sys.stdout, indent=4)
+    sys.stdout.write('\n')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,108 @@
+"""
+Measure how much prefetching on track change speeds up going from now playing to the album, the artist or what's next.
+
+For each simulated track change, a user pauses for --think seconds and then opens the album's tracks, the artist's top tracks and the details of the next few queued tracks.  This is timed with and without a Prefetcher, against a FakeWebAPIServer with added latency.  Rapid skips, where the track changes again before prefetching finishes, show how much work cancellation saves.
+
+    python -m benchmarks.prefetch --changes 20 --latency 0.05
+"""
+
+import argparse
+import logging
+import sys
+import time
+
+import ujson as json
+
+from accessify import library
+from accessify import prefetch
+from accessify.spotify.utils import split_uri
+
+from benchmarks.fake_webapi import ALBUM_TRACK_COUNT, FakeWebAPIServer, make_id
+from benchmarks.timing import summarise
+from benchmarks.webapi import create_client
+
+
+LOOKAHEAD = 5
+
+
+def track_at(client, index):
+    return library.deserialize_track(client.request('tracks/{0}'.format(index)))
+
+
+def navigate(client, track, upcoming):
+    started = time.perf_counter()
+    client.album_tracks(split_uri(track.album.uri)[1])
+    client.artist_top_tracks(split_uri(track.artists[0].uri)[1])
+    client.tracks([split_uri(item.uri)[1] for item in upcoming])
+    return time.perf_counter() - started
+
+
+def run(server, changes, think, use_prefetcher):
+    client = create_client(server)
+    tracks = [track_at(client, make_track_id(index)) for index in range(changes + LOOKAHEAD)]
+    state = {'position': 0}
+    prefetcher = prefetch.Prefetcher(client, upcoming_items=lambda count: tracks[state['position'] + 1:state['position'] + 1 + count], lookahead=LOOKAHEAD, delay=0)
+    if use_prefetcher:
+        prefetcher.start()
+    requests_before = server.stats['requests']
+    samples = []
+    for position in range(changes):
+        state['position'] = position
+        if use_prefetcher:
+            prefetcher.on_track_changed(tracks[position])
+        time.sleep(think)
+        samples.append(navigate(client, tracks[position], tracks[position + 1:position + 1 + LOOKAHEAD]))
+    prefetcher.stop()
+    return {
+        'navigation': summarise(samples),
+        'requests': server.stats['requests'] - requests_before,
+    }
+
+
+def run_rapid_skips(server, changes, interval):
+    client = create_client(server)
+    tracks = [track_at(client, make_track_id(index)) for index in range(changes)]
+    prefetcher = prefetch.Prefetcher(client, lookahead=0, delay=0)
+    prefetcher.start()
+    requests_before = server.stats['requests']
+    for track in tracks:
+        prefetcher.on_track_changed(track)
+        time.sleep(interval)
+    prefetcher.stop()
+    return {
+        'track_changes': changes,
+        'prefetch_requests': server.stats['requests'] - requests_before,
+        'requests_without_cancellation': changes * 2,
+    }
+
+
+def make_track_id(index):
+    # A different album for each change
+    return make_id(index * ALBUM_TRACK_COUNT)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--changes', type=int, default=20)
+    parser.add_argument('--latency', type=float, default=0.05, help='Seconds added to every fake Web API response')
+    parser.add_argument('--think', type=float, default=0.5, help='Seconds between a track change and the user navigating')
+    args = parser.parse_args(argv)
+    logging.getLogger('accessify').addHandler(logging.NullHandler())
+
+    server = FakeWebAPIServer(latency=args.latency)
+    server.start()
+    try:
+        results = {
+            'options': vars(args),
+            'without_prefetch': run(server, args.changes, args.think, use_prefetcher=False),
+            'with_prefetch': run(server, args.changes, args.think, use_prefetcher=True),
+            'rapid_skips': run_rapid_skips(server, args.changes, args.latency / 2),
+        }
+    finally:
+        server.stop()
+    json.dump(results, sys.stdout, indent=4)
+    sys.stdout.write('\n')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,89 @@
+"""
+Measure the time to results for the last of a burst of searches, with and without SearchGenerations tokens.
+
+Each burst submits several searches from one search box in quick succession, as when someone corrects a query and presses Enter again, against a FakeWebAPIServer with added latency.  Without tokens every search runs and delivers its results; with them, searches which have been superseded are skipped or dropped before deserialization.
+
+    python -m benchmarks.search_cancellation --bursts 20 --burst-size 5 --latency 0.05
+"""
+
+import argparse
+import logging
+import sys
+import threading
+import time
+
+import ujson as json
+
+from accessify import library
+from accessify import metrics
+from accessify.library import SearchGenerations, SearchType
+
+from benchmarks.fake_webapi import FakeWebAPIServer
+from benchmarks.timing import summarise
+from benchmarks.webapi import SEARCH_QUERIES, create_client
+
+
+def run_bursts(searcher, bursts, burst_size, interval, use_tokens):
+    generations = SearchGenerations()
+    latest_times = []
+    deliveries = 0
+    for burst in range(bursts):
+        finished = threading.Event()
+        state = {'last': None}
+
+        def results_callback(number, submitted_at):
+            def receive(results):
+                nonlocal deliveries
+                deliveries += 1
+                if number == state['last']:
+                    latest_times.append(time.perf_counter() - submitted_at)
+                    finished.set()
+            return receive
+
+        for number in range(burst_size):
+            token = generations.new_search() if use_tokens else None
+            state['last'] = number
+            searcher.perform_new_search(SEARCH_QUERIES[(burst + number) % len(SEARCH_QUERIES)], SearchType.TRACK, results_callback(number, time.perf_counter()), token)
+            if number < burst_size - 1:
+                time.sleep(interval)
+        finished.wait()
+    return {
+        'latest_time_to_results': summarise(latest_times),
+        'result_sets_delivered': deliveries,
+    }
+
+
+def superseded_counts():
+    snapshot = metrics.registry.snapshot().get('searches_superseded_total', {'series': []})
+    return {series['labels']['stage']: series['value'] for series in snapshot['series']}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--bursts', type=int, default=20)
+    parser.add_argument('--burst-size', type=int, default=5)
+    parser.add_argument('--interval', type=float, default=0.01, help='Seconds between the searches in a burst')
+    parser.add_argument('--latency', type=float, default=0.05, help='Seconds added to every fake Web API response')
+    args = parser.parse_args(argv)
+    logging.getLogger('accessify').addHandler(logging.NullHandler())
+
+    server = FakeWebAPIServer(latency=args.latency)
+    server.start()
+    router = library.LibraryRouter.start(1, library.LibrarySignalman(), {}, create_client(server))
+    searcher = router.ordered('search box')
+    try:
+        results = {
+            'options': vars(args),
+            'without_tokens': run_bursts(searcher, args.bursts, args.burst_size, args.interval, use_tokens=False),
+            'with_tokens': run_bursts(searcher, args.bursts, args.burst_size, args.interval, use_tokens=True),
+        }
+        results['with_tokens']['superseded'] = superseded_counts()
+    finally:
+        router.stop()
+        server.stop()
+    json.dump(results, sys.stdout, indent=4)
+    sys.stdout.write('\n')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,35 @@
+import statistics
+import time
+
+
+def time_calls(func, iterations, *args, **kwargs):
+    samples = []
+    for i in range(iterations):
+        started = time.perf_counter()
+        func(*args, **kwargs)
+        samples.append(time.perf_counter() - started)
+    return samples
+
+
+def percentile(sorted_samples, fraction):
+    if not sorted_samples:
+        return None
+    index = min(len(sorted_samples) - 1, int(round(fraction * (len(sorted_samples) - 1))))
+    return sorted_samples[index]
+
+
+def summarise(samples):
+    """
+    Summarise a list of durations in seconds as milliseconds.
+    """
+    ordered = sorted(samples)
+    if not ordered:
+        return {'count': 0}
+    return {
+        'count': len(ordered),
+        'mean_ms': statistics.mean(ordered) * 1000,
+        'p50_ms': percentile(ordered, 0.5) * 1000,
+        'p95_ms': percentile(ordered, 0.95) * 1000,
+        'p99_ms': percentile(ordered, 0.99) * 1000,
+        'max_ms': ordered[-1] * 1000,
+    }
@@ -0,0 +1,131 @@
+"""
+Measure bulk imports of Spotify URIs and links with URIResolver.
+
+A seeded list of --uris lines is generated, mixing spotify: URIs, open.spotify.com links with locales and query strings, and older user playlist URIs, with some duplicates, invalid URIs and IDs which don't exist.  Parsing alone is timed first, then resolving against a FakeWebAPIServer with added latency at each of --concurrency, against looking up --baseline-sample tracks one request at a time.  The resolved items are checked to come back in the order given, and adding them to a PlaybackQueue is timed.
+
+    python -m benchmarks.uri_import --uris 10000 --latency 0.05
+"""
+
+import argparse
+import logging
+import random
+import sys
+import time
+
+import ujson as json
+
+from accessify import library
+from accessify.playback_queue import PlaybackQueue
+from accessify.spotify.utils import split_uri
+from accessify.uri_import import URIResolver, URIScanner
+
+from benchmarks.fake_webapi import FakeWebAPIServer, make_id
+from benchmarks.webapi import create_client
+
+
+CATALOGUE_SIZE = 10000
+FORMATS = (
+    'spotify:{kind}:{id}',
+    'https://open.spotify.com/{kind}/{id}',
+    'https://open.spotify.com/intl-de/{kind}/{id}?si=0123456789abcdef',
+    'open.spotify.com/{kind}/{id}',
+)
+
+
+def generate_lines(count, seed):
+    """
+    Return the lines and the (kind, ID) of each distinct valid URI in them, in order.
+    """
+    generator = random.Random(seed)
+    lines = []
+    expected = []
+    seen = set()
+    for line in range(count):
+        roll = generator.random()
+        if roll < 0.1 and expected:
+            kind, item_id = generator.choice(expected)
+            lines.append('spotify:{0}:{1}'.format(kind, item_id))
+            continue
+        if roll < 0.13:
+            lines.append(generator.choice(['spotify:track:tooshort', 'https://open.spotify.com/show/{0}'.format(make_id(line)), 'spotify:']))
+            continue
+        # Just beyond the catalogue, so the lookup comes back null
+        index = CATALOGUE_SIZE + line if roll < 0.15 else generator.randrange(CATALOGUE_SIZE)
+        kind = 'track' if roll < 0.9 else generator.choice(['album', 'playlist'])
+        item_id = make_id(index)
+        if (kind, item_id) in seen:
+            continue
+        seen.add((kind, item_id))
+        if kind == 'playlist' and generator.random() < 0.5:
+            lines.append('spotify:user:someone:playlist:{0}'.format(item_id))
+        else:
+            lines.append(generator.choice(FORMATS).format(kind=kind, id=item_id))
+        expected.append((kind, item_id))
+    return lines, expected
+
+
+def parse_only(lines):
+    scanner = URIScanner()
+    started = time.perf_counter()
+    uris = sum(1 for uri in scanner.scan(lines))
+    seconds = time.perf_counter() - started
+    return {'seconds': seconds, 'uris_per_second': scanner.candidates / seconds, 'unique': uris, 'duplicates': scanner.duplicates, 'rejected': len(scanner.rejected)}
+
+
+def one_request_per_track(server, client, expected, sample):
+    track_ids = [item_id for kind, item_id in expected if kind == 'track'][:sample]
+    requests_before = server.stats['requests']
+    started = time.perf_counter()
+    for track_id in track_ids:
+        client.tracks([track_id])
+    seconds = time.perf_counter() - started
+    return {'tracks': len(track_ids), 'seconds': seconds, 'uris_per_second': len(track_ids) / seconds, 'requests': server.stats['requests'] - requests_before}
+
+
+def batched(server, client, lines, expected, concurrency):
+    requests_before = server.stats['requests']
+    result = URIResolver(client, library.IMPORT_LOOKUPS, concurrency=concurrency).resolve(lines)
+    found = [(kind, item_id) for kind, item_id in expected if int(item_id[len('fake'):]) < CATALOGUE_SIZE]
+    return result, {
+        'seconds': result.seconds,
+        'uris_per_second': result.uris_per_second,
+        'resolved': len(result.items),
+        'unresolved': len(result.unresolved),
+        'rejected': len(result.rejected),
+        'duplicates': result.duplicates,
+        'requests': server.stats['requests'] - requests_before,
+        'in_order': [split_uri(item.uri) for item in result.items] == found,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--uris', type=int, default=10000, help='Lines of input')
+    parser.add_argument('--latency', type=float, default=0.05, help='Seconds added to every fake Web API response')
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 4])
+    parser.add_argument('--baseline-sample', type=int, default=200, help='Tracks looked up one request at a time for comparison')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args(argv)
+    logging.getLogger('accessify').addHandler(logging.NullHandler())
+
+    lines, expected = generate_lines(args.uris, args.seed)
+    results = {'options': vars(args), 'parse_only': parse_only(lines), 'resolve': {}}
+    server = FakeWebAPIServer(latency=args.latency, size=CATALOGUE_SIZE)
+    server.start()
+    try:
+        client = create_client(server)
+        results['resolve']['one_request_per_track'] = one_request_per_track(server, client, expected, args.baseline_sample)
+        for concurrency in args.concurrency:
+            result, results['resolve']['concurrency_{0}'.format(concurrency)] = batched(server, client, lines, expected, concurrency)
+    finally:
+        server.stop()
+    queue = PlaybackQueue()
+    started = time.perf_counter()
+    queue.extend(result.items)
+    results['queue'] = {'items': len(queue), 'ms': (time.perf_counter() - started) * 1000}
+    json.dump(results, sys.stdout, indent=4)
+    sys.stdout.write('\n')
+
+
+if __name__ == '__main__':
+    main()
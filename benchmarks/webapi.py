@@ -0,0 +1,280 @@
+"""
+Benchmark WebAPIClient and LibraryController against a local FakeWebAPIServer.
+
+Measures search latency, the cost of deserializing results into structures, the overhead of refreshing expired access tokens, the throughput of paging through saved tracks and playlists and how much a fields filter saves on playlist pages.  Results are written as JSON along with the options used, so that runs can be compared:
+
+    python -m benchmarks.webapi --output before.json
+    python -m benchmarks.webapi --output after.json --compare before.json
+"""
+
+import argparse
+import logging
+import platform
+import sys
+import time
+
+import requests
+import ujson as json
+
+from accessify import library
+from accessify.library import LibraryController, SearchType
+from accessify.spotify.webapi import AuthorisationAgent, WebAPIClient
+from accessify.spotify.webapi import exceptions
+from accessify.spotify.webapi.cache import ResponseCache
+from accessify.spotify.webapi.fields import format_fields
+
+from benchmarks.fake_webapi import DEFAULT_CATALOGUE_SIZE, DEFAULT_LIBRARY_SIZE, DEFAULT_MARKET_COUNT, DEFAULT_PLAYLIST_SIZE, FakeWebAPIServer, FaultInjector, make_id
+from benchmarks.timing import summarise, time_calls
+
+
+SEARCH_QUERIES = ['beatles', 'radiohead', 'miles davis', 'daft punk', 'bach', 'nina simone', 'aphex twin', 'fleetwood mac']
+
+
+def create_client(server):
+    authorisation = AuthorisationAgent('client-id', 'client-secret', access_token=server.access_token, refresh_token='fake-refresh-token', token_url=server.token_url)
+    return WebAPIClient(authorisation, base_url=server.base_url)
+
+
+def cycle(values):
+    position = 0
+    def next_value():
+        nonlocal position
+        position += 1
+        return values[position % len(values)]
+    return next_value
+
+
+def benchmark_search(server, iterations):
+    client = create_client(server)
+    # Calling perform_search on an actor which hasn't been started keeps pykka's messaging out of the measurement
+    controller = LibraryController(None, {}, client)
+    results = {}
+    for search_type in SearchType:
+        query = cycle(SEARCH_QUERIES)
+        results[search_type.value] = {
+            'client': summarise(time_calls(lambda: client.search(query(), search_type.value), iterations)),
+            'controller': summarise(time_calls(lambda: controller.perform_search(query(), search_type, offset=0), iterations)),
+        }
+    return results
+
+
+def benchmark_deserialization(server, iterations):
+    results = {}
+    for search_type in SearchType:
+        container = library.item_containers[search_type]
+        deserializer = library.item_deserializers[search_type]
+        response = requests.get('{0}/v1/search'.format(server.base_url), params={'q': 'deserialization', 'type': search_type.value, 'limit': 50}, headers={'Authorization': 'Bearer {0}'.format(server.access_token)})
+        content = response.content
+        items = json.loads(content)[container]['items']
+        parse = summarise(time_calls(json.loads, iterations, content))
+        deserialize = summarise(time_calls(lambda: [deserializer(item) for item in items], iterations))
+        results[search_type.value] = {
+            'response_bytes': len(content),
+            'items': len(items),
+            'parse': parse,
+            'deserialize': deserialize,
+            'parse_us_per_item': parse['mean_ms'] * 1000 / len(items),
+            'deserialize_us_per_item': deserialize['mean_ms'] * 1000 / len(items),
+        }
+    return results
+
+
+def benchmark_token_refresh(iterations, latency, token_lifetime):
+    results = {}
+    for label, lifetime in (('valid_token', 0), ('expiring_token', token_lifetime)):
+        server = FakeWebAPIServer(faults=FaultInjector(latency=latency, token_lifetime=lifetime)).start()
+        try:
+            client = create_client(server)
+            started = time.perf_counter()
+            samples = time_calls(client.me, iterations)
+            elapsed = time.perf_counter() - started
+            results[label] = dict(summarise(samples), requests_per_second=iterations / elapsed, **server.stats)
+        finally:
+            server.stop()
+    results['overhead_ms_per_request'] = results['expiring_token']['mean_ms'] - results['valid_token']['mean_ms']
+    return results
+
+
+def benchmark_paging(server):
+    client = create_client(server)
+    results = {}
+    pages = {
+        'saved_tracks': ('me/tracks', 50),
+        'playlist_tracks': ('playlists/{0}/tracks'.format(make_id(1)), 100),
+    }
+    for label, (endpoint, limit) in pages.items():
+        started = time.perf_counter()
+        offset = 0
+        items = 0
+        request_count = 0
+        while True:
+            page = client.request(endpoint, query_parameters={'offset': offset, 'limit': limit})
+            request_count += 1
+            items += len([library.deserialize_track(item['track']) for item in page['items']])
+            if page['next'] is None:
+                break
+            offset += limit
+        elapsed = time.perf_counter() - started
+        results[label] = {
+            'items': items,
+            'requests': request_count,
+            'seconds': elapsed,
+            'items_per_second': items / elapsed,
+        }
+    return results
+
+
+def benchmark_revalidation(server):
+    """
+    Page through a playlist twice, as when revisiting it, with and without the ETag cache.
+    """
+    endpoint = 'playlists/{0}/tracks'.format(make_id(2))
+    results = {}
+    for label, cache in (('uncached', ResponseCache(max_entries=0)), ('etag_cache', ResponseCache())):
+        client = create_client(server)
+        client.cache = cache
+        passes = []
+        for visit in range(2):
+            bytes_before, not_modified_before = server.stats['bytes_sent'], server.stats['not_modified']
+            started = time.perf_counter()
+            offset = 0
+            while True:
+                page = client.request(endpoint, query_parameters={'offset': offset, 'limit': 100})
+                if page['next'] is None:
+                    break
+                offset += 100
+            passes.append({
+                'seconds': time.perf_counter() - started,
+                'bytes_downloaded': server.stats['bytes_sent'] - bytes_before,
+                'not_modified': server.stats['not_modified'] - not_modified_before,
+            })
+        results[label] = {'first_visit': passes[0], 'revisit': passes[1]}
+    return results
+
+
+def benchmark_projection(server, iterations):
+    """
+    Page through a playlist with full objects and with only the fields the deserializers read, and compare the bytes and parse time of a page.
+    """
+    playlist_id = make_id(3)
+    results = {}
+    for label, fields in (('full', None), ('projected', library.PLAYLIST_TRACKS_PAGE_FIELDS)):
+        parameters = {'limit': 100}
+        if fields is not None:
+            parameters['fields'] = format_fields(fields)
+        response = requests.get('{0}/v1/playlists/{1}/tracks'.format(server.base_url, playlist_id), params=parameters, headers={'Authorization': 'Bearer {0}'.format(server.access_token)})
+        content = response.content
+        client = create_client(server)
+        client.cache = ResponseCache(max_entries=0)
+        bytes_before = server.stats['bytes_sent']
+        started = time.perf_counter()
+        offset = 0
+        items = 0
+        while True:
+            page = client.playlist_tracks(playlist_id, offset=offset, fields=fields)
+            items += len([library.deserialize_track(item['track']) for item in page['items']])
+            if page['next'] is None:
+                break
+            offset += 100
+        elapsed = time.perf_counter() - started
+        results[label] = {
+            'page_bytes': len(content),
+            'parse_page': summarise(time_calls(json.loads, iterations, content)),
+            'items': items,
+            'seconds': elapsed,
+            'bytes_downloaded': server.stats['bytes_sent'] - bytes_before,
+        }
+    results['bytes_ratio'] = results['projected']['page_bytes'] / results['full']['page_bytes']
+    results['parse_ratio'] = results['projected']['parse_page']['mean_ms'] / results['full']['parse_page']['mean_ms']
+    return results
+
+
+def benchmark_rate_limiting(iterations, latency, rate_limit_every):
+    server = FakeWebAPIServer(faults=FaultInjector(latency=latency, rate_limit_every=rate_limit_every)).start()
+    try:
+        client = create_client(server)
+        errors = 0
+        for iteration in range(iterations):
+            try:
+                client.search(SEARCH_QUERIES[iteration % len(SEARCH_QUERIES)], 'track')
+            except exceptions.APIError:
+                errors += 1
+        return dict(server.stats, failed_calls=errors, failure_rate=errors / iterations)
+    finally:
+        server.stop()
+
+
+def run(args):
+    faults = FaultInjector(latency=args.latency, jitter=args.jitter)
+    server = FakeWebAPIServer(faults=faults, size=args.catalogue_size, library_size=args.library_size, playlist_size=args.playlist_size, market_count=args.market_count).start()
+    try:
+        results = {
+            'search': benchmark_search(server, args.iterations),
+            'deserialization': benchmark_deserialization(server, args.iterations),
+            'paging': benchmark_paging(server),
+            'revalidation': benchmark_revalidation(server),
+            'projection': benchmark_projection(server, args.iterations),
+        }
+    finally:
+        server.stop()
+    results['token_refresh'] = benchmark_token_refresh(args.iterations, args.latency, args.token_lifetime)
+    results['rate_limiting'] = benchmark_rate_limiting(args.iterations, args.latency, args.rate_limit_every)
+    return results
+
+
+def metadata(args):
+    return {
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'options': vars(args),
+    }
+
+
+def compare(previous, current, path=()):
+    """
+    Return {dotted.path: (previous, current, ratio)} for every number present in both sets of results.
+    """
+    differences = {}
+    for key, value in current.items():
+        if key not in previous:
+            continue
+        if isinstance(value, dict) and isinstance(previous[key], dict):
+            differences.update(compare(previous[key], value, path + (key,)))
+        elif isinstance(value, (int, float)) and isinstance(previous[key], (int, float)) and not isinstance(value, bool):
+            ratio = value / previous[key] if previous[key] else None
+            differences['.'.join(path + (key,))] = (previous[key], value, ratio)
+    return differences
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--iterations', type=int, default=50)
+    parser.add_argument('--latency', type=float, default=0, help='Simulated server latency in seconds')
+    parser.add_argument('--jitter', type=float, default=0, help='Maximum random latency in seconds added on top of --latency')
+    parser.add_argument('--catalogue-size', type=int, default=DEFAULT_CATALOGUE_SIZE)
+    parser.add_argument('--library-size', type=int, default=DEFAULT_LIBRARY_SIZE)
+    parser.add_argument('--playlist-size', type=int, default=DEFAULT_PLAYLIST_SIZE)
+    parser.add_argument('--market-count', type=int, default=DEFAULT_MARKET_COUNT, help='Number of available_markets on each album and track, which dominates payload size')
+    parser.add_argument('--token-lifetime', type=int, default=10, help='Requests an access token lasts for in the token refresh benchmark')
+    parser.add_argument('--rate-limit-every', type=int, default=10, help='Fail every nth request with a 429 in the rate limiting benchmark')
+    parser.add_argument('--output', help='File to save the results to as JSON')
+    parser.add_argument('--compare', help='Results from a previous run to compare against')
+    args = parser.parse_args(argv)
+    # The injected 429s would otherwise have their tracebacks printed to stderr
+    logging.getLogger('accessify').addHandler(logging.NullHandler())
+
+    results = {'metadata': metadata(args), 'results': run(args)}
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            previous = json.load(f)
+        results['comparison'] = compare(previous['results'], results['results'])
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=4)
+    json.dump(results, sys.stdout, indent=4)
+    sys.stdout.write('\n')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,121 @@
+"""
+Measure how many requests WriteBehindQueue saves when the library is changed a keypress at a time.
+
+A seeded stream of --changes saves and unsaves, spread over --tracks tracks with --interval seconds between them, is sent to a FakeWebAPIServer once as one request per change and once through a WriteBehindQueue whose LibraryMembership has been synced.  The saved tracks are checked to end up the same both ways.  A simulated crash, where the queue is abandoned with changes waiting and a new one is created from the same file, checks that nothing is lost.
+
+    python -m benchmarks.write_behind --changes 500 --tracks 40
+"""
+
+import argparse
+import logging
+import os
+import random
+import sys
+import tempfile
+import time
+
+import ujson as json
+
+from accessify import writes
+from accessify.membership import LibraryMembership
+
+from benchmarks.fake_webapi import FakeWebAPIServer, make_id
+from benchmarks.webapi import create_client
+
+
+FIRST_TRACK = 9000
+
+
+def change_stream(changes, tracks, seed):
+    generator = random.Random(seed)
+    return [('spotify:track:{0}'.format(make_id(FIRST_TRACK + generator.randrange(tracks))), generator.random() < 0.6) for change in range(changes)]
+
+
+def saved_tracks(server, tracks):
+    saved = server.catalogue.saved['track']
+    return sorted(index for index in saved if FIRST_TRACK <= index < FIRST_TRACK + tracks)
+
+
+def reset(server, tracks):
+    for index in range(FIRST_TRACK, FIRST_TRACK + tracks):
+        server.catalogue.saved['track'].pop(index, None)
+
+
+def one_request_per_change(server, client, stream):
+    requests_before = server.stats['requests']
+    started = time.perf_counter()
+    for uri, saved in stream:
+        track_id = uri.rsplit(':', 1)[1]
+        if saved:
+            client.save_tracks([track_id])
+        else:
+            client.remove_saved_tracks([track_id])
+    return {'seconds': time.perf_counter() - started, 'requests': server.stats['requests'] - requests_before}
+
+
+def synced_membership(client):
+    membership = LibraryMembership(client)
+    membership.sync(['track'])
+    return membership
+
+
+def through_queue(server, client, stream, interval, flush_interval):
+    queue = writes.WriteBehindQueue(writes.BatchWriter(client, membership=synced_membership(client)), flush_interval=flush_interval)
+    queue.start()
+    requests_before = server.stats['requests']
+    started = time.perf_counter()
+    for uri, saved in stream:
+        (queue.save if saved else queue.remove)([uri])
+        time.sleep(interval)
+    queue.stop()
+    queue.writer.stop()
+    return dict(queue.statistics(), seconds=time.perf_counter() - started, server_requests=server.stats['requests'] - requests_before)
+
+
+def crash_recovery(server, client, stream):
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, writes.PENDING_WRITES_FILENAME)
+        # Never started or stopped, as if the process died before the changes were flushed
+        abandoned = writes.WriteBehindQueue(writes.BatchWriter(client, membership=synced_membership(client)), path)
+        for uri, saved in stream:
+            (abandoned.save if saved else abandoned.remove)([uri])
+        recovered = writes.WriteBehindQueue(writes.BatchWriter(client), path)
+        waiting = len(recovered)
+        recovered.flush()
+        return {'recovered_changes': waiting, 'pending_after_flush': len(recovered)}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--changes', type=int, default=500)
+    parser.add_argument('--tracks', type=int, default=40, help='Distinct tracks the changes are spread over')
+    parser.add_argument('--interval', type=float, default=0.005, help='Seconds between changes')
+    parser.add_argument('--flush-interval', type=float, default=0.5)
+    parser.add_argument('--latency', type=float, default=0.02, help='Seconds added to every fake Web API response')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args(argv)
+    logging.getLogger('accessify').addHandler(logging.NullHandler())
+
+    stream = change_stream(args.changes, args.tracks, args.seed)
+    server = FakeWebAPIServer(latency=args.latency)
+    server.start()
+    try:
+        client = create_client(server)
+        results = {'options': vars(args)}
+        reset(server, args.tracks)
+        results['one_request_per_change'] = one_request_per_change(server, client, stream)
+        expected = saved_tracks(server, args.tracks)
+        reset(server, args.tracks)
+        results['write_behind_queue'] = through_queue(server, client, stream, args.interval, args.flush_interval)
+        results['write_behind_queue']['same_saved_tracks'] = saved_tracks(server, args.tracks) == expected
+        reset(server, args.tracks)
+        results['crash_recovery'] = crash_recovery(server, client, stream)
+        results['crash_recovery']['same_saved_tracks'] = saved_tracks(server, args.tracks) == expected
+    finally:
+        server.stop()
+    json.dump(results, sys.stdout, indent=4)
+    sys.stdout.write('\n')
+
+
+if __name__ == '__main__':
+    main()
@@ -12,7 +12,7 @@ data_files = []
 tolk_data_files = [(path, '.') for path in glob.glob(os.path.join(os.path.dirname(tolk.__file__), '*.dll'))]
 data_files.extend(tolk_data_files)
 
-a = Analysis(['..\\accessify\\main.py'],
+a = Analysis(['..\\accessify\\cli.py'],
              pathex=['build'],
              binaries=[],
              datas=data_files,
@@ -10,7 +10,8 @@ setup(
     packages=['accessify'],
     entry_points={
         'console_scripts':[
-            'accessify = accessify.main:main'
+            'accessify = accessify.cli:main',
+            'accessify-daemon = accessify.daemon:main',
         ]
     }
 )